@@ -0,0 +1,198 @@
+"""Harness for the benchmark suite, see `src/benchmarks/suite.py`.
+
+Every benchmark runs in a fresh spawned process, so that the peak resident set size (RSS) it reports is its own and
+no MediaPipe graph or decoded frame of a previous benchmark is still around.
+"""
+
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, where the peak RSS is not reported
+    resource = None
+
+
+def peakRssMb():
+    """Returns the peak resident set size of the current process in MiB, or None when it cannot be measured"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kibibytes everywhere else
+    return peak / 1024**2 if sys.platform == "darwin" else peak / 1024
+
+
+def syntheticFrames(width: int, height: int, count: int, seed=0) -> list:
+    """Generates `count` reproducible BGR frames of a noisy background with shapes moving across it"""
+    rng = np.random.default_rng(seed)
+    background = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    shapes = [
+        (rng.uniform(0, 1, 2), rng.uniform(-0.02, 0.02, 2), int(rng.integers(10, max(11, min(width, height) // 6))))
+        for _ in range(6)
+    ]
+    colors = rng.integers(0, 256, (len(shapes), 3)).tolist()
+
+    frames = []
+    for ind in range(count):
+        frame = background.copy()
+        for (start, velocity, radius), color in zip(shapes, colors):
+            x, y = np.mod(start + velocity * ind, 1) * (width, height)
+            cv2.circle(frame, (int(x), int(y)), radius, color, cv2.FILLED)
+        frames.append(frame)
+    return frames
+
+
+def loadFrames(source: dict) -> list:
+    """Loads the frames described by `source`, which is either
+    `{"synthetic": [width, height], "frames": count}`, or `{"path": ..., "frames": count}` for an image, which is
+    repeated, or a video, of which the first frames are read.
+    """
+    count = source["frames"]
+    if "synthetic" in source:
+        width, height = source["synthetic"]
+        return syntheticFrames(width, height, count, source.get("seed", 0))
+
+    # imported here as utils pulls in ffmpeg, which the synthetic benchmarks do not need
+    from src.modules.utils import VideoReader, checkFileType
+
+    if checkFileType(source["path"]) == "image":
+        img = cv2.imread(source["path"])
+        if img is None:
+            raise IOError(f"Could not read {source['path']}")
+        return [img.copy() for _ in range(count)]
+
+    frames = []
+    with VideoReader(source["path"]) as reader:
+        for frame in reader:
+            frames.append(frame)
+            if len(frames) == count:
+                break
+    return frames
+
+
+def summarise(latencies: list, seconds: float) -> dict:
+    """Summarises per-frame `latencies` (in seconds) of a run that took `seconds` in total"""
+    latencies = np.asarray(latencies) * 1000
+    return {
+        "frames": len(latencies),
+        "seconds": seconds,
+        "fps": len(latencies) / seconds if seconds else None,
+        "meanMs": float(latencies.mean()) if len(latencies) else None,
+        "p50Ms": float(np.percentile(latencies, 50)) if len(latencies) else None,
+        "p95Ms": float(np.percentile(latencies, 95)) if len(latencies) else None,
+        "p99Ms": float(np.percentile(latencies, 99)) if len(latencies) else None,
+    }
+
+
+def timeEach(items):
+    """Wraps `items` in a generator recording how long producing each item took, including the work done by the
+    consumer on the previous one.
+
+    Returns:
+        tuple: `(generator, latencies)` where `latencies` fills up as the generator is consumed
+    """
+    latencies = []
+
+    def generate():
+        previous = time.perf_counter()
+        for item in items:
+            now = time.perf_counter()
+            latencies.append(now - previous)
+            previous = now
+            yield item
+        if latencies:
+            # the consumer asks for the next item once done with the last one
+            latencies[-1] += time.perf_counter() - previous
+
+    generator = generate()
+    return generator, latencies
+
+
+def _runInProcess(function, source: dict, options: dict) -> dict:
+    # the frames are loaded before the clock starts, but they do count towards the peak RSS
+    frames = loadFrames(source) if source else None
+    start = time.perf_counter()
+    latencies = function(frames, **options)
+    totalSeconds = time.perf_counter() - start
+    if isinstance(latencies, dict):
+        # benchmarks which are not per frame, such as the cold start ones, report their own timings
+        return {**latencies, "totalSeconds": totalSeconds, "peakRssMb": peakRssMb()}
+    # throughput only counts the measured frames, leaving out set up such as building the MediaPipe graphs
+    return {**summarise(latencies, float(np.sum(latencies))), "totalSeconds": totalSeconds, "peakRssMb": peakRssMb()}
+
+
+def runIsolated(function, source: dict = None, **options) -> dict:
+    """Runs `function(frames, **options)` in a fresh process, where `frames` are loaded from `source`.
+
+    `function` must be importable from a module, and return the latency of every frame in seconds,
+    or a dictionary of its own timings.
+    """
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(1, mp_context=context) as pool:
+        return pool.submit(_runInProcess, function, source, options).result()
+
+
+def environment() -> dict:
+    """Describes the machine and library versions the results were measured with"""
+    import mediapipe as mp
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpus": os.cpu_count(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "mediapipe": getattr(mp, "__version__", None),
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance=0.15) -> list:
+    """Compares the results of a run with a baseline run, both as written by `writeResults`.
+
+    A benchmark regressed when its throughput or landmark agreement dropped, or its p95 latency, peak RSS, import time,
+    time to the first result or landmark error grew, by more than `tolerance`.
+
+    Returns:
+        list: `(benchmark, metric, baseline, current)` tuples of every regression
+    """
+    regressions = []
+    for name, current in results["benchmarks"].items():
+        previous = baseline["benchmarks"].get(name)
+        if previous is None:
+            continue
+        for metric, higherIsBetter in (
+            ("fps", True),
+            ("p95Ms", False),
+            ("peakRssMb", False),
+            ("importMs", False),
+            ("firstResultMs", False),
+            ("errorPx", False),
+            ("agreement", True),
+        ):
+            old, new = previous.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (higherIsBetter and change < -tolerance) or (not higherIsBetter and change > tolerance):
+                regressions.append((name, metric, old, new))
+    return regressions
+
+
+def writeResults(filename: str, results: dict):
+    os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+    with open(filename, "w") as file:
+        json.dump(results, file, indent=2)
+
+
+def readResults(filename: str) -> dict:
+    with open(filename) as file:
+        return json.load(file)
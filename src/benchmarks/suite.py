@@ -0,0 +1,392 @@
+"""Benchmarks every detector and the offline pipelines over the bundled assets, or over synthetic frames.
+
+Reports the throughput, the p50/p95/p99 latency per frame and the peak RSS of each benchmark, writes them to a JSON
+file and compares them with a baseline run, exiting with a non-zero status when anything regressed.
+
+Usage:
+```
+python -m src.benchmarks.suite                         # compare with out/benchmarks/baseline.json if it exists
+python -m src.benchmarks.suite --save-baseline         # record the baseline
+python -m src.benchmarks.suite --synthetic 1920x1080   # synthetic frames at any resolution instead of the assets
+python -m src.benchmarks.suite --only PoseDetector --frames 120
+python -m src.benchmarks.suite --only coldStart       # import time and time to the first result of each detector
+```
+"""
+
+import argparse
+import importlib
+import os
+import subprocess
+import sys
+import time
+from itertools import islice
+from src.benchmarks.benchmark import (
+    compare,
+    environment,
+    readResults,
+    runIsolated,
+    summarise,
+    timeEach,
+    writeResults,
+)
+from termcolor import colored
+
+WARMUP_FRAMES = 3
+# the directory `src` is imported from, for the fresh interpreters of `timeImport`
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+DEFAULT_OUTPUT = os.path.join("out", "benchmarks", "results.json")
+DEFAULT_BASELINE = os.path.join("out", "benchmarks", "baseline.json")
+
+# detector => parameter sets to benchmark and the assets to run them over
+DETECTORS = {
+    "HandDetector": ([{}], ["assets/hand0.jpg", "assets/chain punch.mp4"]),
+    "PoseDetector": (
+        [{"modelComplexity": 0}, {"modelComplexity": 1}, {"modelComplexity": 2}],
+        ["assets/maLong0.jpg", "assets/ben0.mp4"],
+    ),
+    "FaceDetector": (
+        [{"model_selection": 0}, {"model_selection": 1}],
+        ["assets/techPeople0.jpg", "assets/IpMan4Faces0.mp4"],
+    ),
+    "FaceMeshDetector": ([{}], ["assets/techPeople0.jpg", "assets/IpMan4Faces0.mp4"]),
+}
+PIPELINE_ASSET = "assets/ben0.mp4"
+# `(backend, frameShape)` of the decoders compared by the decodeForInference benchmarks
+DECODE_BACKENDS = [("opencv", None), ("ffmpeg", None), ("opencv", [640, None]), ("ffmpeg", [640, None])]
+# inference resolutions compared by the inferenceResolution benchmarks, against landmarks found at full resolution
+INFERENCE_RESOLUTIONS = [{}, {"inferenceMaxSide": 960}, {"inferenceMaxSide": 640}, {"inferenceMaxSide": 320}]
+DETECTOR_MODULES = {
+    "HandDetector": "src.modules.handTracking",
+    "PoseDetector": "src.modules.poseEstimation",
+    "FaceDetector": "src.modules.faceDetection",
+    "FaceMeshDetector": "src.modules.faceMesh",
+}
+
+
+def createDetector(name: str, params: dict):
+    # imported in the benchmark process only, so that the parent never loads MediaPipe graphs
+    return getattr(importlib.import_module(DETECTOR_MODULES[name]), name)(**params)
+
+
+def benchmarkDetector(frames: list, detector: str, params: dict) -> list:
+    """Times `find` on every frame"""
+    detectorInstance = createDetector(detector, params)
+    for frame in frames[:WARMUP_FRAMES]:
+        detectorInstance.find(frame.copy(), False)
+    detectorInstance.reset()
+
+    latencies = []
+    for frame in frames:
+        start = time.perf_counter()
+        detectorInstance.find(frame, False)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def _pixelPoints(points, detectorInstance, imageShape):
+    """Returns the `(..., 2)` pixels of normalised landmarks, or of the corners of normalised face boxes"""
+    import numpy as np
+
+    if type(detectorInstance).__name__ == "FaceDetector":
+        points = np.concatenate([points[:, None, :2], points[:, None, :2] + points[:, None, 2:4]], axis=1)
+    imageH, imageW = imageShape[:2]
+    return points[..., :2] * (imageW, imageH)
+
+
+def benchmarkInferenceResolution(frames: list, detector: str, params: dict) -> dict:
+    """Times `find` at the inference resolution set in `params`, and measures how far its landmarks land from those
+    found at full resolution: the mean and p95 distance in pixels of the original frames, and the share of frames
+    where both found as many hands, faces or poses
+    """
+    import numpy as np
+    from src.modules.subsampling import isEmpty, matchOrder
+
+    referenceParams = {key: value for key, value in params.items() if not key.startswith("inference")}
+    reference = createDetector(detector, referenceParams)
+    expected = [reference.find(frame, False, asArray=True, normalised=True)[1] for frame in frames]
+    reference.close()
+
+    detectorInstance = createDetector(detector, params)
+    for frame in frames[:WARMUP_FRAMES]:
+        detectorInstance.find(frame, False)
+    detectorInstance.reset()
+
+    latencies, found = [], []
+    for frame in frames:
+        start = time.perf_counter()
+        _, points = detectorInstance.find(frame, False, asArray=True, normalised=True)
+        latencies.append(time.perf_counter() - start)
+        found.append(points)
+
+    errors, agreed = [], 0
+    for frame, pointsA, pointsB in zip(frames, expected, found):
+        if isEmpty(pointsA) != isEmpty(pointsB) or pointsA.shape != pointsB.shape:
+            continue
+        agreed += 1
+        if isEmpty(pointsA):
+            continue
+        if detectorInstance.multipleResults:
+            pointsB = matchOrder(pointsA, pointsB)
+        pixelsA, pixelsB = (_pixelPoints(points, detectorInstance, frame.shape) for points in (pointsA, pointsB))
+        distances = np.linalg.norm(pixelsA - pixelsB, axis=-1).ravel()
+        errors.extend(distances[~np.isnan(distances)].tolist())
+
+    return {
+        **summarise(latencies, float(np.sum(latencies))),
+        "errorPx": float(np.mean(errors)) if errors else None,
+        "p95ErrorPx": float(np.percentile(errors, 95)) if errors else None,
+        "agreement": agreed / len(frames) if frames else None,
+    }
+
+
+def timeImport(module: str) -> float:
+    """Returns the seconds a fresh interpreter takes to import `module`, along with everything it imports in turn"""
+    code = f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+    process = subprocess.run([sys.executable, "-c", code], cwd=PROJECT_ROOT, capture_output=True, text=True, check=True)
+    return float(process.stdout.strip().splitlines()[-1])
+
+
+def benchmarkColdStart(frames: list, detector: str, params: dict) -> dict:
+    """Times what a fresh worker pays before its first result: importing the detector module, creating the detector,
+    warming its graph up and processing the first frame.
+    The import is timed in an interpreter of its own, as this process already imported OpenCV and NumPy to load the
+    frames.
+    """
+    importSeconds = timeImport(DETECTOR_MODULES[detector])
+    module = importlib.import_module(DETECTOR_MODULES[detector])
+    imported = time.perf_counter()
+    detectorInstance = getattr(module, detector)(**params)
+    created = time.perf_counter()
+    detectorInstance.warmup((frames[0].shape[1], frames[0].shape[0]))
+    warmedUp = time.perf_counter()
+    detectorInstance.find(frames[0], False)
+    firstResult = time.perf_counter()
+
+    return {
+        "importMs": importSeconds * 1000,
+        "createMs": (created - imported) * 1000,
+        "warmupMs": (warmedUp - created) * 1000,
+        "firstFrameMs": (firstResult - warmedUp) * 1000,
+        "firstResultMs": (importSeconds + firstResult - imported) * 1000,
+    }
+
+
+def _writeTemporaryVideo(frames: list) -> str:
+    import tempfile
+    from src.modules.utils import VideoWriter
+
+    filename = os.path.join(tempfile.mkdtemp(), "synthetic.mp4")
+    frameShape = (frames[0].shape[1], frames[0].shape[0])
+    with VideoWriter(filename, frameShape, 30) as writer:
+        for frame in frames:
+            writer.write(frame)
+    return filename
+
+
+def benchmarkReadVideo(frames: list, path: str = None, count: int = None) -> list:
+    """Times decoding each frame, the way `readVideo` does. Synthetic `frames` are encoded to a temporary file first."""
+    from src.modules.utils import VideoReader
+
+    if path is None:
+        path, count = _writeTemporaryVideo(frames), len(frames)
+    with VideoReader(path) as reader:
+        timedFrames, latencies = timeEach(islice(reader, count))
+        for _ in timedFrames:
+            pass
+    return latencies
+
+
+def benchmarkDecodeForInference(
+    frames: list, path: str = None, count: int = None, backend="opencv", frameShape=None
+) -> list:
+    """Times getting each frame ready for a graph: decoding with `cv2.VideoCapture` then converting to RGB, or
+    decoding straight to RGB with `FfmpegReader`, optionally at a `(frameWidth, frameHeight)` inference resolution
+    """
+    import cv2
+    from src.modules.utils import FfmpegReader, VideoReader, scaledShape
+
+    if path is None:
+        path, count = _writeTemporaryVideo(frames), len(frames)
+    if backend == "ffmpeg":
+        reader = FfmpegReader(path, frameShape)
+        ready = iter(reader)
+    else:
+        reader = VideoReader(path)
+        size = frameShape and scaledShape((reader.frameWidth, reader.frameHeight), frameShape)
+        resized = (cv2.resize(frame, size, interpolation=cv2.INTER_AREA) for frame in reader) if size else reader
+        ready = (cv2.cvtColor(frame, cv2.COLOR_BGR2RGB) for frame in resized)
+    with reader:
+        timedFrames, latencies = timeEach(islice(ready, count))
+        for _ in timedFrames:
+            pass
+    return latencies
+
+
+def benchmarkOutputWrite(frames: list) -> list:
+    """Times encoding each frame through `outputWrite`"""
+    from src.modules.utils import outputWrite
+
+    timedFrames, latencies = timeEach(frames)
+    frameShape = (frames[0].shape[1], frames[0].shape[0])
+    outputFilename = outputWrite(timedFrames, "benchmark.mp4", "video", "benchmarks", 30, frameShape)
+    os.remove(outputFilename)
+    return latencies
+
+
+def benchmarkAITrainer(frames: list) -> list:
+    """Times the AITrainer flow end to end: pose estimation, curl counting and annotation, then encoding"""
+    from src.modules.poseEstimation import PoseDetector
+    from src.modules.utils import outputWrite
+    from src.projects.AITrainer import countCurls
+
+    detector = PoseDetector()
+    for frame in frames[:WARMUP_FRAMES]:
+        detector.findPose(frame.copy(), False)
+    detector.reset()
+
+    allPosesInFrames = (detector.findPose(frame, False) for frame in frames)
+    timedFrames, latencies = timeEach(countCurls(allPosesInFrames, detector))
+    frameShape = (frames[0].shape[1], frames[0].shape[0])
+    outputFilename = outputWrite(timedFrames, "AITrainer.mp4", "video", "benchmarks", 30, frameShape)
+    os.remove(outputFilename)
+    return latencies
+
+
+def describe(params: dict) -> str:
+    return ",".join(f"{key}={value}" for key, value in params.items())
+
+
+def listBenchmarks(frameCount: int, synthetic=None) -> list:
+    """Returns `(name, function, source, options)` for every benchmark, over synthetic `(width, height)` frames
+    when `synthetic` is given and over the assets otherwise
+    """
+    syntheticSource = synthetic and {"synthetic": list(synthetic), "frames": frameCount}
+    inputName = synthetic and f"synthetic-{synthetic[0]}x{synthetic[1]}"
+
+    benchmarks = []
+    for detector, (paramSets, assets) in DETECTORS.items():
+        for params in paramSets:
+            sources = (
+                [(inputName, syntheticSource)]
+                if synthetic
+                else [(os.path.basename(asset), {"path": asset, "frames": frameCount}) for asset in assets]
+            )
+            for sourceName, source in sources:
+                name = f"{detector}({describe(params)})/{sourceName}"
+                benchmarks.append((name, benchmarkDetector, source, {"detector": detector, "params": params}))
+
+    for detector, (paramSets, assets) in DETECTORS.items():
+        source = syntheticSource and {**syntheticSource, "frames": 1}
+        options = {"detector": detector, "params": {}}
+        name = f"coldStart/{detector}/{inputName or os.path.basename(assets[0])}"
+        benchmarks.append((name, benchmarkColdStart, source or {"path": assets[0], "frames": 1}, options))
+
+    for detector, (paramSets, assets) in DETECTORS.items():
+        # the video asset, at the default parameters
+        source = syntheticSource or {"path": assets[-1], "frames": frameCount}
+        for params in INFERENCE_RESOLUTIONS:
+            name = f"inferenceResolution/{detector}({describe(params)})/{inputName or os.path.basename(assets[-1])}"
+            benchmarks.append((name, benchmarkInferenceResolution, source, {"detector": detector, "params": params}))
+
+    pipelineSource = syntheticSource or {"path": PIPELINE_ASSET, "frames": frameCount}
+    pipelineName = inputName or os.path.basename(PIPELINE_ASSET)
+    if synthetic:
+        benchmarks.append((f"readVideo/{pipelineName}", benchmarkReadVideo, syntheticSource, {}))
+    else:
+        readOptions = {"path": PIPELINE_ASSET, "count": frameCount}
+        benchmarks.append((f"readVideo/{pipelineName}", benchmarkReadVideo, None, readOptions))
+    for backend, frameShape in DECODE_BACKENDS:
+        size = f"-{frameShape[0]}w" if frameShape else ""
+        source, options = syntheticSource, {"backend": backend, "frameShape": frameShape}
+        if not synthetic:
+            source, options = None, {**readOptions, **options}
+        name = f"decodeForInference/{backend}{size}/{pipelineName}"
+        benchmarks.append((name, benchmarkDecodeForInference, source, options))
+    benchmarks.append((f"outputWrite/{pipelineName}", benchmarkOutputWrite, pipelineSource, {}))
+    benchmarks.append((f"AITrainer/{pipelineName}", benchmarkAITrainer, pipelineSource, {}))
+    return benchmarks
+
+
+def formatRow(name: str, result: dict) -> str:
+    rss = f"{result['peakRssMb']:.0f} MiB" if result["peakRssMb"] is not None else "n/a"
+    if "firstResultMs" in result:
+        return (
+            f"{name:<60} import {result['importMs']:>7.1f} ms  create {result['createMs']:>7.1f} ms  "
+            f"warmup {result['warmupMs']:>7.1f} ms  "
+            f"first frame {result['firstFrameMs']:>7.1f} ms  first result {result['firstResultMs']:>7.1f} ms  peak {rss}"
+        )
+    row = (
+        f"{name:<60} {result['fps']:>8.1f} fps  p50 {result['p50Ms']:>7.1f} ms  p95 {result['p95Ms']:>7.1f} ms  "
+        f"p99 {result['p99Ms']:>7.1f} ms  peak {rss}"
+    )
+    if "agreement" in result:
+        error = "n/a" if result["errorPx"] is None else f"{result['errorPx']:.1f} px (p95 {result['p95ErrorPx']:.1f})"
+        row += f"  error {error}  agreement {result['agreement']:.0%}"
+    return row
+
+
+def parseResolution(value: str) -> tuple:
+    width, height = value.lower().split("x")
+    return (int(width), int(height))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the detectors and the offline pipelines")
+    parser.add_argument("--frames", type=int, default=60, help="frames per benchmark")
+    parser.add_argument("--synthetic", type=parseResolution, help="use synthetic WIDTHxHEIGHT frames")
+    parser.add_argument("--only", help="only run the benchmarks whose name contains this")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="relative change counted as a regression")
+    parser.add_argument("--list", action="store_true", help="list the benchmarks without running them")
+    args = parser.parse_args()
+
+    benchmarks = listBenchmarks(args.frames, args.synthetic)
+    if args.only:
+        benchmarks = [benchmark for benchmark in benchmarks if args.only in benchmark[0]]
+    if args.list:
+        for name, *_ in benchmarks:
+            print(name)
+        return
+
+    results = {"environment": environment(), "frames": args.frames, "benchmarks": {}}
+    failures = []
+    for name, function, source, options in benchmarks:
+        try:
+            result = runIsolated(function, source, **options)
+        except Exception as e:
+            # e.g. a model MediaPipe has to download, the other benchmarks can still run
+            failures.append(name)
+            results["benchmarks"][name] = {"error": repr(e)}
+            print(colored(f"{name:<60} failed: {e!r}", "red"))
+            continue
+        results["benchmarks"][name] = result
+        print(formatRow(name, result))
+
+    writeResults(args.output, results)
+    print(colored(f"Results written to {args.output}", "green"))
+
+    if failures:
+        print(colored(f"{len(failures)} benchmark(s) failed", "red"))
+        sys.exit(1)
+    if args.save_baseline:
+        writeResults(args.baseline, results)
+        print(colored(f"Baseline written to {args.baseline}", "green"))
+        return
+    if not os.path.exists(args.baseline):
+        return
+
+    baseline = readResults(args.baseline)
+    if baseline["environment"] != results["environment"]:
+        print(colored("The baseline was measured on a different machine or library versions", "yellow"))
+    regressions = compare(results, baseline, args.tolerance)
+    for name, metric, old, new in regressions:
+        print(colored(f"REGRESSION {name}: {metric} {old:.1f} -> {new:.1f}", "red"))
+    if regressions:
+        sys.exit(1)
+    print(colored("No regressions against the baseline", "green"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+import os
+import cv2
+from concurrent.futures import ThreadPoolExecutor
+from src.modules.faceDetection import FaceDetector
+from src.modules.faceMesh import FaceMeshDetector
+from src.modules.handTracking import HandDetector
+from src.modules.holistic import HolisticDetector
+from src.modules.poseEstimation import PoseDetector
+from src.modules.utils import VideoReader, checkFileType, outputWrite
+from termcolor import colored
+
+MODELS = {"hands": HandDetector, "pose": PoseDetector, "faces": FaceDetector, "faceMesh": FaceMeshDetector}
+# the models MediaPipe Holistic can stand in for
+HOLISTIC_MODELS = ("hands", "pose", "faceMesh")
+
+
+class Analyser:
+    """Runs several detectors over the same frames in a single pass.
+
+    Each frame is decoded and converted to RGB once, then the same buffer goes through every detector, on a thread
+    per detector when `parallel` is set, since MediaPipe releases the GIL while a graph runs. The frame is only drawn
+    on once every detector is done, so the detectors never see each other's annotations.
+
+    Usage:
+    ```python
+    analyser = Analyser(["hands", "pose", "faces"])
+    img, results = analyser.analyse(img)
+    hands, pose, faces = results["hands"], results["pose"], results["faces"]
+    ```
+
+    Args:
+        models (optional): Names of the models to run, out of `MODELS`. Defaults to all of them.
+        holistic (bool, optional): Whether to find the hands, pose and face mesh with a single `HolisticDetector`,
+            which only handles one person. Defaults to False.
+        parallel (bool, optional): Whether to run the detectors concurrently.
+            Defaults to None and thus only when there is more than one CPU.
+        detectors (dict, optional): Detector instances to use instead of the default ones, keyed by model name,
+            e.g. `{"hands": HandDetector(maxNumHands=4)}`, or "holistic" for the `HolisticDetector`.
+    """
+
+    def __init__(self, models=tuple(MODELS), holistic=False, parallel=None, detectors=None):
+        unknown = set(models) - set(MODELS)
+        if unknown:
+            raise ValueError(f"Unknown models {', '.join(sorted(unknown))}")
+        detectors = detectors or {}
+        self.models = list(models)
+
+        # each detector produces the results of the models it covers
+        self.detectors = {}
+        fused = [model for model in self.models if holistic and model in HOLISTIC_MODELS]
+        if fused:
+            self.detectors["holistic"] = (detectors.get("holistic") or HolisticDetector(), fused)
+        for model in self.models:
+            if model not in fused:
+                self.detectors[model] = (detectors.get(model) or MODELS[model](), [model])
+
+        if parallel is None:
+            parallel = (os.cpu_count() or 1) > 1
+        self.pool = ThreadPoolExecutor(len(self.detectors)) if parallel and len(self.detectors) > 1 else None
+
+    def _find(self, name: str, img, rgb):
+        detector, covered = self.detectors[name]
+        _, points = detector.find(img, False, asArray=True, normalised=True, rgb=rgb)
+        if name != "holistic":
+            return {covered[0]: points}
+        return {model: points[model] for model in covered}
+
+    def analyse(self, img, draw=True, asArray=False, normalised=False):
+        """
+        Returns a tuple structured as `(img, results)` where "results" maps each model name to what its detector
+        returns, e.g. `results["hands"]` is in the format of `HandDetector.findHands`.
+        """
+        rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        if self.pool is None:
+            found = [self._find(name, img, rgb) for name in self.detectors]
+        else:
+            found = list(self.pool.map(lambda name: self._find(name, img, rgb), self.detectors))
+
+        results = {}
+        for name, points in zip(self.detectors, found):
+            detector, _ = self.detectors[name]
+            # the holistic detector handles all of its models at once, the others a single array
+            if name == "holistic":
+                if draw:
+                    detector.drawArray(img, points)
+                results.update(detector.formatResult(img, points, asArray, normalised))
+            else:
+                if draw:
+                    detector.drawArray(img, points[name])
+                results[name] = detector.formatResult(img, points[name], asArray, normalised)
+
+        return (img, {model: results[model] for model in self.models})
+
+    def analyseFrames(self, frames, draw=True, **options):
+        """
+        Returns a list of tuples where `list[i] = (frame, results)`
+
+        `frames` can be a list of frames or a `VideoReader`, in which case the tuples are yielded lazily.
+        """
+        res = (self.analyse(frame, draw, **options) for frame in frames)
+        return res if isinstance(frames, VideoReader) else list(res)
+
+    def reset(self):
+        """Drops the tracking state of every detector, so that the next frame starts a new input"""
+        for detector, _ in self.detectors.values():
+            detector.reset()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+def main():
+    filename = "./assets/ben0.mp4"
+    filename = os.path.normpath(filename)
+    write = True
+
+    fileType = checkFileType(filename)
+
+    if fileType == "other":
+        print(colored("Unsupported file format", "red"))
+        return
+
+    fps = None
+    frameShape = None
+
+    if fileType == "image":
+        frames = [cv2.imread(filename)]
+    else:
+        # frames are decoded, processed and encoded one at a time
+        frames = VideoReader(filename, prefetch=8)
+        fps, frameShape = frames.fps, (frames.frameWidth, frames.frameHeight)
+
+    # a single decode and encode rather than one per model
+    with Analyser(["faces", "hands", "pose", "faceMesh"]) as analyser:
+        frames = (frame for frame, _ in analyser.analyseFrames(frames))
+
+        if not write:
+            for frame in frames:
+                cv2.imshow("Frame", frame)
+                cv2.waitKey(1 if fileType == "video" else 0)
+            return
+
+        outputFilename = outputWrite(frames, filename, fileType, "analysis", fps, frameShape, filename)
+
+    print(colored("Finish processing the analysis", "green"))
+    print(colored(f"Output written to {outputFilename}", "green"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+import glob
+import os
+import sys
+import threading
+import time
+import cv2
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from src.modules import metrics
+from src.modules.detectorPool import getPool
+from src.modules.utils import checkFileType
+from termcolor import colored
+
+
+def listImages(pattern: str, catalog=None) -> list:
+    """Returns the sorted paths of the images in the directory `pattern`, or of those matching the glob `pattern`,
+    where `**` matches any number of sub directories.
+    With a scanned `MediaCatalog` as `catalog`, the paths are looked up in it instead of on disk.
+    """
+    if catalog is not None:
+        return [entry["path"] for entry in catalog.select(pattern, "image")]
+    if os.path.isdir(pattern):
+        paths = [os.path.join(pattern, name) for name in os.listdir(pattern)]
+    else:
+        paths = glob.glob(pattern, recursive=True)
+    return sorted(path for path in paths if os.path.isfile(path) and checkFileType(path.lower()) == "image")
+
+
+def _readImage(path: str):
+    with metrics.timer("decode", "processImages"):
+        img = cv2.imread(path)
+    if img is None:
+        raise IOError(f"Failed to read {path}")
+    return img
+
+
+def _writeImage(path: str, img):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with metrics.timer("encode", "processImages"):
+        success = cv2.imwrite(path, img)
+    if not success:
+        raise IOError(f"Failed to write {path}")
+
+
+def processImages(
+    detector,
+    pattern: str,
+    outputDirectoryName: str,
+    workers=None,
+    ioThreads=4,
+    window=None,
+    overwrite=False,
+    draw=True,
+    onResult=None,
+    catalog=None,
+    **findOptions,
+) -> dict:
+    """Runs `detector` over every image in a directory or matching a glob and writes the annotated images to
+    f"out/{outputDirectoryName}/...", keeping their paths relative to the input directory.
+
+    Decoding and encoding run on threads while inference runs in worker processes, so that the three stages overlap.
+    Each image is handled independently, as with `staticImageMode=True`.
+
+    Args:
+        detector: The detector whose parameters the workers are built from, see `Detector.createWorkerPool`.
+        pattern (str): A directory, or a glob such as "photos/**/*.jpg".
+        outputDirectoryName (str): Will be plugged in to f"out/{outputDirectoryName}/..."
+        workers (int, optional): Number of inference processes. Defaults to None and thus one per CPU.
+            With a single worker, inference runs on a thread of this process instead.
+        ioThreads (int, optional): Number of threads reading and of threads writing images. Defaults to 4.
+        window (int, optional): Maximum number of images in flight at once, which caps the memory used.
+            Defaults to None and thus four per worker plus one per I/O thread.
+        overwrite (bool, optional): Whether to process images whose output already exists. Defaults to False.
+        draw (bool, optional): Whether to draw the landmarks on the output images. Defaults to True.
+        onResult (optional): Called with `(path, results)` once an image is written, from a background thread.
+            An exception it raises counts the image as failed.
+        catalog (optional): A `MediaCatalog` the images are listed from, see `listImages`. Defaults to None.
+        **findOptions: Passed on to `find`, e.g. `normalised=True`.
+
+    Returns:
+        dict: A summary with the number of "images" found, and how many were "processed", "skipped" and "failed",
+            the "seconds" it took, "imagesPerSecond" and the "failures" as `(path, error)` tuples.
+    """
+    images = listImages(pattern, catalog)
+    root = (
+        pattern if os.path.isdir(pattern) else os.path.commonpath([os.path.dirname(path) for path in images] or ["."])
+    )
+
+    jobs = []
+    for path in images:
+        outputFilename = os.path.join("out", outputDirectoryName, os.path.relpath(path, root))
+        if overwrite or not os.path.exists(outputFilename):
+            jobs.append((path, outputFilename))
+
+    workers = min(workers or os.cpu_count() or 1, os.cpu_count() or 1)
+    window = window or workers * 4 + ioThreads
+    # a slot is taken before an image is read and given back once it is written or has failed
+    slots = threading.BoundedSemaphore(window)
+    lock = threading.Lock()
+    summary = {
+        "images": len(images),
+        "processed": 0,
+        "skipped": len(images) - len(jobs),
+        "failed": 0,
+        "seconds": 0.0,
+        "imagesPerSecond": None,
+        "failures": [],
+    }
+
+    def fail(path: str, error: BaseException):
+        with lock:
+            summary["failed"] += 1
+            summary["failures"].append((path, repr(error)))
+        slots.release()
+
+    start = time.perf_counter()
+    with ExitStack() as stack:
+        if workers > 1:
+            inference = stack.enter_context(detector.createWorkerPool(workers, static=True))
+            find = lambda img: detector.findInPool(inference, img, draw, **findOptions)
+        else:
+            # a static detector from the shared pool, as `detector` may be tracking and used elsewhere
+            staticDetector = stack.enter_context(getPool().checkout(type(detector), **detector.getStaticParams()))
+            inference = stack.enter_context(ThreadPoolExecutor(1))
+            find = lambda img: inference.submit(staticDetector.find, img, draw, **findOptions)
+        readers = stack.enter_context(ThreadPoolExecutor(ioThreads))
+        writers = stack.enter_context(ThreadPoolExecutor(ioThreads))
+
+        # `concurrent.futures` swallows the exceptions raised in done callbacks, leaving their slot taken forever,
+        # so each callback fails the image itself, e.g. when a crashed worker broke the pool
+        def onWritten(path: str, results, future):
+            try:
+                future.result()
+                if onResult is not None:
+                    onResult(path, results)
+            except BaseException as error:
+                return fail(path, error)
+            with lock:
+                summary["processed"] += 1
+            slots.release()
+
+        def onFound(path: str, outputFilename: str, future):
+            try:
+                img, results = future.result()
+                writers.submit(_writeImage, outputFilename, img).add_done_callback(
+                    lambda written: onWritten(path, results, written)
+                )
+            except BaseException as error:
+                fail(path, error)
+
+        def onRead(path: str, outputFilename: str, future):
+            try:
+                find(future.result()).add_done_callback(lambda found: onFound(path, outputFilename, found))
+            except BaseException as error:
+                fail(path, error)
+
+        for path, outputFilename in jobs:
+            slots.acquire()
+            readers.submit(_readImage, path).add_done_callback(
+                lambda read, path=path, outputFilename=outputFilename: onRead(path, outputFilename, read)
+            )
+
+        # every slot is free again once the last image is done
+        for _ in range(window):
+            slots.acquire()
+
+    summary["seconds"] = time.perf_counter() - start
+    if summary["seconds"] > 0:
+        summary["imagesPerSecond"] = summary["processed"] / summary["seconds"]
+    return summary
+
+
+def printSummary(summary: dict):
+    imagesPerSecond = summary["imagesPerSecond"] or 0
+    print(
+        colored(
+            f"Processed {summary['processed']} of {summary['images']} images in {summary['seconds']:.1f}s "
+            f"({imagesPerSecond:.1f} images/s), skipped {summary['skipped']} already processed",
+            "green",
+        )
+    )
+    if summary["failed"]:
+        print(colored(f"{summary['failed']} image(s) failed:", "red"))
+        for path, error in summary["failures"]:
+            print(colored(f"  {path}: {error}", "red"))
+
+
+def main():
+    # imported here as the analyser loads every detector module
+    from src.modules.analyser import MODELS
+
+    if len(sys.argv) < 2:
+        print(colored(f"Usage: python -m src.modules.batchImages <directory|glob> [{'|'.join(MODELS)}]", "red"))
+        return
+
+    pattern = sys.argv[1]
+    model = sys.argv[2] if len(sys.argv) > 2 else "hands"
+    summary = processImages(MODELS[model](), pattern, f"batch/{model}")
+    printSummary(summary)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,8 @@
+"""Colours shared by the detectors and projects, kept apart so that using them does not load any detector module.
+Colours are BGR.
+"""
+
+ANNOTATION_COLOR = (26, 246, 0)
+EMPHASIS_COLOR = (26, 0, 246)
+LANDMARK_COLOR = (48, 48, 255)
+FACE_ANNOTATION_COLOR = (157, 155, 24)
@@ -0,0 +1,312 @@
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import ExitStack
+from itertools import islice
+import cv2
+import numpy as np
+from src.modules import metrics
+from src.modules.frameRing import FrameRing, ringSlots
+from src.modules.resizePlan import ResizePlan
+from src.modules.utils import VideoReader
+
+# the detector owned by the current worker process, see `_initWorker`
+_workerDetector = None
+# shared memory name => the `FrameRing` the current worker process attached to
+_workerRings = {}
+# index of the chunk that continues the last one the current worker process tracked, see `_processChunk`
+_workerNextChunk = None
+# frames per chunk of `Detector.findInFrames`, larger when tracking as tracking may start over with every chunk
+STATIC_CHUNK_SIZE = 32
+TRACKING_CHUNK_SIZE = 128
+
+
+def _initWorker(detectorClass, params: dict, metricsEnabled=False):
+    global _workerDetector
+    # the workers initialise their graphs side by side as the pool starts, rather than on their first frame
+    _workerDetector = detectorClass(**params).warmup()
+    # the values a worker records are handed back with its results, see `metrics.drain`
+    if metricsEnabled:
+        metrics.enable()
+
+
+def _attachRing(spec: tuple) -> FrameRing:
+    if spec[0] not in _workerRings:
+        _workerRings[spec[0]] = FrameRing.attach(spec)
+    return _workerRings[spec[0]]
+
+
+def _processChunk(frames: list, draw: bool, tracking: bool, findOptions: dict, ringSpec=None, chunkIndex=None):
+    global _workerNextChunk
+    # tracking must not carry over from a chunk that does not precede this one. The graph of a fresh worker holds no
+    # state, and resetting it is expensive, as MediaPipe 0.8 closes and builds it again
+    if tracking and _workerNextChunk is not None and chunkIndex != _workerNextChunk:
+        _workerDetector.reset()
+    _workerNextChunk = None if chunkIndex is None else chunkIndex + 1
+    results = []
+    for frame in frames:
+        if isinstance(frame, tuple):
+            # a handle to a frame in shared memory, annotated in place, so only the landmarks go back
+            results.append((None, _workerDetector.find(_attachRing(ringSpec).view(frame), draw, **findOptions)[1]))
+        else:
+            results.append(_workerDetector.find(frame, draw, **findOptions))
+    return results, metrics.drain()
+
+
+def _processImage(img, draw: bool, findOptions: dict):
+    return _workerDetector.find(img, draw, **findOptions), metrics.drain()
+
+
+def _mergeWorkerMetrics(future: Future) -> Future:
+    """Returns a future of the result held by `future` alongside the metrics of the worker, which are merged here"""
+    resultFuture = Future()
+
+    def done(future):
+        if future.exception() is not None:
+            return resultFuture.set_exception(future.exception())
+        result, recorded = future.result()
+        metrics.merge(recorded)
+        resultFuture.set_result(result)
+
+    future.add_done_callback(done)
+    return resultFuture
+
+
+def mediapipeSolutions():
+    """Returns `mediapipe.solutions`. MediaPipe is only imported here, when the first detector is created,
+    as importing it takes most of the start-up time.
+    """
+    import mediapipe as mp
+
+    return mp.solutions
+
+
+def toRgb(img, rgb=None):
+    """Returns the RGB frame a graph takes: `rgb` if it is the frame already converted, `img` itself if `rgb` is True,
+    e.g. for frames read by an `FfmpegReader`, and `img` converted from BGR otherwise
+    """
+    if rgb is True:
+        return img
+    if rgb is None:
+        return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    return rgb
+
+
+def chunked(iterable, chunkSize: int):
+    """Yields lists of at most `chunkSize` consecutive items of `iterable`"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, chunkSize))
+        if not chunk:
+            return
+        yield chunk
+
+
+class Detector:
+    """Behaviour shared by `HandDetector`, `PoseDetector`, `FaceDetector` and `FaceMeshDetector`.
+
+    Subclasses implement:
+     - `getParams`, returning the keyword arguments needed to construct an identical detector
+     - `createGraph`, returning a new MediaPipe solution built from those parameters
+     - `find`, processing a single frame and returning `(frame, landmarks)`, accepting `asArray` and `normalised`
+     - `formatResult`, a static method converting a normalised landmark array into the format returned by `find`
+     - `drawArray`, drawing a normalised landmark array onto a frame
+
+    and store the graph returned by `createGraph` under the attribute named by `graphAttribute`.
+    `multipleResults` tells whether the landmark arrays hold any number of hands or faces, rather than exactly one pose.
+    Subclasses taking an inference resolution keep their `ResizePlan` in `resizePlan` and pass frames to their graph
+    through `inferenceInput`.
+    """
+
+    graphAttribute = None
+    multipleResults = True
+    # infers on frames as they come, see `inferenceInput`
+    resizePlan = ResizePlan()
+
+    def getParams(self) -> dict:
+        raise NotImplementedError
+
+    def createGraph(self):
+        raise NotImplementedError
+
+    def find(self, img, draw=True, **options):
+        raise NotImplementedError
+
+    @staticmethod
+    def formatResult(img, points, asArray=False, normalised=False):
+        raise NotImplementedError
+
+    def drawArray(self, img, points):
+        raise NotImplementedError
+
+    def inferenceInput(self, img, rgb=None):
+        """Returns the RGB frame the graph runs on, downscaled to the inference resolution of `resizePlan`.
+        See `toRgb` for `rgb`.
+        """
+        if rgb is None:
+            # downscaling first leaves fewer pixels to convert
+            return cv2.cvtColor(self.resizePlan.apply(img), cv2.COLOR_BGR2RGB)
+        return self.resizePlan.apply(toRgb(img, rgb))
+
+    def getStaticParams(self) -> dict:
+        """Returns the constructor parameters of an equivalent detector that treats every frame independently"""
+        params = self.getParams()
+        if "staticImageMode" in params:
+            params["staticImageMode"] = True
+        return params
+
+    def warmup(self, frameShape=(640, 480)):
+        """Runs a blank `(frameWidth, frameHeight)` frame through the graph, so that the first real frame does not pay
+        for initialising it. Returns the detector.
+
+        Nothing is found in a blank frame, so no tracking state is left behind. The graph must not be `reset`
+        afterwards, as that initialises it again.
+        """
+        frameWidth, frameHeight = frameShape
+        self.find(np.zeros((frameHeight, frameWidth, 3), np.uint8), False)
+        return self
+
+    def reset(self):
+        """Drops the tracking state, so that the next frame is handled as the start of a new input"""
+        graph = getattr(self, self.graphAttribute)
+        if hasattr(graph, "reset"):
+            graph.reset()
+        else:
+            graph.close()
+            setattr(self, self.graphAttribute, self.createGraph())
+
+    def isStatic(self) -> bool:
+        """Whether every frame is handled independently, in which case there is no tracking state to reset"""
+        return self.getParams() == self.getStaticParams()
+
+    def close(self):
+        """Frees the MediaPipe graph, after which the detector can no longer be used"""
+        getattr(self, self.graphAttribute).close()
+
+    def findInFrames(
+        self,
+        frames,
+        draw=True,
+        workers=None,
+        chunkSize=None,
+        tracking=True,
+        cache=None,
+        subsampler=None,
+        sharedMemory=True,
+        **findOptions,
+    ):
+        """Runs `find` over `frames` and returns a list of tuples where `list[i] = (frame, landmarks)`
+
+        Args:
+            frames: A list of frames or a `VideoReader`, in which case the tuples are yielded lazily.
+            draw (bool, optional): Whether to annotate the frames. Defaults to True.
+            workers (int, optional): Number of worker processes, each owning a detector built from `getParams`.
+                Capped at the number of CPUs. Defaults to None and thus the frames are processed in this process.
+            chunkSize (int, optional): Number of consecutive frames sent to a worker at a time. Defaults to None
+                and thus `TRACKING_CHUNK_SIZE` when tracking and `STATIC_CHUNK_SIZE` otherwise.
+            tracking (bool, optional): Whether to keep temporal tracking within each chunk, rather than treating
+                every frame as a static image. Defaults to True. A worker resets its detector whenever its next chunk
+                does not follow its previous one, which with MediaPipe 0.8, whose graphs cannot be reset, closes the
+                graph and builds it again, hence the larger chunks.
+            cache (LandmarkCache, optional): Reuses the landmarks found for the same source file and parameters
+                before, skipping inference. Only used when `frames` was read from a file, e.g. a `VideoReader`.
+            subsampler (Subsampler, optional): Only runs `find` on keyframes and interpolates the landmarks of the
+                frames in between, see `src.modules.subsampling`. The frames are then processed in this process.
+            sharedMemory (bool, optional): Whether to hand the frames to the worker processes through a `FrameRing`
+                in shared memory rather than pickling them. The ring is sized to the free space of /dev/shm, see
+                `ringSlots`, and the frames that do not fit in it are pickled. Defaults to True.
+            **findOptions: Passed on to `find`, e.g. `asArray=True` to get the landmarks as arrays.
+
+        Returns:
+            The results in input order. In parallel mode, the frames in the results are annotated copies.
+        """
+        workers = min(workers or 1, os.cpu_count() or 1)
+        chunkSize = chunkSize or (TRACKING_CHUNK_SIZE if tracking else STATIC_CHUNK_SIZE)
+        if getattr(frames, "pixelFormat", "bgr24") == "rgb24":
+            # the graphs take the frames as they are
+            findOptions = {**findOptions, "rgb": True}
+        if cache is not None and getattr(frames, "path", None) is not None:
+            res = cache.findInFrames(self, frames, draw, workers, chunkSize, tracking, subsampler, **findOptions)
+        elif subsampler is not None:
+            res = subsampler.findInFrames(self, frames, draw, **findOptions)
+        elif workers == 1:
+            res = (self.find(frame, draw, **findOptions) for frame in frames)
+        else:
+            res = self._findInFramesParallel(frames, draw, workers, chunkSize, tracking, sharedMemory, findOptions)
+
+        # stream the results when reading lazily so that memory stays flat
+        return res if isinstance(frames, VideoReader) else list(res)
+
+    def createWorkerPool(self, workers: int, static=False) -> ProcessPoolExecutor:
+        """Returns a pool of `workers` processes, each owning a detector built from `getParams`,
+        or from `getStaticParams` if `static` is set. See `findInPool` to submit frames to it.
+        """
+        params = self.getStaticParams() if static else self.getParams()
+        # forking a process that already runs MediaPipe graph threads is unsafe, so workers are always spawned
+        context = multiprocessing.get_context("spawn")
+        initargs = (type(self), params, metrics.isEnabled())
+        return ProcessPoolExecutor(workers, mp_context=context, initializer=_initWorker, initargs=initargs)
+
+    def findInPool(self, pool: ProcessPoolExecutor, img, draw=True, **findOptions):
+        """Submits `img` to a pool returned by `createWorkerPool`, returning the future of `find`'s result"""
+        return _mergeWorkerMetrics(pool.submit(_processImage, img, draw, findOptions))
+
+    def _findInFramesParallel(
+        self, frames, draw: bool, workers: int, chunkSize: int, tracking: bool, sharedMemory: bool, findOptions: dict
+    ):
+        # bound the number of chunks in flight so that a long video is never fully buffered, keeping about as many
+        # frames in flight as two chunks of `STATIC_CHUNK_SIZE` per worker, with one chunk to spare
+        maxPending = max(workers + 1, workers * 2 * STATIC_CHUNK_SIZE // chunkSize)
+        ring = None
+
+        def collect(chunk: list, future) -> list:
+            try:
+                results, recorded = future.result()
+                metrics.merge(recorded)
+                # frames sent through the ring come back from it, the others were pickled back
+                return [
+                    (ring.read(frame), landmarks) if isinstance(frame, tuple) else (annotated, landmarks)
+                    for frame, (annotated, landmarks) in zip(chunk, results)
+                ]
+            finally:
+                for frame in chunk:
+                    if isinstance(frame, tuple):
+                        ring.release(frame)
+
+        def toRing(frame):
+            # frames of another size, e.g. in a list of images, are pickled as before
+            if not ring.fits(frame):
+                return frame
+            try:
+                # slots are only released by `collect` on this thread, so waiting for one would never end
+                return ring.write(frame, timeout=0)
+            except TimeoutError:
+                return frame
+
+        with ExitStack() as stack:
+            pool = stack.enter_context(self.createWorkerPool(workers, static=not tracking))
+            pending = deque()
+            for chunkIndex, chunk in enumerate(chunked(frames, chunkSize)):
+                if sharedMemory and ring is None and chunk[0].dtype == np.uint8 and chunk[0].ndim == 3:
+                    frameHeight, frameWidth = chunk[0].shape[:2]
+                    # as many frames as are in flight, within the shared memory budget, past which frames are pickled
+                    slots = ringSlots((frameWidth, frameHeight), maxPending * chunkSize)
+                    sharedMemory = False
+                    if slots >= workers:
+                        try:
+                            ring = stack.enter_context(FrameRing((frameWidth, frameHeight), slots))
+                        except OSError:
+                            # e.g. shared memory that cannot be created at all
+                            pass
+                if ring is not None:
+                    chunk = [toRing(frame) for frame in chunk]
+
+                spec = ring.spec if ring is not None else None
+                future = pool.submit(_processChunk, chunk, draw, tracking, findOptions, spec, chunkIndex)
+                pending.append((chunk, future))
+                if len(pending) >= maxPending:
+                    yield from collect(*pending.popleft())
+
+            while pending:
+                yield from collect(*pending.popleft())
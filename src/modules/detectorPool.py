@@ -0,0 +1,166 @@
+import inspect
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class DetectorPool:
+    """Keeps detectors, and so their MediaPipe graphs, alive between jobs, keyed by detector class and constructor
+    parameters, so that short jobs check a warmed-up detector out and back in rather than building their own.
+
+    A detector is reset when it is checked back in, so the next job starts from a clean tracking state. At most
+    `maxDetectors` detectors are alive at once: when the pool is full, the least recently used idle detector is closed
+    to make room, and when every detector is checked out, `acquire` waits for one to come back.
+    The pool is thread-safe, but a checked out detector belongs to a single thread until it is released.
+
+    Usage:
+    ```python
+    with getPool().checkout(HandDetector, maxNumHands=1) as detector:
+        frames = detector.findHandsInFrames(frames)
+    ```
+
+    Args:
+        maxDetectors (int, optional): Maximum number of live detectors across every key. Defaults to 8.
+        warmup (bool, optional): Whether new and reset detectors are warmed up before being handed out, see
+            `Detector.warmup`. Defaults to True.
+    """
+
+    def __init__(self, maxDetectors=8, warmup=True):
+        self.maxDetectors = maxDetectors
+        self.warmup = warmup
+        self.condition = threading.Condition()
+        # key => idle detectors, the least recently used key first
+        self.idle = OrderedDict()
+        # detector => key, for the detectors currently checked out
+        self.checkedOut = {}
+        self.live = 0
+        self.stats = {"created": 0, "reused": 0, "evicted": 0}
+
+    @staticmethod
+    def keyFor(detectorClass, params: dict) -> tuple:
+        """Returns the key of `detectorClass(**params)`, where omitted parameters count as their default value"""
+        arguments = inspect.signature(detectorClass).bind(**params)
+        arguments.apply_defaults()
+        return (detectorClass, tuple(sorted(arguments.arguments.items())))
+
+    def acquire(self, detectorClass, timeout=None, **params):
+        """Checks out a detector built as `detectorClass(**params)`, reusing an idle one when there is one.
+
+        Raises:
+            TimeoutError: When every detector stays checked out for `timeout` seconds.
+        """
+        key = self.keyFor(detectorClass, params)
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with self.condition:
+            while True:
+                if self.idle.get(key):
+                    detector = self.idle[key].pop()
+                    self.idle.move_to_end(key)
+                    self.checkedOut[detector] = key
+                    self.stats["reused"] += 1
+                    return detector
+                if self.live < self.maxDetectors:
+                    # the slot is taken now, but the detector is built outside the lock
+                    self.live += 1
+                    break
+                if self._evictLeastRecentlyUsed():
+                    continue
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError(f"No {detectorClass.__name__} became available within {timeout}s")
+                self.condition.wait(remaining)
+
+        try:
+            detector = detectorClass(**params)
+            if self.warmup:
+                detector.warmup()
+        except BaseException:
+            with self.condition:
+                self.live -= 1
+                self.condition.notify()
+            raise
+
+        with self.condition:
+            self.checkedOut[detector] = key
+            self.stats["created"] += 1
+        return detector
+
+    def release(self, detector):
+        """Checks a detector back in, resetting its tracking state so that the next job starts afresh"""
+        with self.condition:
+            if detector not in self.checkedOut:
+                raise ValueError("The detector was not checked out from this pool")
+            key = self.checkedOut.pop(detector)
+
+        try:
+            # resetting initialises the graph again, which is done here rather than by the next job
+            if not detector.isStatic():
+                detector.reset()
+                if self.warmup:
+                    detector.warmup()
+        except BaseException:
+            detector.close()
+            with self.condition:
+                self.live -= 1
+                self.condition.notify()
+            raise
+
+        with self.condition:
+            self.idle.setdefault(key, []).append(detector)
+            self.idle.move_to_end(key)
+            self.condition.notify()
+
+    @contextmanager
+    def checkout(self, detectorClass, timeout=None, **params):
+        """Context manager around `acquire` and `release`"""
+        detector = self.acquire(detectorClass, timeout, **params)
+        try:
+            yield detector
+        finally:
+            self.release(detector)
+
+    def _evictLeastRecentlyUsed(self) -> bool:
+        # called with the lock held
+        for key, detectors in self.idle.items():
+            if detectors:
+                detectors.pop(0).close()
+                if not detectors:
+                    del self.idle[key]
+                self.live -= 1
+                self.stats["evicted"] += 1
+                return True
+        return False
+
+    def getStats(self) -> dict:
+        """Returns how many detectors were "created", "reused" and "evicted", and how many are "live" and "idle" """
+        with self.condition:
+            return {
+                **self.stats,
+                "live": self.live,
+                "idle": sum(len(detectors) for detectors in self.idle.values()),
+            }
+
+    def clear(self):
+        """Closes every idle detector, the ones still checked out come back to the pool as usual when released"""
+        with self.condition:
+            for detectors in self.idle.values():
+                for detector in detectors:
+                    detector.close()
+                    self.live -= 1
+            self.idle.clear()
+            self.condition.notify_all()
+
+
+_pool = None
+_poolLock = threading.Lock()
+
+
+def getPool() -> DetectorPool:
+    """Returns the pool shared by the whole process, created on first use"""
+    global _pool
+    with _poolLock:
+        if _pool is None:
+            _pool = DetectorPool()
+        return _pool
@@ -1,82 +1,160 @@
 import os
 import cv2
-import mediapipe as mp
-from src.modules.utils import checkFileType, readVideo
+import numpy as np
+from src.modules import metrics
+from src.modules.constants import FACE_ANNOTATION_COLOR as ANNOTATION_COLOR
+from src.modules.detector import Detector, mediapipeSolutions
+from src.modules.landmarks import boxesToPixels
+from src.modules.renderer import drawSegments
+from src.modules.resizePlan import ResizePlan
+from src.modules.utils import VideoReader, checkFileType, outputWrite
 from termcolor import colored
-import ffmpeg
 
-ANNOTATION_COLOR = (157, 155, 24)
 
+class FaceDetector(Detector):
+    """Finds the bounding boxes of faces with MediaPipe Face Detection.
 
-class FaceDetector:
-    def __init__(self, min_detection_confidence=0.5, model_selection=0):
+    With `inferenceMaxSide` or `inferenceScale` set, the graph runs on the frame downscaled by a `ResizePlan`, while
+    the boxes are still returned and drawn in the pixels of the frame as it came.
+    """
+
+    graphAttribute = "face"
+
+    def __init__(self, min_detection_confidence=0.5, model_selection=0, inferenceMaxSide=None, inferenceScale=None):
         self.min_detection_confidence = min_detection_confidence
         self.model_selection = model_selection
-        self.mpFace = mp.solutions.face_detection
-        self.face = self.mpFace.FaceDetection(min_detection_confidence, model_selection)
-        self.mpDraw = mp.solutions.drawing_utils
-
-    def findFace(self, img, draw=True):
-        currResult = self.face.process(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
-        detections = currResult.detections
-        boundingBoxes = []
-        if detections:
-            for ind, detection in enumerate(detections):
-                bboxC = detection.location_data.relative_bounding_box
-                imageH, imageW, _trash = img.shape
-                boundingBox = (
-                    int(bboxC.xmin * imageW),
-                    int(bboxC.ymin * imageH),
-                    int(bboxC.width * imageW),
-                    int(bboxC.height * imageH),
-                )
-
-                # a tuple containing (id, boundingBox, detectionScore)
-                boundingBoxes.append((ind, boundingBox, detection.score))
-                if draw:
-                    img = self.customDraw(img, boundingBox)
-                    cv2.putText(
-                        img,
-                        f"{int(detection.score[0] * 100)}%",
-                        (boundingBox[0], boundingBox[1] - 20),
-                        cv2.FONT_HERSHEY_PLAIN,
-                        2,
-                        ANNOTATION_COLOR,
-                        2,
-                    )
-        return (img, boundingBoxes)
-
-    def findFaceInFrames(self, frames: list, draw=True):
+        self.inferenceMaxSide = inferenceMaxSide
+        self.inferenceScale = inferenceScale
+        self.resizePlan = ResizePlan(inferenceMaxSide, inferenceScale)
+        solutions = mediapipeSolutions()
+        self.mpFace = solutions.face_detection
+        self.face = self.createGraph()
+        self.mpDraw = solutions.drawing_utils
+
+    def getParams(self) -> dict:
+        # face detection has no tracking, so every frame is already handled as a static image
+        return {
+            "min_detection_confidence": self.min_detection_confidence,
+            "model_selection": self.model_selection,
+            "inferenceMaxSide": self.inferenceMaxSide,
+            "inferenceScale": self.inferenceScale,
+        }
+
+    def createGraph(self):
+        return self.mpFace.FaceDetection(
+            min_detection_confidence=self.min_detection_confidence, model_selection=self.model_selection
+        )
+
+    def find(self, img, draw=True, **options):
+        return self.findFace(img, draw, **options)
+
+    def findFace(self, img, draw=True, asArray=False, normalised=False, rgb=None):
         """
-        Returns a list of tuples where `list[i] = (frame, landmarks)`
+        Returns a tuple structured as `(img, boundingBoxes)` where "boundingBoxes" is a list of
+        `(id, (x, y, width, height), detectionScore)` tuples,
+        or a float32 array of shape `(nFaces, 5)` if `asArray` is set, see `src.modules.landmarks`.
+        `rgb` can hold the frame already converted to RGB, e.g. when it is shared by several detectors,
+        or be True when `img` itself is RGB.
         """
-        res = []
-        for frame in frames:
-            res.append(self.findFace(frame, draw))
-        return res
-
-    def customDraw(self, img, boundingBox, cornerMarkerLength=30, cornerMarkerThickness=10, rectangleThickness=1):
-        xStart, yStart, w, h = boundingBox
-        xEnd, yEnd = xStart + w, yStart + h
+        with metrics.timer("convert", "FaceDetector"):
+            rgb = self.inferenceInput(img, rgb)
+        with metrics.timer("inference", "FaceDetector"):
+            currResult = self.face.process(rgb)
+        detections = currResult.detections or []
+
+        with metrics.timer("landmarks", "FaceDetector"):
+            boxes = np.array(
+                [
+                    (box.xmin, box.ymin, box.width, box.height, detection.score[0])
+                    for detection in detections
+                    for box in [detection.location_data.relative_bounding_box]
+                ]
+            ).reshape(-1, 5)
+            res = self.formatResult(img, boxes, asArray, normalised)
+        with metrics.timer("draw", "FaceDetector"):
+            if draw:
+                self.drawArray(img, boxes)
+        metrics.recordDetections("FaceDetector", len(boxes))
+        return (img, res)
+
+    @staticmethod
+    def formatResult(img, boxes, asArray=False, normalised=False):
+        """Converts normalised `(nFaces, 5)` boxes into the format returned by `findFace`"""
+        if asArray and normalised:
+            return boxes.astype(np.float32)
+
+        pixelBoxes = boxesToPixels(boxes, img.shape)
+        if asArray:
+            return pixelBoxes.astype(np.float32)
+
+        # a tuple containing (id, boundingBox, detectionScore)
+        return [
+            (ind, tuple(boundingBox), [score])
+            for ind, (boundingBox, score) in enumerate(
+                zip(pixelBoxes[:, :4].astype(int).tolist(), pixelBoxes[:, 4].tolist())
+            )
+        ]
+
+    def drawArray(self, img, boxes):
+        """Draws normalised `(nFaces, 5)` boxes, e.g. ones that were cached rather than inferred"""
+        return drawBoxes(img, boxes)
+
+    def findFaceInFrames(self, frames, draw=True, **options):
+        """
+        Returns a list of tuples where `list[i] = (frame, landmarks)`
 
-        cv2.rectangle(img, boundingBox, ANNOTATION_COLOR, rectangleThickness)
-        # top left corner
-        cv2.line(img, (xStart, yStart), (xStart + cornerMarkerLength, yStart), ANNOTATION_COLOR, cornerMarkerThickness)
-        cv2.line(img, (xStart, yStart), (xStart, yStart + cornerMarkerLength), ANNOTATION_COLOR, cornerMarkerThickness)
+        `frames` can be a list of frames or a `VideoReader`, in which case the tuples are yielded lazily.
+        See `Detector.findInFrames` for the `options`, e.g. running over a pool of `workers` processes.
+        """
+        # face detection has no tracking to keep
+        return self.findInFrames(frames, draw, tracking=False, **options)
 
-        # top right corner
-        cv2.line(img, (xEnd, yStart), (xEnd - cornerMarkerLength, yStart), ANNOTATION_COLOR, cornerMarkerThickness)
-        cv2.line(img, (xEnd, yStart), (xEnd, yStart + cornerMarkerLength), ANNOTATION_COLOR, cornerMarkerThickness)
+    @staticmethod
+    def customDraw(img, boundingBox, cornerMarkerLength=30, cornerMarkerThickness=10, rectangleThickness=1):
+        """Draws a bounding box `(x, y, width, height)` with thick corner markers, or a list of them at once"""
+        boxes = np.array(boundingBox, dtype=np.int32).reshape(-1, 4)
+        for box in boxes.tolist():
+            cv2.rectangle(img, box, ANNOTATION_COLOR, rectangleThickness)
+        drawSegments(img, cornerSegments(boxes, cornerMarkerLength), ANNOTATION_COLOR, cornerMarkerThickness)
 
-        # bottom right corner
-        cv2.line(img, (xEnd, yEnd), (xEnd - cornerMarkerLength, yEnd), ANNOTATION_COLOR, cornerMarkerThickness)
-        cv2.line(img, (xEnd, yEnd), (xEnd, yEnd - cornerMarkerLength), ANNOTATION_COLOR, cornerMarkerThickness)
+        return img
 
-        # bottom left corner
-        cv2.line(img, (xStart, yEnd), (xStart + cornerMarkerLength, yEnd), ANNOTATION_COLOR, cornerMarkerThickness)
-        cv2.line(img, (xStart, yEnd), (xStart, yEnd - cornerMarkerLength), ANNOTATION_COLOR, cornerMarkerThickness)
 
-        return img
+def drawBoxes(img, boxes: np.ndarray):
+    """Draws normalised `(nFaces, 5)` boxes with their detection score, as `findFace` does"""
+    faces = FaceDetector.formatResult(img, boxes)
+    FaceDetector.customDraw(img, [boundingBox for _, boundingBox, _ in faces])
+    for _, boundingBox, score in faces:
+        cv2.putText(
+            img,
+            f"{int(score[0] * 100)}%",
+            (boundingBox[0], boundingBox[1] - 20),
+            cv2.FONT_HERSHEY_PLAIN,
+            2,
+            ANNOTATION_COLOR,
+            2,
+        )
+    return img
+
+
+def cornerSegments(boxes: np.ndarray, cornerMarkerLength: int) -> np.ndarray:
+    """Returns the `(nBoxes * 8, 2, 2)` segments of the corner markers of `(nBoxes, 4)` `(x, y, width, height)` boxes"""
+    xStart, yStart = boxes[:, 0], boxes[:, 1]
+    xEnd, yEnd = xStart + boxes[:, 2], yStart + boxes[:, 3]
+    length = cornerMarkerLength
+    # each corner gets a horizontal and a vertical marker pointing into the box
+    segments = [
+        ((xStart, yStart), (xStart + length, yStart)),
+        ((xStart, yStart), (xStart, yStart + length)),
+        ((xEnd, yStart), (xEnd - length, yStart)),
+        ((xEnd, yStart), (xEnd, yStart + length)),
+        ((xEnd, yEnd), (xEnd - length, yEnd)),
+        ((xEnd, yEnd), (xEnd, yEnd - length)),
+        ((xStart, yEnd), (xStart + length, yEnd)),
+        ((xStart, yEnd), (xStart, yEnd - length)),
+    ]
+    # (8, 2, 2, nBoxes) => (nBoxes, 8, 2, 2)
+    return np.array(segments, dtype=np.int32).transpose(3, 0, 1, 2).reshape(-1, 2, 2)
 
 
 def main():
@@ -90,56 +168,28 @@ def main():
         print(colored("Unsupported file format", "red"))
         return
 
-    frameWidth = None
-    frameHeight = None
-
-    frames = []
+    fps = None
+    frameShape = None
 
     if fileType == "image":
-        img = cv2.imread(filename)
-        frames.append(img)
+        frames = [cv2.imread(filename)]
     else:
-        ((frames, audio), (frameWidth, frameHeight, fps)) = readVideo(filename, True, True)
-
-    print(colored(f"Finish reading {fileType}", "green"))
+        # frames are decoded, processed and encoded one at a time
+        frames = VideoReader(filename, prefetch=8)
+        fps, frameShape = frames.fps, (frames.frameWidth, frames.frameHeight)
 
     detector = FaceDetector()
-    detector.findFaceInFrames(frames, True)
-
-    print(colored("Finish processing face detection", "green"))
+    frames = (frame for frame, _ in detector.findFaceInFrames(frames, True))
 
     if not write:
-        if fileType == "video":
-            for frame in frames:
-                cv2.imshow("Frame", frame)
-                cv2.waitKey(1)
-        else:
-            cv2.imshow("Frame", frames[0])
-            cv2.waitKey(0)
-        return
-
-    if fileType == "video":
-        outputFilename = f"out/face/{filename.split(os.sep)[-1]}"
-        bufferOutputFilename = f"out/face/buffer-{filename.split(os.sep)[-1]}"
-        outputVideo = cv2.VideoWriter(
-            bufferOutputFilename, cv2.VideoWriter_fourcc(*"MP4V"), fps, (frameWidth, frameHeight)
-        )
         for frame in frames:
-            outputVideo.write(frame)
-            cv2.waitKey(1)
-        outputVideo.release()
-
-        processedFfmpegVideo = ffmpeg.input(bufferOutputFilename)
-
-        ffmpeg.concat(processedFfmpegVideo, audio, v=1, a=1).output(outputFilename, loglevel="quiet").run()
-        os.remove(bufferOutputFilename)
+            cv2.imshow("Frame", frame)
+            cv2.waitKey(1 if fileType == "video" else 0)
+        return
 
-    else:
-        outputFilename = f"out/face/{filename.split(os.sep)[-1]}"
-        if write:
-            cv2.imwrite(outputFilename, frames[0])
-    outputFilename = outputFilename.replace("buffer-", "")
+    outputFilename = outputWrite(frames, filename, fileType, "face", fps, frameShape, filename)
 
+    print(colored("Finish processing face detection", "green"))
     print(colored(f"Output written to {outputFilename}", "green"))
 
 
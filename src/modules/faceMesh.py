@@ -1,49 +1,128 @@
 import os
 import cv2
-import mediapipe as mp
-from src.modules.utils import checkFileType, readVideo
+import numpy as np
+from src.modules import metrics, renderer
+from src.modules.constants import ANNOTATION_COLOR
+from src.modules.detector import Detector, mediapipeSolutions
+from src.modules.landmarks import landmarksToArray, toLandmarkList, toPixels, toTuples
+from src.modules.resizePlan import ResizePlan
+from src.modules.utils import VideoReader, checkFileType, outputWrite
 from termcolor import colored
-import ffmpeg
 
-ANNOTATION_COLOR = (26, 246, 0)
 
-
-class FaceMeshDetector:
-    def __init__(self, staticImageMode=False, maxNumFaces=3, minDetectionConfidence=0.5, minTrackingConfidence=0.5):
-        self.mpFaceMesh = mp.solutions.face_mesh
-        self.face = self.mpFaceMesh.FaceMesh(
-            staticImageMode, maxNumFaces, minDetectionConfidence, minTrackingConfidence
-        )
-        self.mpDraw = mp.solutions.drawing_utils
+class FaceMeshDetector(Detector):
+    """Finds the face mesh landmarks of several faces with MediaPipe Face Mesh.
+
+    With `fastDraw` set, the contours are drawn by `src.modules.renderer`, which batches every line and landmark of a
+    frame into one OpenCV call each, instead of with `draw_landmarks`.
+
+    With `inferenceMaxSide` or `inferenceScale` set, the graph runs on the frame downscaled by a `ResizePlan`, while
+    the landmarks are still returned and drawn in the pixels of the frame as it came.
+    """
+
+    graphAttribute = "face"
+
+    def __init__(
+        self,
+        staticImageMode=False,
+        maxNumFaces=3,
+        minDetectionConfidence=0.5,
+        minTrackingConfidence=0.5,
+        fastDraw=False,
+        inferenceMaxSide=None,
+        inferenceScale=None,
+    ):
+        self.staticImageMode = staticImageMode
+        self.maxNumFaces = maxNumFaces
+        self.minDetectionConfidence = minDetectionConfidence
+        self.minTrackingConfidence = minTrackingConfidence
+        self.fastDraw = fastDraw
+        self.inferenceMaxSide = inferenceMaxSide
+        self.inferenceScale = inferenceScale
+        self.resizePlan = ResizePlan(inferenceMaxSide, inferenceScale)
+        solutions = mediapipeSolutions()
+        self.mpFaceMesh = solutions.face_mesh
+        self.face = self.createGraph()
+        self.mpDraw = solutions.drawing_utils
         self.drawSpec = self.mpDraw.DrawingSpec(thickness=1, circle_radius=1, color=ANNOTATION_COLOR)
+        self.renderer = renderer.Renderer(renderer.FACEMESH_CONTOURS, ANNOTATION_COLOR, 1, ANNOTATION_COLOR, 1)
+
+    def getParams(self) -> dict:
+        return {
+            "staticImageMode": self.staticImageMode,
+            "maxNumFaces": self.maxNumFaces,
+            "minDetectionConfidence": self.minDetectionConfidence,
+            "minTrackingConfidence": self.minTrackingConfidence,
+            "fastDraw": self.fastDraw,
+            "inferenceMaxSide": self.inferenceMaxSide,
+            "inferenceScale": self.inferenceScale,
+        }
+
+    def createGraph(self):
+        return self.mpFaceMesh.FaceMesh(
+            static_image_mode=self.staticImageMode,
+            max_num_faces=self.maxNumFaces,
+            min_detection_confidence=self.minDetectionConfidence,
+            min_tracking_confidence=self.minTrackingConfidence,
+        )
 
-    def findFaceMesh(self, img, draw=True):
+    def find(self, img, draw=True, **options):
+        return self.findFaceMesh(img, draw, **options)
+
+    def findFaceMesh(self, img, draw=True, asArray=False, normalised=False, rgb=None):
         """
         Returns tuple consisting of (frame, landmarks)
+        where "landmarks" is a list of `(id, x, y)` tuples per face,
+        or a float32 array of shape `(nFaces, 468, 3)` if `asArray` is set, see `src.modules.landmarks`.
+        `rgb` can hold the frame already converted to RGB, e.g. when it is shared by several detectors,
+        or be True when `img` itself is RGB.
         """
-        currResult = self.face.process(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
-        multiFacelandmarks = currResult.multi_face_landmarks
-        faces = []
-        if multiFacelandmarks:
-            for faceLandmarks in multiFacelandmarks:
-                if draw:
+        with metrics.timer("convert", "FaceMeshDetector"):
+            rgb = self.inferenceInput(img, rgb)
+        with metrics.timer("inference", "FaceMeshDetector"):
+            currResult = self.face.process(rgb)
+        multiFacelandmarks = currResult.multi_face_landmarks or []
+
+        with metrics.timer("draw", "FaceMeshDetector"):
+            if draw and self.fastDraw:
+                self.renderer.draw(img, landmarksToArray(multiFacelandmarks, 468))
+            elif draw:
+                for faceLandmarks in multiFacelandmarks:
                     self.mpDraw.draw_landmarks(img, faceLandmarks, self.mpFaceMesh.FACEMESH_CONTOURS, self.drawSpec)
-                face = []
-                for ind, landmark in enumerate(faceLandmarks.landmark):
-                    imageH, imageW, _ = img.shape
-                    x, y = int(landmark.x * imageW), int(landmark.y * imageH)
-                    face.append((ind, x, y))
-                faces.append(face)
-        return (img, faces)
-
-    def findFaceMeshInFrames(self, frames: list, draw=True):
+
+        with metrics.timer("landmarks", "FaceMeshDetector"):
+            faces = landmarksToArray(multiFacelandmarks, 468)
+            res = self.formatResult(img, faces, asArray, normalised)
+        metrics.recordDetections("FaceMeshDetector", len(faces))
+        return (img, res)
+
+    @staticmethod
+    def formatResult(img, faces, asArray=False, normalised=False):
+        """Converts normalised `(nFaces, 468, 3)` landmarks into the format returned by `findFaceMesh`"""
+        if asArray and normalised:
+            return faces.astype(np.float32)
+
+        faces = toPixels(faces, img.shape)
+        if asArray:
+            return faces.astype(np.float32)
+        return [toTuples(face) for face in faces]
+
+    def drawArray(self, img, faces):
+        """Draws normalised `(nFaces, 468, 3)` landmarks, e.g. ones that were cached rather than inferred"""
+        if self.fastDraw:
+            return self.renderer.draw(img, faces)
+        for face in faces:
+            self.mpDraw.draw_landmarks(img, toLandmarkList(face), self.mpFaceMesh.FACEMESH_CONTOURS, self.drawSpec)
+        return img
+
+    def findFaceMeshInFrames(self, frames, draw=True, **options):
         """
         Returns a list of tuples where `list[i] = (frame, landmarks)`
+
+        `frames` can be a list of frames or a `VideoReader`, in which case the tuples are yielded lazily.
+        See `Detector.findInFrames` for the `options`, e.g. running over a pool of `workers` processes.
         """
-        res = []
-        for frame in frames:
-            res.append(self.findFaceMesh(frame, draw))
-        return res
+        return self.findInFrames(frames, draw, **options)
 
 
 def main():
@@ -57,56 +136,28 @@ def main():
         print(colored("Unsupported file format", "red"))
         return
 
-    frameWidth = None
-    frameHeight = None
-
-    frames = []
+    fps = None
+    frameShape = None
 
     if fileType == "image":
-        img = cv2.imread(filename)
-        frames.append(img)
+        frames = [cv2.imread(filename)]
     else:
-        ((frames, audio), (frameWidth, frameHeight, fps)) = readVideo(filename, True, True)
-
-    print(colored(f"Finish reading {fileType}", "green"))
+        # frames are decoded, processed and encoded one at a time
+        frames = VideoReader(filename, prefetch=8)
+        fps, frameShape = frames.fps, (frames.frameWidth, frames.frameHeight)
 
     detector = FaceMeshDetector(maxNumFaces=10, minDetectionConfidence=0.3)
-    detector.findFaceMeshInFrames(frames, True)
-
-    print(colored("Finish processing face detection", "green"))
+    frames = (frame for frame, _ in detector.findFaceMeshInFrames(frames, True))
 
     if not write:
-        if fileType == "video":
-            for frame in frames:
-                cv2.imshow("Frame", frame)
-                cv2.waitKey(1)
-        else:
-            cv2.imshow("Frame", frames[0])
-            cv2.waitKey(0)
-        return
-
-    if fileType == "video":
-        outputFilename = f"out/faceMesh/{filename.split(os.sep)[-1]}"
-        bufferOutputFilename = f"out/faceMesh/buffer-{filename.split(os.sep)[-1]}"
-        outputVideo = cv2.VideoWriter(
-            bufferOutputFilename, cv2.VideoWriter_fourcc(*"MP4V"), fps, (frameWidth, frameHeight)
-        )
         for frame in frames:
-            outputVideo.write(frame)
-            cv2.waitKey(1)
-        outputVideo.release()
-
-        processedFfmpegVideo = ffmpeg.input(bufferOutputFilename)
-
-        ffmpeg.concat(processedFfmpegVideo, audio, v=1, a=1).output(outputFilename, loglevel="quiet").run()
-        os.remove(bufferOutputFilename)
+            cv2.imshow("Frame", frame)
+            cv2.waitKey(1 if fileType == "video" else 0)
+        return
 
-    else:
-        outputFilename = f"out/faceMesh/{filename.split(os.sep)[-1]}"
-        if write:
-            cv2.imwrite(outputFilename, frames[0])
-    outputFilename = outputFilename.replace("buffer-", "")
+    outputFilename = outputWrite(frames, filename, fileType, "faceMesh", fps, frameShape, filename)
 
+    print(colored("Finish processing face detection", "green"))
     print(colored(f"Output written to {outputFilename}", "green"))
 
 
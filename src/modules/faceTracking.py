@@ -0,0 +1,208 @@
+import time
+import cv2
+import numpy as np
+from src.modules.faceDetection import ANNOTATION_COLOR, FaceDetector
+from src.modules.utils import VideoReader
+
+
+def boxIou(boxA, boxB) -> float:
+    """Intersection over union of two `(x, y, width, height)` boxes"""
+    xA, yA = max(boxA[0], boxB[0]), max(boxA[1], boxB[1])
+    xB, yB = min(boxA[0] + boxA[2], boxB[0] + boxB[2]), min(boxA[1] + boxA[3], boxB[1] + boxB[3])
+    intersection = max(0.0, xB - xA) * max(0.0, yB - yA)
+    union = boxA[2] * boxA[3] + boxB[2] * boxB[3] - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+class FaceTracker:
+    """Detect-then-track wrapper around `FaceDetector`.
+
+    The detector only runs every `interval` frames, or as soon as the tracking confidence of a face drops below
+    `minTrackingConfidence`. In between, each box is carried forward with sparse Lucas-Kanade optical flow of
+    corners found inside it, computed on a copy of the frame downscaled to `trackingMaxSide`. `interval` adapts to
+    the motion in the video, shrinking when faces move quickly and growing while they stay still. Every face keeps a
+    stable track ID across frames.
+
+    Results are returned in the same `(id, boundingBox, detectionScore)` format as `FaceDetector.findFace`,
+    with the track ID as the id.
+    """
+
+    def __init__(
+        self,
+        detector: FaceDetector = None,
+        interval=5,
+        minInterval=1,
+        maxInterval=30,
+        minTrackingConfidence=0.6,
+        maxCorners=30,
+        minMatchIou=0.3,
+        trackingMaxSide=480,
+    ):
+        self.detector = detector or FaceDetector()
+        self.interval = interval
+        self.minInterval = minInterval
+        self.maxInterval = maxInterval
+        self.minTrackingConfidence = minTrackingConfidence
+        self.maxCorners = maxCorners
+        self.minMatchIou = minMatchIou
+        self.trackingMaxSide = trackingMaxSide
+        self.lkParams = {
+            "winSize": (21, 21),
+            "maxLevel": 3,
+            "criteria": (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 20, 0.03),
+        }
+        self.reset()
+
+    def reset(self):
+        # trackId => {"box": np.ndarray (x, y, width, height), "score": float, "points": np.ndarray (n, 1, 2)}
+        self.tracks = {}
+        self.nextTrackId = 0
+        self.prevGray = None
+        self.framesSinceDetection = 0
+        self.framesProcessed = 0
+        self.detectorCalls = 0
+
+    def _findCorners(self, gray, box):
+        x, y, w, h = np.clip(box * self.trackingScale, 0, None).astype(int)
+        # only search inside the box rather than masking the whole frame
+        corners = cv2.goodFeaturesToTrack(gray[y : y + h, x : x + w], self.maxCorners, 0.01, 3)
+        if corners is None:
+            return np.empty((0, 1, 2), np.float32)
+        return corners + np.array([x, y], np.float32)
+
+    def _detect(self, img, gray):
+        _, boxes = self.detector.findFace(img, False, asArray=True)
+        self.detectorCalls += 1
+        self.framesSinceDetection = 0
+
+        # keep the track ID of the existing face that overlaps each detection the most
+        tracks = {}
+        unmatched = dict(self.tracks)
+        for box in boxes.astype(np.float64):
+            bestId, bestIou = None, self.minMatchIou
+            for trackId, track in unmatched.items():
+                iou = boxIou(box[:4], track["box"])
+                if iou >= bestIou:
+                    bestId, bestIou = trackId, iou
+            if bestId is None:
+                bestId = self.nextTrackId
+                self.nextTrackId += 1
+            else:
+                del unmatched[bestId]
+            tracks[bestId] = {"box": box[:4], "score": float(box[4]), "points": self._findCorners(gray, box[:4])}
+        self.tracks = tracks
+
+    def _track(self, gray) -> bool:
+        """Moves every box along the optical flow, returning False when a face can no longer be tracked reliably"""
+        if not self.tracks:
+            return True
+        tracks = list(self.tracks.values())
+        if any(len(track["points"]) < 4 for track in tracks):
+            return False
+
+        # the corners of every face go through a single optical flow call
+        points = np.concatenate([track["points"] for track in tracks])
+        newPoints, status, _ = cv2.calcOpticalFlowPyrLK(self.prevGray, gray, points, None, **self.lkParams)
+        owners = np.repeat(np.arange(len(tracks)), [len(track["points"]) for track in tracks])
+        found = status.ravel() == 1
+
+        motions = []
+        for ind, track in enumerate(tracks):
+            ownPoints = owners == ind
+            good = ownPoints & found
+            if good.sum() < max(4, self.minTrackingConfidence * ownPoints.sum()):
+                return False
+
+            oldGood, newGood = points[good, 0], newPoints[good, 0]
+            shift = np.median(newGood - oldGood, axis=0)
+            # the spread of the corners around their centre tells how much the face grew or shrank
+            oldSpread = np.linalg.norm(oldGood - oldGood.mean(axis=0), axis=1)
+            newSpread = np.linalg.norm(newGood - newGood.mean(axis=0), axis=1)
+            scale = np.median(newSpread / np.maximum(oldSpread, 1e-6))
+
+            x, y, w, h = track["box"]
+            shift = shift / self.trackingScale
+            centreX, centreY = x + w / 2 + shift[0], y + h / 2 + shift[1]
+            w, h = w * scale, h * scale
+            track["box"] = np.array([centreX - w / 2, centreY - h / 2, w, h])
+            track["points"] = newGood.reshape(-1, 1, 2)
+            motions.append(np.linalg.norm(shift) / max(w, 1.0))
+
+        self._adaptInterval(max(motions))
+        return True
+
+    def _adaptInterval(self, motion: float):
+        # motion is the displacement per frame relative to the size of the face
+        if motion > 0.05:
+            self.interval = max(self.minInterval, self.interval // 2)
+        elif motion < 0.01:
+            self.interval = min(self.maxInterval, self.interval + 1)
+
+    def findFace(self, img, draw=True):
+        # optical flow runs on a downscaled copy of the frame, the boxes stay in full resolution
+        self.trackingScale = min(1.0, self.trackingMaxSide / max(img.shape[:2]))
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        gray = cv2.resize(gray, None, fx=self.trackingScale, fy=self.trackingScale, interpolation=cv2.INTER_LINEAR)
+        self.framesProcessed += 1
+        self.framesSinceDetection += 1
+
+        if self.prevGray is None or self.framesSinceDetection >= self.interval or not self._track(gray):
+            self._detect(img, gray)
+        self.prevGray = gray
+
+        boundingBoxes = []
+        for trackId, track in self.tracks.items():
+            boundingBox = tuple(track["box"].astype(int).tolist())
+            boundingBoxes.append((trackId, boundingBox, [track["score"]]))
+            if draw:
+                img = self.detector.customDraw(img, boundingBox)
+                cv2.putText(
+                    img,
+                    f"#{trackId} {int(track['score'] * 100)}%",
+                    (boundingBox[0], boundingBox[1] - 20),
+                    cv2.FONT_HERSHEY_PLAIN,
+                    2,
+                    ANNOTATION_COLOR,
+                    2,
+                )
+        return (img, boundingBoxes)
+
+    def findFaceInFrames(self, frames, draw=True):
+        """
+        Returns a list of tuples where `list[i] = (frame, landmarks)`
+
+        `frames` can be a list of frames or a `VideoReader`, in which case the tuples are yielded lazily.
+        """
+        res = (self.findFace(frame, draw) for frame in frames)
+        return res if isinstance(frames, VideoReader) else list(res)
+
+
+def compareWithDetection(frames: list, detector: FaceDetector = None, **trackerOptions) -> dict:
+    """Measures the speed-up of `FaceTracker` over running `FaceDetector` on every frame of `frames`,
+    along with how closely the tracked boxes follow the detected ones (mean IoU).
+    """
+    detector = detector or FaceDetector()
+
+    start = time.perf_counter()
+    detected = [detector.findFace(frame, False)[1] for frame in frames]
+    detectionSeconds = time.perf_counter() - start
+
+    tracker = FaceTracker(detector, **trackerOptions)
+    start = time.perf_counter()
+    tracked = [tracker.findFace(frame, False)[1] for frame in frames]
+    trackingSeconds = time.perf_counter() - start
+
+    ious = [
+        max((boxIou(box, trackedBox) for _, trackedBox, _ in trackedFaces), default=0.0)
+        for detectedFaces, trackedFaces in zip(detected, tracked)
+        for _, box, _ in detectedFaces
+    ]
+
+    return {
+        "frames": len(frames),
+        "detectionSeconds": detectionSeconds,
+        "trackingSeconds": trackingSeconds,
+        "speedUp": detectionSeconds / trackingSeconds if trackingSeconds else float("inf"),
+        "detectorCalls": tracker.detectorCalls,
+        "meanIou": float(np.mean(ious)) if ious else None,
+    }
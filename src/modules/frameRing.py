@@ -0,0 +1,216 @@
+import os
+import threading
+import time
+from multiprocessing import shared_memory
+import numpy as np
+
+# states of a slot, see `FrameRing`
+FREE, WRITING, READY, CLAIMED = range(4)
+# columns of the control table
+_SEQUENCE, _STATE, _PID = range(3)
+# frames start on a cache line, after the control table
+_ALIGNMENT = 64
+# the most bytes of shared memory `ringSlots` sizes a ring to
+DEFAULT_BUDGET = 1 << 30
+
+
+class FrameRing:
+    """A fixed ring of frame slots in shared memory, so that frames are handed to worker processes without being
+    pickled: the producer writes a frame into a slot and sends its small `(slot, sequence)` handle, and workers read
+    and annotate the frame in place through a NumPy view of the slot.
+
+    Each slot goes FREE -> WRITING -> READY -> CLAIMED -> FREE. Only the producer frees a slot, once it has the
+    result of the frame, and every reuse of a slot bumps its sequence number, so a stale handle is refused rather
+    than reading the next frame. Workers record their pid when they claim a slot, and `reclaim` frees the slots of
+    workers that died holding them.
+
+    The producer creates the ring and owns the shared memory, which is freed when it is closed.
+    Workers `attach` to it from its `spec`.
+
+    Usage:
+    ```python
+    with FrameRing((1920, 1080), slots=16) as ring:
+        handle = ring.write(frame)
+        pool.submit(work, ring.spec, handle)  # in the worker: FrameRing.attach(spec).view(handle)
+        ...
+        annotated = ring.read(handle)
+        ring.release(handle)
+    ```
+
+    Args:
+        frameShape (tuple[int, int]): `(frameWidth, frameHeight)` of the frames, which are BGR uint8.
+        slots (int): Number of frames the ring holds at once.
+        name (str, optional): Name of the shared memory to attach to rather than creating it, see `attach`.
+    """
+
+    def __init__(self, frameShape: tuple[int, int], slots: int, name=None):
+        self.frameWidth, self.frameHeight = frameShape
+        self.slots = slots
+        self.owner = name is None
+        frameBytes = self.frameHeight * self.frameWidth * 3
+        controlBytes = -(-slots * 3 * 8 // _ALIGNMENT) * _ALIGNMENT
+
+        if self.owner:
+            self.memory = shared_memory.SharedMemory(create=True, size=controlBytes + slots * frameBytes)
+        else:
+            self.memory = shared_memory.SharedMemory(name)
+        self.control = np.ndarray((slots, 3), np.int64, self.memory.buf)
+        self.frames = np.ndarray((slots, self.frameHeight, self.frameWidth, 3), np.uint8, self.memory.buf, controlBytes)
+        if self.owner:
+            self.control.fill(0)
+
+        # the producer side may be used from several threads
+        self.condition = threading.Condition()
+        self.nextSlot = 0
+
+    @property
+    def spec(self) -> tuple:
+        """What a worker needs to `attach` to the ring, small enough to send along with every task"""
+        return (self.memory.name, (self.frameWidth, self.frameHeight), self.slots)
+
+    @classmethod
+    def attach(cls, spec: tuple) -> "FrameRing":
+        name, frameShape, slots = spec
+        return cls(frameShape, slots, name)
+
+    def fits(self, frame) -> bool:
+        """Whether `frame` can be written to the ring"""
+        return frame.dtype == np.uint8 and frame.shape == self.frames.shape[1:]
+
+    def acquire(self, timeout=None) -> tuple:
+        """Takes a free slot for writing, waiting for one to be released if the ring is full.
+        Returns `(handle, view)` where the frame is to be written into `view`, e.g. by `cv2.VideoCapture.read(view)`,
+        before passing `handle` to `publish`.
+
+        Raises:
+            TimeoutError: When no slot was released within `timeout` seconds.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            while True:
+                free = np.flatnonzero(self.control[:, _STATE] == FREE)
+                if len(free):
+                    # slots are taken round-robin, so that a freed slot is reused as late as possible
+                    slot = int(free[np.argmin((free - self.nextSlot) % self.slots)])
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError(f"No frame slot was released within {timeout}s")
+                self.condition.wait(remaining)
+
+            self.nextSlot = (slot + 1) % self.slots
+            self.control[slot, _SEQUENCE] += 1
+            self.control[slot, _STATE] = WRITING
+            self.control[slot, _PID] = 0
+            return ((slot, int(self.control[slot, _SEQUENCE])), self.frames[slot])
+
+    def publish(self, handle: tuple):
+        """Marks the frame written into an acquired slot as ready for the workers"""
+        self._check(handle, WRITING)
+        self.control[handle[0], _STATE] = READY
+
+    def write(self, frame, timeout=None) -> tuple:
+        """Copies `frame` into a free slot and returns its handle"""
+        handle, view = self.acquire(timeout)
+        np.copyto(view, frame)
+        self.publish(handle)
+        return handle
+
+    def view(self, handle: tuple) -> np.ndarray:
+        """Claims a ready frame for the calling process and returns a writable view of it, without copying.
+
+        Raises:
+            ValueError: When the slot was released and reused since the handle was issued.
+        """
+        slot, _ = self._check(handle, READY, CLAIMED)
+        self.control[slot, _PID] = os.getpid()
+        self.control[slot, _STATE] = CLAIMED
+        return self.frames[slot]
+
+    def read(self, handle: tuple, copy=True) -> np.ndarray:
+        """Returns the frame of a slot, e.g. once a worker has annotated it, as a copy unless `copy` is False,
+        in which case the view is only valid until the slot is released
+        """
+        slot, _ = self._check(handle, READY, CLAIMED)
+        return self.frames[slot].copy() if copy else self.frames[slot]
+
+    def release(self, handle: tuple):
+        """Frees a slot for the producer to reuse. Releasing a slot that was already reused does nothing."""
+        slot, sequence = handle
+        with self.condition:
+            if self.control[slot, _SEQUENCE] == sequence and self.control[slot, _STATE] != FREE:
+                self.control[slot, _STATE] = FREE
+                self.control[slot, _PID] = 0
+                self.condition.notify()
+
+    def reclaim(self) -> int:
+        """Frees the slots claimed by processes that no longer exist, e.g. crashed workers, and returns how many"""
+        reclaimed = 0
+        with self.condition:
+            for slot in np.flatnonzero(self.control[:, _STATE] == CLAIMED).tolist():
+                pid = int(self.control[slot, _PID])
+                if pid and not _isAlive(pid):
+                    self.control[slot, _STATE] = FREE
+                    self.control[slot, _PID] = 0
+                    reclaimed += 1
+            if reclaimed:
+                self.condition.notify_all()
+        return reclaimed
+
+    def getStats(self) -> dict:
+        """Returns how many slots are in each state"""
+        states = np.bincount(self.control[:, _STATE], minlength=4)
+        return {
+            "free": int(states[FREE]),
+            "writing": int(states[WRITING]),
+            "ready": int(states[READY]),
+            "claimed": int(states[CLAIMED]),
+        }
+
+    def _check(self, handle: tuple, *states) -> tuple:
+        slot, sequence = handle
+        if self.control[slot, _SEQUENCE] != sequence or self.control[slot, _STATE] not in states:
+            raise ValueError(f"Frame slot {slot} was reused since sequence {sequence} was written")
+        return handle
+
+    def close(self):
+        """Detaches from the shared memory, and frees it if this is the ring that created it"""
+        # the views must go before the memory can be unmapped
+        self.control = self.frames = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+def ringSlots(frameShape: tuple[int, int], slots: int, budget=DEFAULT_BUDGET) -> int:
+    """Returns how many of `slots` frames of `(frameWidth, frameHeight)` a ring can hold within `budget` bytes and
+    half of the free space of /dev/shm.
+
+    /dev/shm is a tmpfs, which only hands out its pages as they are written, so creating an oversized ring succeeds
+    and it is the first write past the free space that kills the process with SIGBUS. The ring must therefore be
+    sized before it is created.
+    """
+    frameWidth, frameHeight = frameShape
+    try:
+        stat = os.statvfs("/dev/shm")
+        budget = min(budget, stat.f_bavail * stat.f_frsize // 2)
+    except (AttributeError, OSError):
+        # e.g. Windows or macOS, whose shared memory is not backed by /dev/shm
+        pass
+    return max(0, min(slots, budget // (frameWidth * frameHeight * 3)))
+
+
+def _isAlive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
@@ -0,0 +1,158 @@
+import hashlib
+import json
+import os
+import cv2
+import numpy as np
+from src.modules.utils import VideoReader, hashFile
+
+DEFAULT_STORE_DIRECTORY = os.path.join(os.path.expanduser("~"), ".cache", "computer-vision", "frames")
+MAGIC = "computer-vision-frames"
+# bump whenever the layout of the store files changes
+STORE_VERSION = 1
+# the JSON header is padded to this many bytes, so that the frames start on a page boundary
+HEADER_BYTES = 4096
+
+
+class FrameStore:
+    """The frames of a video decoded once into a raw file, and memory-mapped from then on, so that running several
+    detectors or parameter sweeps over the same clip does not decode it again each time.
+
+    A store file holds a JSON header with the shape, dtype, fps and source of the frames, the frames themselves, and
+    a frame index of their timestamps. Frames are handed out as NumPy views into the mapping, by index, slice or time
+    range, and any number of processes can read the same file at once. The mapping is copy-on-write: drawing on a
+    frame changes it for this `FrameStore` object only, never in the file.
+
+    `open` rebuilds the store when the source file changed since it was decoded.
+    A store can be passed anywhere a list of frames is accepted, e.g. to `find*InFrames`, and it keeps the `path` of
+    its source so that a `LandmarkCache` recognises it.
+
+    Usage:
+    ```python
+    store = FrameStore.open("assets/ben0.mp4")
+    results = PoseDetector().findPoseInFrames(store, False)
+    clip = store.timeRange(2.0, 4.5)  # (nFrames, height, width, 3) view
+    ```
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        with open(filename, "rb") as file:
+            self.header = json.loads(file.read(HEADER_BYTES).rstrip(b"\0"))
+        if self.header.get("magic") != MAGIC or self.header.get("version") != STORE_VERSION:
+            raise ValueError(f"{filename} is not a frame store of version {STORE_VERSION}")
+
+        self.path = self.header["source"]["path"]
+        self.frameCount = self.header["frameCount"]
+        self.frameHeight, self.frameWidth, _ = self.header["shape"]
+        self.fps = self.header["fps"]
+        shape = (self.frameCount, *self.header["shape"])
+        if self.frameCount:
+            # plain views of the mappings, which stay mapped for as long as a view of them is alive
+            self.frames = np.asarray(np.memmap(filename, self.header["dtype"], "c", HEADER_BYTES, shape))
+            self.timestamps = np.asarray(
+                np.memmap(filename, np.float64, "r", self.header["indexOffset"], (self.frameCount,))
+            )
+        else:
+            self.frames = np.empty(shape, self.header["dtype"])
+            self.timestamps = np.empty(0)
+
+    @staticmethod
+    def storeFilename(source: str, directory=DEFAULT_STORE_DIRECTORY) -> str:
+        """Returns the file the frames of `source` are stored in"""
+        name = hashlib.sha256(os.path.abspath(source).encode()).hexdigest()[:24]
+        return os.path.join(directory, f"{name}.frames")
+
+    @classmethod
+    def open(cls, source: str, directory=DEFAULT_STORE_DIRECTORY) -> "FrameStore":
+        """Returns the store of the video at `source`, decoding it first if it was never decoded or has changed"""
+        filename = cls.storeFilename(source, directory)
+        if os.path.exists(filename):
+            try:
+                store = cls(filename)
+                if store.isValid():
+                    return store
+            except (ValueError, json.JSONDecodeError):
+                pass
+        return cls.build(source, filename)
+
+    @classmethod
+    def build(cls, source: str, filename: str) -> "FrameStore":
+        """Decodes every frame of the video at `source` into the store file `filename` and returns the store"""
+        stat = os.stat(source)
+        reader = VideoReader(source)
+        header = {
+            "magic": MAGIC,
+            "version": STORE_VERSION,
+            "shape": [reader.frameHeight, reader.frameWidth, 3],
+            "dtype": "uint8",
+            "fps": reader.fps,
+            "source": {
+                "path": os.path.abspath(source),
+                "size": stat.st_size,
+                "mtime": stat.st_mtime,
+                "hash": hashFile(source),
+            },
+        }
+
+        os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+        # concurrent builds each write their own file, and readers of an older store keep their mapping
+        temporaryFilename = f"{filename}.{os.getpid()}.tmp"
+        try:
+            timestamps = []
+            with open(temporaryFilename, "wb") as file:
+                file.seek(HEADER_BYTES)
+                for frame in reader:
+                    timestamps.append(reader.cap.get(cv2.CAP_PROP_POS_MSEC) / 1000)
+                    file.write(np.ascontiguousarray(frame, np.uint8).data)
+
+                header["frameCount"] = len(timestamps)
+                header["indexOffset"] = file.tell()
+                file.write(np.array(timestamps, np.float64).tobytes())
+                file.seek(0)
+                file.write(json.dumps(header).encode().ljust(HEADER_BYTES, b"\0"))
+            os.replace(temporaryFilename, filename)
+        finally:
+            reader.release()
+            if os.path.exists(temporaryFilename):
+                os.remove(temporaryFilename)
+        return cls(filename)
+
+    def isValid(self) -> bool:
+        """Whether the source file is unchanged since it was decoded, only hashing it again when its size or
+        modification time changed
+        """
+        source = self.header["source"]
+        if not os.path.exists(source["path"]):
+            return False
+        stat = os.stat(source["path"])
+        if stat.st_size == source["size"] and stat.st_mtime == source["mtime"]:
+            return True
+        return stat.st_size == source["size"] and hashFile(source["path"]) == source["hash"]
+
+    def __len__(self):
+        return self.frameCount
+
+    def __getitem__(self, index):
+        """Returns a view of a frame, or of a range of frames for a slice"""
+        return self.frames[index]
+
+    def __iter__(self):
+        return iter(self.frames)
+
+    def indexAt(self, seconds: float) -> int:
+        """Returns the index of the first frame shown at or after `seconds`"""
+        return int(np.searchsorted(self.timestamps, seconds - 1e-6))
+
+    def timeRange(self, startSeconds: float, endSeconds: float) -> np.ndarray:
+        """Returns a `(nFrames, height, width, 3)` view of the frames shown from `startSeconds` up to `endSeconds`"""
+        return self.frames[self.indexAt(startSeconds) : self.indexAt(endSeconds)]
+
+    def close(self):
+        """Drops the mapping of the store, which is unmapped once the views handed out are gone as well"""
+        self.frames = self.timestamps = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
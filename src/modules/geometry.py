@@ -0,0 +1,94 @@
+"""Vectorised geometry on landmark arrays of shape `(..., nLandmarks, 2 | 3)`, e.g. `(frames, landmarks, 2)`.
+
+Every function computes a whole clip in a single NumPy call, see `src.modules.landmarks` for the array layout.
+"""
+
+import numpy as np
+
+FINGERTIP_IDS = np.array([4, 8, 12, 16, 20])
+WRIST_ID = 0
+MIDDLE_FINGER_MCP_ID = 9
+
+
+def jointAngles(points, triples) -> np.ndarray:
+    """Computes ∠ABC in degrees within [0, 360) for every `(A, B, C)` landmark triple, using x and y only.
+
+    Returns:
+        np.ndarray: Shape `(..., len(triples))`
+    """
+    points = np.asarray(points, dtype=np.float64)
+    triples = np.asarray(triples).reshape(-1, 3)
+    a, b, c = (points[..., triples[:, ind], :2] for ind in range(3))
+
+    angles = np.degrees(
+        np.arctan2(c[..., 1] - b[..., 1], c[..., 0] - b[..., 0])
+        - np.arctan2(a[..., 1] - b[..., 1], a[..., 0] - b[..., 0])
+    )
+    return np.mod(angles, 360)
+
+
+def distances(points, pairs, dims=2) -> np.ndarray:
+    """Computes the euclidean distance between the landmarks of every `(A, B)` pair over the first `dims` coordinates.
+
+    Returns:
+        np.ndarray: Shape `(..., len(pairs))`
+    """
+    points = np.asarray(points, dtype=np.float64)[..., :dims]
+    pairs = np.asarray(pairs).reshape(-1, 2)
+    return np.linalg.norm(points[..., pairs[:, 0], :] - points[..., pairs[:, 1], :], axis=-1)
+
+
+def pairwiseDistances(points, dims=2) -> np.ndarray:
+    """Computes the distance between every two landmarks over the first `dims` coordinates.
+
+    Returns:
+        np.ndarray: Shape `(..., nLandmarks, nLandmarks)`
+    """
+    points = np.asarray(points, dtype=np.float64)[..., :dims]
+    return np.linalg.norm(points[..., :, np.newaxis, :] - points[..., np.newaxis, :, :], axis=-1)
+
+
+def isRightHand(hands) -> np.ndarray:
+    """Guesses the handedness of `(..., 21, 2 | 3)` hands: if the index finger metacarpophalangeal joint
+    is on the right hand side of the pinky MCP joint, it is the right hand.
+    """
+    hands = np.asarray(hands)
+    return hands[..., 5, 0] > hands[..., 17, 0]
+
+
+def fingerStates(hands, rightHand=None) -> np.ndarray:
+    """Computes whether each finger of `(..., 21, 2 | 3)` hands is up (1) or down (0), starting from the thumb.
+
+    Args:
+        hands: Hand landmarks in pixel or normalised coordinates.
+        rightHand (optional): Boolean array of shape `(...)`, e.g. from MediaPipe's handedness.
+            Defaults to None and thus the handedness is guessed with `isRightHand`.
+
+    Returns:
+        np.ndarray: int8 array of shape `(..., 5)`
+    """
+    hands = np.asarray(hands)
+    rightHand = isRightHand(hands) if rightHand is None else np.asarray(rightHand)
+
+    # edge case => the thumb, which folds sideways rather than downwards
+    thumbX, thumbIpX = hands[..., 4, 0], hands[..., 3, 0]
+    thumbDown = np.where(rightHand, thumbX < thumbIpX, thumbX > thumbIpX)
+
+    # the other fingers are up when the tip is above the proximal interphalangeal joint
+    fingersUp = hands[..., FINGERTIP_IDS[1:], 1] < hands[..., FINGERTIP_IDS[1:] - 2, 1]
+
+    return np.concatenate([~thumbDown[..., np.newaxis], fingersUp], axis=-1).astype(np.int8)
+
+
+def handSize(hands) -> np.ndarray:
+    """Measures `(..., 21, 2 | 3)` hands as the distance between the wrist and the middle finger MCP joint"""
+    return distances(hands, [(WRIST_ID, MIDDLE_FINGER_MCP_ID)])[..., 0]
+
+
+def normaliseHands(hands) -> np.ndarray:
+    """Centres `(..., 21, 2 | 3)` hands on the wrist and scales them to a hand size of 1,
+    so that gestures can be compared regardless of the distance to the camera.
+    """
+    hands = np.asarray(hands, dtype=np.float64)
+    size = handSize(hands)[..., np.newaxis, np.newaxis]
+    return (hands - hands[..., WRIST_ID : WRIST_ID + 1, :]) / size
@@ -1,45 +1,153 @@
 import os
 import cv2
-import mediapipe as mp
-from src.modules.utils import checkFileType, readVideo
+import numpy as np
+from src.modules import geometry, metrics, renderer
+from src.modules.constants import ANNOTATION_COLOR, EMPHASIS_COLOR, LANDMARK_COLOR
+from src.modules.detector import Detector, mediapipeSolutions
+from src.modules.landmarks import landmarksToArray, toLandmarkList, toPixels, toTuples
+from src.modules.resizePlan import ResizePlan
+from src.modules.roi import landmarksToRoi, roiOverlap, roiToFrame
+from src.modules.utils import VideoReader, checkFileType, outputWrite
 from termcolor import colored
 from typing import List, Tuple
 
-if __name__ == "__main__":
-    import ffmpeg
-
-ANNOTATION_COLOR = (26, 246, 0)
-EMPHASIS_COLOR = (26, 0, 246)
 
-
-class HandDetector:
-    def __init__(self, staticImageMode=False, maxNumHands=2, minDetectionConfidence=0.5, minTrackingConfidence=0.5):
-        # get the hands recognition object
+class HandDetector(Detector):
+    """Finds hand landmarks with MediaPipe Hands.
+
+    With `roiMode` set, only a crop around each hand found in the previous frame goes through MediaPipe, expanded by
+    `roiMargin` times the size of the hand on every side. Each hand gets its own ROI and graph. The whole frame is
+    searched again as soon as a hand is lost, and every `roiSearchInterval` frames while fewer than `maxNumHands`
+    hands are tracked, so that new hands are picked up. See `getRoiStats` for tuning the margin.
+
+    With `fastDraw` set, hands are drawn in a single colour by `src.modules.renderer`, which batches every line and
+    landmark of a frame into one OpenCV call each, instead of with the per-finger MediaPipe style.
+
+    With `inferenceMaxSide` or `inferenceScale` set, the graph runs on the frame downscaled by a `ResizePlan`, while
+    the landmarks are still returned and drawn in the pixels of the frame as it came.
+    """
+
+    graphAttribute = "hands"
+
+    def __init__(
+        self,
+        staticImageMode=False,
+        maxNumHands=2,
+        minDetectionConfidence=0.5,
+        minTrackingConfidence=0.5,
+        roiMode=False,
+        roiMargin=0.5,
+        roiSearchInterval=15,
+        fastDraw=False,
+        inferenceMaxSide=None,
+        inferenceScale=None,
+    ):
+        self.staticImageMode = staticImageMode
         self.maxNumHands = maxNumHands
-        self.mpHands = mp.solutions.hands
-        self.hands = self.mpHands.Hands(staticImageMode, maxNumHands, minDetectionConfidence, minTrackingConfidence)
-        self.mpDraw = mp.solutions.drawing_utils
+        self.minDetectionConfidence = minDetectionConfidence
+        self.minTrackingConfidence = minTrackingConfidence
+        self.roiMode = roiMode
+        self.roiMargin = roiMargin
+        self.roiSearchInterval = roiSearchInterval
+        self.fastDraw = fastDraw
+        self.inferenceMaxSide = inferenceMaxSide
+        self.inferenceScale = inferenceScale
+        self.resizePlan = ResizePlan(inferenceMaxSide, inferenceScale)
+        # one single-hand graph per ROI, created on first use
+        self.roiGraphs = []
+        self.rois = []
+        self.framesSinceSearch = 0
+        self.roiStats = {"frames": 0, "hits": 0, "misses": 0, "fullSearches": 0}
+        # get the hands recognition object
+        solutions = mediapipeSolutions()
+        self.mpHands = solutions.hands
+        self.hands = self.createGraph()
+        self.mpDraw = solutions.drawing_utils
         self.drawingSpec = self.mpDraw.DrawingSpec(ANNOTATION_COLOR)
-        self.mpDrawingStyles = mp.solutions.drawing_styles
+        self.mpDrawingStyles = solutions.drawing_styles
+        self.renderer = renderer.Renderer(renderer.HAND_CONNECTIONS, ANNOTATION_COLOR, 2, LANDMARK_COLOR, 4)
         self.fingertipIds = [4, 8, 12, 16, 20]
 
-    def findHands(self, img, draw=True):
-        currResult = self.hands.process(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
-        allHandLandmarks = currResult.multi_hand_landmarks
-        hands = []
-        if allHandLandmarks:
-            counter = 0
-            for handLandmarks in allHandLandmarks:
-                if counter == self.maxNumHands:
-                    break
-                hand = []
-                for ind, landmark in enumerate(handLandmarks.landmark):
-                    imageH, imageW, _ = img.shape
-                    x, y = int(landmark.x * imageW), int(landmark.y * imageH)
-                    hand.append((ind, x, y))
-                hands.append(hand)
+    def getParams(self) -> dict:
+        return {
+            "staticImageMode": self.staticImageMode,
+            "maxNumHands": self.maxNumHands,
+            "minDetectionConfidence": self.minDetectionConfidence,
+            "minTrackingConfidence": self.minTrackingConfidence,
+            "roiMode": self.roiMode,
+            "roiMargin": self.roiMargin,
+            "roiSearchInterval": self.roiSearchInterval,
+            "fastDraw": self.fastDraw,
+            "inferenceMaxSide": self.inferenceMaxSide,
+            "inferenceScale": self.inferenceScale,
+        }
+
+    def createGraph(self, maxNumHands=None):
+        return self.mpHands.Hands(
+            static_image_mode=self.staticImageMode,
+            max_num_hands=maxNumHands or self.maxNumHands,
+            min_detection_confidence=self.minDetectionConfidence,
+            min_tracking_confidence=self.minTrackingConfidence,
+        )
 
+    def reset(self):
+        super().reset()
+        self.rois = []
+        self.framesSinceSearch = 0
+        self._resetRoiGraphs()
+
+    def _resetRoiGraphs(self):
+        """Drops the tracking state of the crop graphs, where the graphs can reset it. Older MediaPipe graphs cannot,
+        and recreating them costs more than their tracking falling back on palm detection by itself.
+        """
+        for graph in self.roiGraphs:
+            if hasattr(graph, "reset"):
+                graph.reset()
+
+    def close(self):
+        super().close()
+        for graph in self.roiGraphs:
+            graph.close()
+        self.roiGraphs = []
+
+    def find(self, img, draw=True, **options):
+        return self.findHands(img, draw, **options)
+
+    def findHands(self, img, draw=True, asArray=False, normalised=False, rgb=None):
+        """
+        Returns a tuple structured as `(img, hands)` where "hands" is a list of `(id, x, y)` tuples per hand,
+        or a float32 array of shape `(nHands, 21, 3)` if `asArray` is set, see `src.modules.landmarks`.
+        `rgb` can hold the frame already converted to RGB, e.g. when it is shared by several detectors,
+        or be True when `img` itself is RGB.
+        """
+        if self.roiMode:
+            with metrics.timer("inference", "HandDetector"):
+                # the ROIs live in the pixels of the frame inferred on, and the crops are converted on their own
+                # unless the frame is RGB already
+                if rgb is None:
+                    hands = self._findHandsInRois(self.resizePlan.apply(img))
+                else:
+                    small = self.resizePlan.apply(img if rgb is True else rgb)
+                    hands = self._findHandsInRois(small, small)
+            with metrics.timer("draw", "HandDetector"):
                 if draw:
+                    self.drawArray(img, hands)
+            with metrics.timer("landmarks", "HandDetector"):
+                res = self.formatResult(img, hands, asArray, normalised)
+            metrics.recordDetections("HandDetector", len(hands))
+            return (img, res)
+
+        with metrics.timer("convert", "HandDetector"):
+            rgb = self.inferenceInput(img, rgb)
+        with metrics.timer("inference", "HandDetector"):
+            currResult = self.hands.process(rgb)
+        allHandLandmarks = (currResult.multi_hand_landmarks or [])[: self.maxNumHands]
+
+        with metrics.timer("draw", "HandDetector"):
+            if draw and self.fastDraw:
+                self.renderer.draw(img, landmarksToArray(allHandLandmarks, 21))
+            elif draw:
+                for handLandmarks in allHandLandmarks:
                     self.mpDraw.draw_landmarks(
                         img,
                         handLandmarks,
@@ -47,88 +155,155 @@ class HandDetector:
                         self.mpDrawingStyles.get_default_hand_landmarks_style(),
                         self.drawingSpec,
                     )
-                counter += 1
-        return (img, hands)
 
-    def findHandsInFrames(self, frames: list, draw=True):
+        with metrics.timer("landmarks", "HandDetector"):
+            hands = landmarksToArray(allHandLandmarks, 21)
+            res = self.formatResult(img, hands, asArray, normalised)
+        metrics.recordDetections("HandDetector", len(hands))
+        return (img, res)
+
+    def _findHandsInRois(self, img, rgb=None) -> np.ndarray:
+        """Returns the normalised `(nHands, 21, 3)` landmarks found in the ROIs of the previous frame,
+        falling back to the whole frame when a hand is lost or it is time to look for new hands.
+        """
+        self.roiStats["frames"] += 1
+        self.framesSinceSearch += 1
+
+        hands = []
+        lost = False
+        for ind, (xStart, yStart, xEnd, yEnd) in enumerate(self.rois):
+            if ind == len(self.roiGraphs):
+                self.roiGraphs.append(self.createGraph(maxNumHands=1))
+            if rgb is None:
+                cropResult = self.roiGraphs[ind].process(cv2.cvtColor(img[yStart:yEnd, xStart:xEnd], cv2.COLOR_BGR2RGB))
+            else:
+                cropResult = self.roiGraphs[ind].process(np.ascontiguousarray(rgb[yStart:yEnd, xStart:xEnd]))
+            if not cropResult.multi_hand_landmarks:
+                self.roiStats["misses"] += 1
+                lost = True
+                break
+            self.roiStats["hits"] += 1
+            cropHand = landmarksToArray(cropResult.multi_hand_landmarks[:1], 21)[0]
+            hands.append(roiToFrame(cropHand, self.rois[ind], img.shape))
+
+        searchDue = len(self.rois) < self.maxNumHands and self.framesSinceSearch >= self.roiSearchInterval
+        if lost or not self.rois or searchDue:
+            self.roiStats["fullSearches"] += 1
+            self.framesSinceSearch = 0
+            # a lost hand only drops the ROIs: the full-frame graph is not reset, as that rebuilds it on older
+            # MediaPipe, and its tracking falls back on palm detection by itself once the hand it followed is gone
+            currResult = self.hands.process(cv2.cvtColor(img, cv2.COLOR_BGR2RGB) if rgb is None else rgb)
+            hands = list(landmarksToArray((currResult.multi_hand_landmarks or [])[: self.maxNumHands], 21))
+            # the crops move to new hands, so the crop graphs must not track the old ones
+            self._resetRoiGraphs()
+
+        # hands whose landmarks mostly cover each other are the same hand found twice
+        self.rois = []
+        handBoxes = []
+        uniqueHands = []
+        for hand in hands:
+            handBox = landmarksToRoi(hand, img.shape, margin=0)
+            roi = landmarksToRoi(hand, img.shape, self.roiMargin)
+            if roi[2] - roi[0] < 2 or roi[3] - roi[1] < 2:
+                continue
+            if any(roiOverlap(handBox, other) > 0.5 for other in handBoxes):
+                continue
+            self.rois.append(roi)
+            handBoxes.append(handBox)
+            uniqueHands.append(hand)
+
+        return np.array(uniqueHands).reshape(-1, 21, 3)
+
+    def getRoiStats(self) -> dict:
+        """Returns how often the ROIs of `roiMode` still held the hand (`hits`) or lost it (`misses`),
+        and how many frames were searched in full.
+        """
+        stats = dict(self.roiStats)
+        attempts = stats["hits"] + stats["misses"]
+        stats["hitRate"] = stats["hits"] / attempts if attempts else None
+        stats["fullSearchRate"] = stats["fullSearches"] / stats["frames"] if stats["frames"] else None
+        return stats
+
+    @staticmethod
+    def formatResult(img, hands, asArray=False, normalised=False):
+        """Converts normalised `(nHands, 21, 3)` landmarks into the format returned by `findHands`"""
+        if asArray and normalised:
+            return hands.astype(np.float32)
+
+        hands = toPixels(hands, img.shape)
+        if asArray:
+            return hands.astype(np.float32)
+        return [toTuples(hand) for hand in hands]
+
+    def drawArray(self, img, hands):
+        """Draws normalised `(nHands, 21, 3)` landmarks, e.g. ones that were cached rather than inferred"""
+        if self.fastDraw:
+            return self.renderer.draw(img, hands)
+        for hand in hands:
+            self.mpDraw.draw_landmarks(
+                img,
+                toLandmarkList(hand),
+                self.mpHands.HAND_CONNECTIONS,
+                self.mpDrawingStyles.get_default_hand_landmarks_style(),
+                self.drawingSpec,
+            )
+        return img
+
+    def findHandsInFrames(self, frames, draw=True, **options):
         """
         Returns a list of tuples where `list[i] = (frame, landmarks)`
+
+        `frames` can be a list of frames or a `VideoReader`, in which case the tuples are yielded lazily.
+        See `Detector.findInFrames` for the `options`, e.g. running over a pool of `workers` processes.
         """
-        res = []
-        for frame in frames:
-            res.append(self.findHands(frame, draw))
-        return res
+        return self.findInFrames(frames, draw, **options)
 
     def highlightLandmark(self, img, hands, landmarkId, circleRadius=12):
         """Given a list of hands, highlight the landmark where `landmark.id = landmarkId` across all hands.
 
         Args:
             img: cv2 img
-            hands (List[List[Tuple[int, int]]]): A list of hands
-            landmarkId ([type]): [description]
+            hands: A list of hands of `(id, x, y)` tuples or a pixel array of shape `(nHands, 21, 2 | 3)`
+            landmarkId: A landmark id, or a list of ids to highlight in one go
         """
-        x, y = None, None
-
-        for hand in hands:
-            for ind, currX, currY in hand:
-                if ind == landmarkId:
-                    x, y = currX, currY
-                    break
-
-        if x is None or y is None:
-            raise ValueError("Invalid landmark id")
-
-        cv2.circle(img, (x, y), circleRadius, EMPHASIS_COLOR, cv2.FILLED)
-
+        renderer.highlightLandmarks(
+            img, self._handsToPixels(hands, landmarkId), landmarkId, EMPHASIS_COLOR, circleRadius
+        )
         return img
 
     def connectLandmarks(self, img, hands, landmarkAId, landmarkBId, thickness=4):
-        """Given a list of hands, highlight the landmark where `landmark.id = landmarkId` across all hands.
+        """Given a list of hands, draw a line between landmark A and landmark B across all hands.
 
         Args:
             img: cv2 img
-            hands (List[List[Tuple[int, int]]]): A list of hands
-            landmarkId ([type]): [description]
+            hands: A list of hands of `(id, x, y)` tuples or a pixel array of shape `(nHands, 21, 2 | 3)`
+            landmarkAId: The id of landmark A, or a list of ids to connect in one go
+            landmarkBId: The id of landmark B, or a list of ids matching those of `landmarkAId`
         """
-        x1, y1 = None, None
-        x2, y2 = None, None
-
-        for hand in hands:
-            for ind, currX, currY in hand:
-                if ind == landmarkAId:
-                    x1, y1 = currX, currY
-                elif ind == landmarkBId:
-                    x2, y2 = currX, currY
-
-        if x1 is None or y1 is None:
-            raise ValueError("Id of landmark A is invalid")
-        if x2 is None or y2 is None:
-            raise ValueError("Id of landmark B is invalid")
-
-        cv2.line(img, (x1, y1), (x2, y2), EMPHASIS_COLOR, thickness)
-
+        pixels = self._handsToPixels(hands, landmarkAId, "Id of landmark A is invalid")
+        self._handsToPixels(hands, landmarkBId, "Id of landmark B is invalid")
+        renderer.connectLandmarks(img, pixels, landmarkAId, landmarkBId, EMPHASIS_COLOR, thickness)
         return img
 
+    def _handsToPixels(self, hands, landmarkIds, message="Invalid landmark id") -> np.ndarray:
+        """Returns the `(nHands, 21, 2)` pixels of `hands`, checking that `landmarkIds` exist"""
+        if isinstance(hands, list):
+            hands = np.array([[point[1:] for point in hand] for hand in hands]).reshape(-1, 21, 2)
+        ids = np.atleast_1d(landmarkIds)
+        if not len(hands) or ids.min() < 0 or ids.max() >= hands.shape[1]:
+            raise ValueError(message)
+        return renderer.toPixelPoints(hands, normalised=False)
+
     def getFingersStates(self, hand: List[Tuple[int, int]]) -> Tuple[int, List[int]]:
-        rightHand = hand[5][1] > hand[17][1]
-        fingerStates = []
-
-        # edge case => the thumb
-        if hand[4][1] < hand[3][1] if rightHand else hand[4][1] > hand[3][1]:
-            fingerStates.append(0)
-        else:
-            fingerStates.append(1)
-
-        for fingertipId in self.fingertipIds[1:]:
-            if hand[fingertipId][2] < hand[fingertipId - 2][2]:
-                # current finger is up
-                fingerStates.append(1)
-            else:
-                fingerStates.append(0)
+        """Returns `(totalFingers, fingerStates)` where 1 is up and 0 is down, see `geometry.fingerStates`.
 
-        totalFingers = fingerStates.count(1)
+        Args:
+            hand: A list of `(id, x, y)` tuples or an array of shape `(21, 2 | 3)`
+        """
+        points = np.asarray(hand)[:, 1:] if isinstance(hand, list) else hand
+        fingerStates = geometry.fingerStates(points).tolist()
 
-        return (totalFingers, fingerStates)
+        return (sum(fingerStates), fingerStates)
 
 
 def main():
@@ -143,62 +318,29 @@ def main():
         print(colored("Unsupported file format", "red"))
         return
 
-    frameWidth = None
-    frameHeight = None
-
-    frames = []
+    fps = None
+    frameShape = None
 
     if fileType == "image":
-        img = cv2.imread(filename)
-        frames.append(img)
+        frames = [cv2.imread(filename)]
     else:
-        ((frames, audio), (frameWidth, frameHeight, fps)) = readVideo(filename, True, True)
-
-    print(colored(f"Finish reading {fileType}", "green"))
+        # frames are decoded, processed and encoded one at a time
+        frames = VideoReader(filename, prefetch=8)
+        fps, frameShape = frames.fps, (frames.frameWidth, frames.frameHeight)
 
     detector = HandDetector()
     framesWithHands = detector.findHandsInFrames(frames)
-    frames = []
-    for frameWithHands in framesWithHands:
-        (frame, hands) = frameWithHands
-        detector.highlightLandmark(frame, hands, 4)
-        detector.highlightLandmark(frame, hands, 8)
-        frames.append(frame)
-
-    print(colored("Finish processing hand detection", "green"))
+    frames = (detector.highlightLandmark(frame, hands, [4, 8]) for frame, hands in framesWithHands)
 
     if not write:
-        if fileType == "video":
-            for frame in frames:
-                cv2.imshow("Frame", frame)
-                cv2.waitKey(1)
-        else:
-            cv2.imshow("Frame", frames[0])
-            cv2.waitKey(0)
-        return
-
-    if fileType == "video":
-        outputFilename = f"out/hands/{filename.split(os.sep)[-1]}"
-        bufferOutputFilename = f"out/hands/buffer-{filename.split(os.sep)[-1]}"
-        outputVideo = cv2.VideoWriter(
-            bufferOutputFilename, cv2.VideoWriter_fourcc(*"MP4V"), fps, (frameWidth, frameHeight)
-        )
         for frame in frames:
-            outputVideo.write(frame)
-            cv2.waitKey(1)
-        outputVideo.release()
-
-        processedFfmpegVideo = ffmpeg.input(bufferOutputFilename)
-
-        ffmpeg.concat(processedFfmpegVideo, audio, v=1, a=1).output(outputFilename, loglevel="quiet").run()
-        os.remove(bufferOutputFilename)
+            cv2.imshow("Frame", frame)
+            cv2.waitKey(1 if fileType == "video" else 0)
+        return
 
-    else:
-        outputFilename = f"out/hands/{filename.split(os.sep)[-1]}"
-        if write:
-            cv2.imwrite(outputFilename, frames[0])
-    outputFilename = outputFilename.replace("buffer-", "")
+    outputFilename = outputWrite(frames, filename, fileType, "hands", fps, frameShape, filename)
 
+    print(colored("Finish processing hand detection", "green"))
     print(colored(f"Output written to {outputFilename}", "green"))
 
 
@@ -0,0 +1,147 @@
+import cv2
+import numpy as np
+from src.modules import metrics
+from src.modules.constants import ANNOTATION_COLOR
+from src.modules.detector import Detector, mediapipeSolutions, toRgb
+from src.modules.landmarks import landmarksToArray, toLandmarkList, toPixels, toTuples
+
+
+class HolisticDetector(Detector):
+    """Finds the pose, both hands and the face mesh of a person in one go with MediaPipe Holistic,
+    which is cheaper than running `PoseDetector`, `HandDetector` and `FaceMeshDetector` one after another
+    as the hands and the face are cropped around the pose rather than searched for.
+
+    Results are dictionaries with the keys "pose", "hands" and "faceMesh", each in the format returned by
+    `findPose`, `findHands` and `findFaceMesh` respectively, see `src.modules.landmarks`.
+    Holistic tracks a single person, so there are at most two hands and one face.
+    """
+
+    graphAttribute = "holistic"
+
+    def __init__(
+        self,
+        staticImageMode=False,
+        modelComplexity=1,
+        smoothLandmarks=True,
+        minDetectionConfidence=0.5,
+        minTrackingConfidence=0.5,
+    ):
+        self.staticImageMode = staticImageMode
+        self.modelComplexity = modelComplexity
+        self.smoothLandmarks = smoothLandmarks
+        self.minDetectionConfidence = minDetectionConfidence
+        self.minTrackingConfidence = minTrackingConfidence
+        solutions = mediapipeSolutions()
+        self.mpHolistic = solutions.holistic
+        self.holistic = self.createGraph()
+        self.mpDraw = solutions.drawing_utils
+        self.mpDrawingStyles = solutions.drawing_styles
+        self.drawSpec = self.mpDraw.DrawingSpec(thickness=1, circle_radius=1, color=ANNOTATION_COLOR)
+
+    def getParams(self) -> dict:
+        return {
+            "staticImageMode": self.staticImageMode,
+            "modelComplexity": self.modelComplexity,
+            "smoothLandmarks": self.smoothLandmarks,
+            "minDetectionConfidence": self.minDetectionConfidence,
+            "minTrackingConfidence": self.minTrackingConfidence,
+        }
+
+    def createGraph(self):
+        return self.mpHolistic.Holistic(
+            static_image_mode=self.staticImageMode,
+            model_complexity=self.modelComplexity,
+            smooth_landmarks=self.smoothLandmarks,
+            min_detection_confidence=self.minDetectionConfidence,
+            min_tracking_confidence=self.minTrackingConfidence,
+        )
+
+    def find(self, img, draw=True, **options):
+        return self.findHolistic(img, draw, **options)
+
+    def findHolistic(self, img, draw=True, asArray=False, normalised=False, rgb=None):
+        """
+        Returns a tuple structured as `(img, results)` where "results" is a dictionary holding the "pose",
+        "hands" and "faceMesh" of the person in the frame.
+        `rgb` can hold the frame already converted to RGB, e.g. when it is shared by several detectors,
+        or be True when `img` itself is RGB.
+        """
+        with metrics.timer("convert", "HolisticDetector"):
+            rgb = toRgb(img, rgb)
+        with metrics.timer("inference", "HolisticDetector"):
+            currResult = self.holistic.process(rgb)
+
+        pose = currResult.pose_landmarks
+        handLandmarks = [hand for hand in (currResult.left_hand_landmarks, currResult.right_hand_landmarks) if hand]
+        faceLandmarks = [currResult.face_landmarks] if currResult.face_landmarks else []
+        with metrics.timer("landmarks", "HolisticDetector"):
+            results = {
+                "pose": landmarksToArray([pose], 33, withVisibility=True)[0] if pose else np.full((33, 4), np.nan),
+                "hands": landmarksToArray(handLandmarks, 21),
+                "faceMesh": landmarksToArray(faceLandmarks, 468),
+            }
+            res = self.formatResult(img, results, asArray, normalised)
+
+        with metrics.timer("draw", "HolisticDetector"):
+            if draw:
+                self.drawArray(img, results)
+        metrics.recordDetections("HolisticDetector", int(pose is not None))
+        return (img, res)
+
+    @staticmethod
+    def formatResult(img, results, asArray=False, normalised=False):
+        """Converts a dictionary of normalised landmark arrays into the format returned by `findHolistic`"""
+        formatted = {}
+        for name, points in results.items():
+            if not normalised:
+                points = toPixels(points, img.shape)
+            if asArray:
+                formatted[name] = points.astype(np.float32)
+            elif name == "pose":
+                formatted[name] = [] if np.isnan(points).all() else [toTuples(points)]
+            else:
+                formatted[name] = [toTuples(landmarks) for landmarks in points]
+        return formatted
+
+    def drawArray(self, img, results):
+        """Draws a dictionary of normalised landmark arrays, which may hold any of the keys of the results"""
+        pose = results.get("pose")
+        if pose is not None and not np.isnan(pose).all():
+            self.mpDraw.draw_landmarks(
+                img,
+                toLandmarkList(pose),
+                self.mpHolistic.POSE_CONNECTIONS,
+                self.mpDrawingStyles.get_default_pose_landmarks_style(),
+            )
+        for hand in results.get("hands", []):
+            self.mpDraw.draw_landmarks(
+                img,
+                toLandmarkList(hand),
+                self.mpHolistic.HAND_CONNECTIONS,
+                self.mpDrawingStyles.get_default_hand_landmarks_style(),
+            )
+        for face in results.get("faceMesh", []):
+            self.mpDraw.draw_landmarks(img, toLandmarkList(face), self.mpHolistic.FACEMESH_CONTOURS, self.drawSpec)
+        return img
+
+    def findInFrames(
+        self, frames, draw=True, workers=None, chunkSize=None, tracking=True, cache=None, subsampler=None, **findOptions
+    ):
+        """Same as `Detector.findInFrames`, without `cache` and `subsampler`, which both take the results of a frame
+        as a single landmark array rather than a dictionary of them
+
+        Raises:
+            ValueError: When `cache` or `subsampler` is given.
+        """
+        if cache is not None or subsampler is not None:
+            raise ValueError("HolisticDetector results cannot be cached or subsampled")
+        return super().findInFrames(frames, draw, workers, chunkSize, tracking, **findOptions)
+
+    def findHolisticInFrames(self, frames, draw=True, **options):
+        """
+        Returns a list of tuples where `list[i] = (frame, results)`
+
+        `frames` can be a list of frames or a `VideoReader`, in which case the tuples are yielded lazily.
+        The results cannot be stored in a `LandmarkCache` nor interpolated by a `Subsampler`.
+        """
+        return self.findInFrames(frames, draw, **options)
@@ -0,0 +1,153 @@
+"""A client of `src.modules.inferenceServer`, whose `find*` methods can stand in for those of the detectors.
+
+Usage:
+```python
+client = InferenceClient(("127.0.0.1", 8500))  # or InferenceClient("/tmp/landmarks.sock")
+img, hands = client.findHands(img)
+img, pose = client.findPose(img, asArray=True, normalised=True)
+```
+"""
+
+import http.client
+import io
+import json
+import socket
+import threading
+import cv2
+import numpy as np
+from src.modules import renderer
+from src.modules.analyser import MODELS
+from src.modules.constants import ANNOTATION_COLOR, LANDMARK_COLOR
+from src.modules.faceDetection import drawBoxes
+from src.modules.inferenceServer import NPY_CONTENT_TYPE, RAW_CONTENT_TYPE
+
+# model => the renderer drawing its landmarks like the `fastDraw` of its detector, built on first use as the
+# connections need MediaPipe
+_RENDERERS = {
+    "hands": lambda: renderer.Renderer(renderer.HAND_CONNECTIONS, ANNOTATION_COLOR, 2, LANDMARK_COLOR, 4),
+    "pose": lambda: renderer.Renderer(renderer.POSE_CONNECTIONS, (20, 255, 0), 7, (20, 20, 255), 6),
+    "faceMesh": lambda: renderer.Renderer(renderer.FACEMESH_CONTOURS, ANNOTATION_COLOR, 1, ANNOTATION_COLOR, 1),
+}
+
+
+class InferenceError(RuntimeError):
+    """Raised when the server answers with an error, e.g. 503 when it is overloaded or 504 past the deadline"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(f"{status}: {message}")
+        self.status = status
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+class InferenceClient:
+    """Sends frames to an inference server and returns their landmarks in the same formats as the detectors.
+    Landmarks are drawn locally, in the `fastDraw` style of the detectors. The client is thread-safe, with a connection
+    kept open per thread.
+
+    Args:
+        address: `(host, port)` tuple of the server, or the path of its Unix socket.
+        timeout (float, optional): Socket timeout in seconds. Defaults to 10.
+        deadlineMs (float, optional): How long the server may keep a request before giving up on it.
+            Defaults to None and thus the default of the server.
+        encoding (str, optional): Extension to encode frames with before sending them, e.g. ".jpg" when the server
+            is on another machine. Defaults to None and thus raw frames, which are cheaper on the same machine.
+    """
+
+    def __init__(self, address, timeout=10.0, deadlineMs=None, encoding=None):
+        self.address = address
+        self.timeout = timeout
+        self.deadlineMs = deadlineMs
+        self.encoding = encoding
+        self.local = threading.local()
+        self.renderers = {}
+
+    def _connection(self) -> http.client.HTTPConnection:
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            if isinstance(self.address, str):
+                connection = _UnixHTTPConnection(self.address, self.timeout)
+            else:
+                connection = http.client.HTTPConnection(*self.address, timeout=self.timeout)
+            self.local.connection = connection
+        return connection
+
+    def _request(self, method: str, path: str, body=None, headers=None) -> tuple:
+        connection = self._connection()
+        try:
+            connection.request(method, path, body, headers or {})
+            response = connection.getresponse()
+            return (response.status, response.getheader("Content-Type"), response.read())
+        except (ConnectionError, http.client.HTTPException):
+            # the server may have closed an idle connection, so the request is retried once on a new one
+            connection.close()
+            connection.request(method, path, body, headers or {})
+            response = connection.getresponse()
+            return (response.status, response.getheader("Content-Type"), response.read())
+
+    def findRaw(self, img, model: str) -> np.ndarray:
+        """Returns the normalised landmark array of `model` for `img`, see `src.modules.landmarks`"""
+        if self.encoding:
+            success, body = cv2.imencode(self.encoding, img)
+            if not success:
+                raise ValueError(f"Failed to encode the frame as {self.encoding}")
+            headers = {"Content-Type": f"image/{self.encoding.lstrip('.')}"}
+        else:
+            body = np.ascontiguousarray(img)
+            headers = {"Content-Type": RAW_CONTENT_TYPE, "X-Frame-Shape": f"{img.shape[0]}x{img.shape[1]}"}
+        if self.deadlineMs is not None:
+            headers["X-Deadline-Ms"] = str(self.deadlineMs)
+
+        status, contentType, payload = self._request("POST", f"/v1/{model}", memoryview(body).cast("B"), headers)
+        if status != 200 or contentType != NPY_CONTENT_TYPE:
+            raise InferenceError(status, payload.decode(errors="replace"))
+        return np.load(io.BytesIO(payload))
+
+    def find(self, img, draw=True, asArray=False, normalised=False, model="hands"):
+        """Returns `(img, results)` as the `find` method of the detector of `model` would"""
+        points = self.findRaw(img, model)
+        if draw:
+            self.draw(img, points, model)
+        return (img, MODELS[model].formatResult(img, points, asArray, normalised))
+
+    def findHands(self, img, draw=True, asArray=False, normalised=False):
+        return self.find(img, draw, asArray, normalised, "hands")
+
+    def findPose(self, img, draw=True, asArray=False, normalised=False):
+        return self.find(img, draw, asArray, normalised, "pose")
+
+    def findFace(self, img, draw=True, asArray=False, normalised=False):
+        return self.find(img, draw, asArray, normalised, "faces")
+
+    def findFaceMesh(self, img, draw=True, asArray=False, normalised=False):
+        return self.find(img, draw, asArray, normalised, "faceMesh")
+
+    def draw(self, img, points: np.ndarray, model: str):
+        """Draws the normalised landmarks of `model` on `img`"""
+        if model == "faces":
+            return drawBoxes(img, points)
+        if model not in self.renderers:
+            self.renderers[model] = _RENDERERS[model]()
+        return self.renderers[model].draw(img, points)
+
+    def health(self) -> dict:
+        """Returns the counters of the server"""
+        status, _, payload = self._request("GET", "/health")
+        if status != 200:
+            raise InferenceError(status, payload.decode(errors="replace"))
+        return json.loads(payload)
+
+    def close(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self.local.connection = None
@@ -0,0 +1,341 @@
+"""A headless local inference server, so that several services share one set of warmed-up MediaPipe graphs rather than
+each embedding their own. See `src.modules.inferenceClient` for the client.
+
+Protocol, over HTTP/1.1 on localhost or on a Unix socket:
+ - `POST /v1/<model>`, where the model is one of `analyser.MODELS`, with either an encoded image (any `image/*`
+   content type) or a raw BGR frame (`application/x-raw-bgr` with an `X-Frame-Shape: <height>x<width>` header).
+   An optional `X-Deadline-Ms` header sets how long the client is willing to wait.
+   The response holds the normalised landmark array in the `.npy` format, see `src.modules.landmarks`.
+ - `GET /health`, returning the counters of the server as JSON.
+
+Requests for the same model that arrive within `batchWindowMs` of each other are handed to a worker as one batch,
+so that they share a single detector checkout and thread hand-off. MediaPipe graphs take one frame at a time, so the
+frames of a batch still go through the graph one by one.
+Once `maxPending` requests are queued or running, new ones are turned down with 503 so that clients back off,
+and requests whose deadline passed while queued are answered with 504 without being processed.
+
+Usage:
+```
+python -m src.modules.inferenceServer --port 8500
+python -m src.modules.inferenceServer --unix /tmp/landmarks.sock --models hands pose
+```
+"""
+
+import argparse
+import inspect
+import io
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+import cv2
+import numpy as np
+from src.modules import metrics
+from src.modules.analyser import MODELS
+from src.modules.detectorPool import DetectorPool
+from termcolor import colored
+
+RAW_CONTENT_TYPE = "application/x-raw-bgr"
+NPY_CONTENT_TYPE = "application/x-npy"
+
+
+def decodeFrame(body: bytes, contentType: str, frameShape: str = None):
+    """Decodes the body of a request into a BGR frame, raising ValueError when it cannot"""
+    if contentType == RAW_CONTENT_TYPE:
+        if not frameShape:
+            raise ValueError("Raw frames need an X-Frame-Shape header such as 720x1280")
+        height, width = (int(value) for value in frameShape.lower().split("x"))
+        if len(body) != height * width * 3:
+            raise ValueError(f"Expected {height * width * 3} bytes for a {frameShape} frame, got {len(body)}")
+        return np.frombuffer(body, np.uint8).reshape(height, width, 3)
+
+    frame = cv2.imdecode(np.frombuffer(body, np.uint8), cv2.IMREAD_COLOR)
+    if frame is None:
+        raise ValueError("The body is neither a raw frame nor an image OpenCV can decode")
+    return frame
+
+
+class _Request:
+    __slots__ = ("model", "frame", "deadline", "event", "status", "payload", "batchSize")
+
+    def __init__(self, model: str, frame, deadline: float):
+        self.model = model
+        self.frame = frame
+        self.deadline = deadline
+        self.event = threading.Event()
+        self.status = None
+        self.payload = None
+        self.batchSize = 0
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.deadline
+
+    def finish(self, status: int, payload: bytes):
+        self.status = status
+        self.payload = payload
+        self.event.set()
+
+
+class InferenceServer:
+    """Serves the landmarks of `models` from `workers` threads, each checking warmed-up static detectors out of a
+    shared `DetectorPool`. MediaPipe releases the GIL while a graph runs, so the workers run concurrently.
+
+    Usage:
+    ```python
+    server = InferenceServer(["hands", "pose"]).start(("127.0.0.1", 8500))
+    ...
+    server.shutdown()
+    ```
+
+    Args:
+        models (optional): Names of the models to serve, out of `analyser.MODELS`. Defaults to all of them.
+        workers (int, optional): Number of worker threads. Defaults to None and thus one per CPU.
+        maxBatchSize (int, optional): Maximum number of requests handed to a worker at once. Defaults to 8.
+        batchWindowMs (float, optional): How long the first request of a batch waits for others. Defaults to 2.
+        maxPending (int, optional): Number of queued and running requests beyond which new ones get 503.
+            Defaults to 64.
+        defaultDeadlineMs (float, optional): Deadline of requests without an `X-Deadline-Ms` header. Defaults to 5000.
+    """
+
+    def __init__(
+        self,
+        models=None,
+        workers=None,
+        maxBatchSize=8,
+        batchWindowMs=2.0,
+        maxPending=64,
+        defaultDeadlineMs=5000,
+    ):
+        self.models = list(models or MODELS)
+        unknownModels = [model for model in self.models if model not in MODELS]
+        if unknownModels:
+            raise ValueError(f"Unknown models {unknownModels}, expected any of {list(MODELS)}")
+
+        self.workers = workers or os.cpu_count() or 1
+        self.maxBatchSize = maxBatchSize
+        self.batchWindow = batchWindowMs / 1000
+        self.maxPending = maxPending
+        self.defaultDeadlineMs = defaultDeadlineMs
+        self.pool = DetectorPool(maxDetectors=self.workers * len(self.models))
+        self.executor = ThreadPoolExecutor(self.workers)
+        # at most one batch per worker is handed over, the rest wait in the queues where they can still expire
+        self.freeWorkers = threading.Semaphore(self.workers)
+        self.condition = threading.Condition()
+        self.queues = {model: deque() for model in self.models}
+        self.pending = 0
+        self.stopped = False
+        self.stats = {"requests": 0, "served": 0, "rejected": 0, "expired": 0, "failed": 0, "batches": 0}
+        self.dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+        self.httpServer = None
+
+    def detectorParams(self, model: str) -> dict:
+        # requests come from unrelated clients, so no frame may be tracked from the previous one
+        parameters = inspect.signature(MODELS[model]).parameters
+        return {"staticImageMode": True} if "staticImageMode" in parameters else {}
+
+    def warmup(self):
+        """Creates and warms up a detector per worker and model, so that no request pays for it"""
+        for model in self.models:
+            detectors = [self.pool.acquire(MODELS[model], **self.detectorParams(model)) for _ in range(self.workers)]
+            for detector in detectors:
+                self.pool.release(detector)
+
+    def start(self, address):
+        """Warms the detectors up and serves on `address`, a `(host, port)` tuple or the path of a Unix socket.
+        Returns the server.
+        """
+        self.warmup()
+        self.dispatcher.start()
+        if isinstance(address, str):
+            if os.path.exists(address):
+                os.remove(address)
+            self.httpServer = _UnixHTTPServer(address, _InferenceHandler)
+        else:
+            self.httpServer = ThreadingHTTPServer(address, _InferenceHandler)
+        self.httpServer.inference = self
+        threading.Thread(target=self.httpServer.serve_forever, daemon=True).start()
+        return self
+
+    def submit(self, model: str, frame, deadlineMs=None) -> _Request:
+        """Queues a frame, returning the request to wait on, or None when the server is overloaded"""
+        deadline = time.monotonic() + (deadlineMs if deadlineMs is not None else self.defaultDeadlineMs) / 1000
+        request = _Request(model, frame, deadline)
+        with self.condition:
+            self.stats["requests"] += 1
+            if self.pending >= self.maxPending:
+                self.stats["rejected"] += 1
+                return None
+            self.pending += 1
+            self.queues[model].append(request)
+            self.condition.notify()
+        return request
+
+    def handle(self, model: str, frame, deadlineMs=None) -> tuple:
+        """Runs a frame through the server and returns `(status, payload, request)` for the HTTP handler"""
+        if model not in self.queues:
+            return (404, f"Unknown model {model}, expected any of {self.models}".encode(), None)
+        request = self.submit(model, frame, deadlineMs)
+        if request is None:
+            return (503, b"Too many pending requests", None)
+        if not request.event.wait(max(0.0, request.deadline - time.monotonic())):
+            # the worker skips it if it was not picked up yet
+            return (504, b"Deadline exceeded", request)
+        return (request.status, request.payload, request)
+
+    def _nextBatch(self) -> tuple:
+        """Blocks until requests are queued, then returns `(model, requests)` for the model with the oldest one"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.stopped or any(self.queues.values()))
+            if self.stopped:
+                return (None, [])
+            model = min((queue[0].deadline, model) for model, queue in self.queues.items() if queue)[1]
+            queue = self.queues[model]
+            # give concurrent clients a moment to join the batch
+            batchEnd = time.monotonic() + self.batchWindow
+            while len(queue) < self.maxBatchSize and not self.stopped:
+                remaining = batchEnd - time.monotonic()
+                if remaining <= 0 or not self.condition.wait(remaining):
+                    break
+            return (model, [queue.popleft() for _ in range(min(len(queue), self.maxBatchSize))])
+
+    def _dispatch(self):
+        while not self.stopped:
+            self.freeWorkers.acquire()
+            model, requests = self._nextBatch()
+            if not requests:
+                self.freeWorkers.release()
+                continue
+            self.executor.submit(self._runBatch, model, requests)
+
+    def _runBatch(self, model: str, requests: list):
+        try:
+            metrics.observe("server_batch_size", len(requests), metrics.COUNT_BUCKETS, model=model)
+            with self.pool.checkout(MODELS[model], **self.detectorParams(model)) as detector:
+                for request in requests:
+                    self._run(detector, request, len(requests))
+        finally:
+            with self.condition:
+                self.pending -= len(requests)
+                self.stats["batches"] += 1
+            self.freeWorkers.release()
+
+    def _run(self, detector, request: _Request, batchSize: int):
+        request.batchSize = batchSize
+        if request.expired():
+            with self.condition:
+                self.stats["expired"] += 1
+            return request.finish(504, b"Deadline exceeded")
+        try:
+            _, points = detector.find(request.frame, False, asArray=True, normalised=True)
+        except Exception as e:
+            with self.condition:
+                self.stats["failed"] += 1
+            return request.finish(500, repr(e).encode())
+
+        buffer = io.BytesIO()
+        np.save(buffer, points)
+        with self.condition:
+            self.stats["served"] += 1
+        request.finish(200, buffer.getvalue())
+
+    def getStats(self) -> dict:
+        with self.condition:
+            return {
+                **self.stats,
+                "pending": self.pending,
+                "queued": {model: len(queue) for model, queue in self.queues.items()},
+                "detectors": self.pool.getStats(),
+            }
+
+    def shutdown(self):
+        if self.httpServer is not None:
+            self.httpServer.shutdown()
+            self.httpServer.server_close()
+            if isinstance(self.httpServer, _UnixHTTPServer):
+                os.remove(self.httpServer.server_address)
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        self.freeWorkers.release()
+        self.executor.shutdown()
+        self.pool.clear()
+
+
+class _UnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+class _InferenceHandler(BaseHTTPRequestHandler):
+    # keeps connections open between the requests of a client
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path != "/health":
+            return self._reply(404, b"Not found")
+        self._reply(200, json.dumps(self.server.inference.getStats()).encode(), "application/json")
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        prefix, _, model = self.path.rstrip("/").rpartition("/")
+        if prefix != "/v1":
+            return self._reply(404, b"Not found")
+
+        try:
+            frame = decodeFrame(body, self.headers.get("Content-Type", ""), self.headers.get("X-Frame-Shape"))
+            deadlineMs = self.headers.get("X-Deadline-Ms")
+            deadlineMs = float(deadlineMs) if deadlineMs is not None else None
+        except ValueError as e:
+            return self._reply(400, str(e).encode())
+
+        start = time.perf_counter()
+        status, payload, request = self.server.inference.handle(model, frame, deadlineMs)
+        metrics.increment("server_requests_total", description="Requests served", model=model, status=status)
+        headers = {"X-Elapsed-Ms": f"{(time.perf_counter() - start) * 1000:.2f}"}
+        if request is not None and request.batchSize:
+            headers["X-Batch-Size"] = str(request.batchSize)
+        if status == 503:
+            headers["Retry-After"] = "1"
+        self._reply(status, payload, NPY_CONTENT_TYPE if status == 200 else "text/plain", headers)
+
+    def _reply(self, status: int, body: bytes, contentType="text/plain", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", contentType)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *_):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serves hand, pose and face landmarks to local clients")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8500)
+    parser.add_argument("--unix", help="serve on this Unix socket instead of TCP")
+    parser.add_argument("--models", nargs="+", choices=list(MODELS), default=list(MODELS))
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    parser.add_argument("--max-pending", type=int, default=64)
+    args = parser.parse_args()
+
+    server = InferenceServer(args.models, args.workers, args.max_batch_size, maxPending=args.max_pending)
+    address = args.unix or (args.host, args.port)
+    server.start(address)
+    print(colored(f"Serving {', '.join(server.models)} on {address}", "green"))
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
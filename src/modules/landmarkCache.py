@@ -0,0 +1,235 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+from src.modules.landmarks import stackFrames
+from src.modules.utils import hashFile
+
+DEFAULT_CACHE_DIRECTORY = os.path.join(os.path.expanduser("~"), ".cache", "computer-vision", "landmarks")
+# bump whenever the layout of the stored arrays changes
+CACHE_VERSION = 1
+# detector parameters that only change how landmarks are drawn, and so are left out of the keys
+DRAWING_PARAMS = ("fastDraw",)
+
+try:
+    import fcntl
+except ImportError:
+    # e.g. on Windows, where the index is then only guarded within a process
+    fcntl = None
+
+
+class LandmarkCache:
+    """Persists the per-frame landmarks found in a source file, so that re-running a detector over it skips inference.
+
+    Entries are keyed by the content hash of the source file and the range of its frames that was read, together with
+    the detector class, its constructor parameters and how the frames were read and inferred on. Each entry is a
+    `.npy` file holding the normalised landmark arrays of the whole clip stacked with `landmarks.stackFrames`, which is
+    memory-mapped when read. The least recently used entries are evicted once the cache grows beyond `maxBytes`.
+    Several processes can share a cache directory: every update of the index re-reads it under a lock file, and
+    replaces it atomically.
+
+    Usage:
+    ```python
+    cache = LandmarkCache()
+    with VideoReader("assets/ben0.mp4") as reader:
+        results = PoseDetector().findPoseInFrames(reader, False, cache=cache)
+    ```
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIRECTORY, maxBytes=2 * 1024**3):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.indexFilename = os.path.join(directory, "index.json")
+        self.lockFilename = os.path.join(directory, "index.lock")
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _readIndex(self) -> dict:
+        if not os.path.exists(self.indexFilename):
+            return {"entries": {}, "hashes": {}}
+        with open(self.indexFilename) as file:
+            return json.load(file)
+
+    @contextmanager
+    def _lockIndex(self):
+        """Holds the index for a read-modify-write, against other threads and other processes"""
+        with self.lock, open(self.lockFilename, "a") as lockFile:
+            if fcntl is not None:
+                fcntl.flock(lockFile, fcntl.LOCK_EX)
+            # released when the lock file is closed
+            yield
+
+    def _writeIndex(self, index: dict):
+        # write to a temporary file first so that a crash never leaves a truncated index behind
+        temporaryFilename = f"{self.indexFilename}.{os.getpid()}.tmp"
+        with open(temporaryFilename, "w") as file:
+            json.dump(index, file, indent=2)
+        os.replace(temporaryFilename, self.indexFilename)
+
+    def _entryFilename(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.npy")
+
+    def hashSource(self, path: str) -> str:
+        """Returns the content hash of `path`, only re-reading the file when its size or modification time changed"""
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        with self._lockIndex():
+            index = self._readIndex()
+            known = index["hashes"].get(path)
+            if known and known["size"] == stat.st_size and known["mtime"] == stat.st_mtime:
+                return known["hash"]
+
+        contentHash = hashFile(path)
+        with self._lockIndex():
+            index = self._readIndex()
+            index["hashes"][path] = {"size": stat.st_size, "mtime": stat.st_mtime, "hash": contentHash}
+            self._writeIndex(index)
+        return contentHash
+
+    def keyFor(self, path: str, detector, subsampler=None, startFrame=0, frameLimit=None, inference=None) -> str:
+        """Returns the cache key of the landmarks `detector` finds in the file at `path`, optionally subsampled, from
+        frame `startFrame` on and over at most `frameLimit` frames.
+        `inference` is a dict of whatever else the landmarks depend on, such as whether tracking was on, the size and
+        channel order the frames were decoded to, and the options passed on to `find`.
+        """
+        params = {name: value for name, value in detector.getParams().items() if name not in DRAWING_PARAMS}
+        description = {
+            "version": CACHE_VERSION,
+            "content": self.hashSource(path),
+            "detector": type(detector).__name__,
+            "params": params,
+        }
+        if startFrame or frameLimit is not None:
+            # part of a clip, e.g. a segment of a `SegmentedJob`, must not be served the landmarks of the whole clip
+            description["frames"] = [startFrame, frameLimit]
+        if subsampler is not None:
+            # interpolated landmarks must never be served to a run that expects every frame to be detected
+            description["subsampling"] = subsampler.getParams()
+        if inference is not None:
+            description["inference"] = inference
+        return hashlib.sha256(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()
+
+    def get(self, key: str):
+        """Returns the memory-mapped landmarks stored under `key`, or None on a miss"""
+        with self._lockIndex():
+            index = self._readIndex()
+            entry = index["entries"].get(key)
+            if entry is None or not os.path.exists(self._entryFilename(key)):
+                return None
+            entry["lastAccess"] = time.time()
+            self._writeIndex(index)
+        return np.load(self._entryFilename(key), mmap_mode="r")
+
+    def put(self, key: str, arrays: list, **metadata):
+        """Stores the per-frame landmark `arrays` under `key`, then evicts entries beyond `maxBytes`"""
+        filename = self._entryFilename(key)
+        np.save(filename, stackFrames(arrays))
+        with self._lockIndex():
+            index = self._readIndex()
+            index["entries"][key] = {
+                **metadata,
+                "frames": len(arrays),
+                "bytes": os.path.getsize(filename),
+                "lastAccess": time.time(),
+            }
+            self._writeIndex(index)
+        self.prune()
+
+    def entries(self) -> list:
+        """Returns the metadata of every entry, the most recently used first"""
+        index = self._readIndex()
+        entries = [{"key": key, **entry} for key, entry in index["entries"].items()]
+        return sorted(entries, key=lambda entry: entry["lastAccess"], reverse=True)
+
+    def remove(self, key: str):
+        with self._lockIndex():
+            index = self._readIndex()
+            index["entries"].pop(key, None)
+            self._writeIndex(index)
+        if os.path.exists(self._entryFilename(key)):
+            os.remove(self._entryFilename(key))
+
+    def prune(self, maxBytes=None, olderThan=None) -> list:
+        """Evicts the least recently used entries until the cache fits in `maxBytes` (defaults to `self.maxBytes`),
+        as well as every entry not used within the last `olderThan` seconds.
+
+        Returns:
+            list: The keys of the removed entries
+        """
+        maxBytes = self.maxBytes if maxBytes is None else maxBytes
+        entries = self.entries()
+        now = time.time()
+
+        removed = []
+        totalBytes = 0
+        for entry in entries:
+            totalBytes += entry["bytes"]
+            if totalBytes > maxBytes or (olderThan is not None and now - entry["lastAccess"] > olderThan):
+                removed.append(entry["key"])
+        for key in removed:
+            self.remove(key)
+        return removed
+
+    def clear(self):
+        self.prune(maxBytes=0)
+
+    def findInFrames(
+        self, detector, frames, draw=True, workers=None, chunkSize=None, tracking=True, subsampler=None, **findOptions
+    ):
+        """Same as `detector.findInFrames`, but the landmarks are read from the cache when `frames.path` was processed
+        with the same detector parameters before, and stored once every frame has been processed otherwise.
+        """
+        asArray = findOptions.pop("asArray", False)
+        normalised = findOptions.pop("normalised", False)
+        startFrame, frameLimit = getattr(frames, "startFrame", 0), getattr(frames, "frameLimit", None)
+        inference = {
+            # static images and tracked frames give different landmarks
+            "tracking": tracking,
+            # where tracking starts over, see `Detector.findInFrames`
+            "chunkSize": chunkSize if tracking and (workers or 1) > 1 else None,
+            # e.g. the frames of an `FfmpegReader`, scaled and in RGB
+            "frameShape": [getattr(frames, "frameWidth", None), getattr(frames, "frameHeight", None)],
+            "pixelFormat": getattr(frames, "pixelFormat", "bgr24"),
+            "findOptions": findOptions,
+        }
+        key = self.keyFor(frames.path, detector, subsampler, startFrame, frameLimit, inference)
+        cached = self.get(key)
+
+        if cached is not None:
+            for frame, points in zip(frames, cached):
+                if detector.multipleResults:
+                    # drop the NaN padding of frames with fewer hands or faces
+                    points = points[~np.isnan(points).all(axis=tuple(range(1, points.ndim)))]
+                points = np.array(points, dtype=np.float64)
+                if draw:
+                    detector.drawArray(frame, points)
+                yield (frame, detector.formatResult(frame, points, asArray, normalised))
+            return
+
+        arrays = []
+        results = detector.findInFrames(
+            frames,
+            draw,
+            workers,
+            chunkSize,
+            tracking,
+            subsampler=subsampler,
+            asArray=True,
+            normalised=True,
+            **findOptions,
+        )
+        for frame, points in results:
+            arrays.append(points)
+            yield (frame, detector.formatResult(frame, points.astype(np.float64), asArray, normalised))
+
+        self.put(
+            key,
+            arrays,
+            source=os.path.abspath(frames.path),
+            detector=type(detector).__name__,
+            params=detector.getParams(),
+            subsampling=subsampler.getParams() if subsampler is not None else None,
+        )
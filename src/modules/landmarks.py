@@ -0,0 +1,81 @@
+"""Array form of the detector results.
+
+Every detector can return its landmarks as float32 arrays instead of lists of `(id, x, y)` tuples:
+ - hands: `(nHands, 21, 3)` holding x, y and z
+ - pose: `(33, 4)` holding x, y, z and visibility, filled with NaN when no pose was found
+ - face mesh: `(nFaces, 468, 3)` holding x, y and z
+ - faces: `(nFaces, 5)` holding the x, y, width and height of the bounding box and the detection score
+
+Coordinates are either normalised to [0, 1] or pixels at subpixel precision, where z is scaled like x.
+"""
+
+import numpy as np
+
+
+def landmarksToArray(landmarkLists, numLandmarks: int, withVisibility=False) -> np.ndarray:
+    """Converts MediaPipe landmark lists into a float64 array of shape `(len(landmarkLists), numLandmarks, 3 | 4)`
+    with normalised coordinates.
+    """
+    numFields = 4 if withVisibility else 3
+    if not landmarkLists:
+        return np.empty((0, numLandmarks, numFields))
+
+    if withVisibility:
+        values = [(lm.x, lm.y, lm.z, lm.visibility) for landmarks in landmarkLists for lm in landmarks.landmark]
+    else:
+        values = [(lm.x, lm.y, lm.z) for landmarks in landmarkLists for lm in landmarks.landmark]
+    return np.array(values).reshape(len(landmarkLists), -1, numFields)
+
+
+def toPixels(points: np.ndarray, imageShape) -> np.ndarray:
+    """Scales normalised x, y and z (the first three columns of the last axis) to pixels of an image of `imageShape`"""
+    imageH, imageW = imageShape[:2]
+    pixels = points.copy()
+    pixels[..., 0] *= imageW
+    pixels[..., 1] *= imageH
+    pixels[..., 2] *= imageW
+    return pixels
+
+
+def boxesToPixels(boxes: np.ndarray, imageShape) -> np.ndarray:
+    """Scales normalised `(x, y, width, height, score)` boxes to pixels of an image of `imageShape`"""
+    imageH, imageW = imageShape[:2]
+    pixels = boxes.copy()
+    pixels[..., [0, 2]] *= imageW
+    pixels[..., [1, 3]] *= imageH
+    return pixels
+
+
+def toTuples(points: np.ndarray) -> list:
+    """Converts the pixel landmarks of a single hand, pose or face into the list of `(id, x, y)` tuples"""
+    return [(ind, x, y) for ind, (x, y) in enumerate(points[:, :2].astype(int).tolist())]
+
+
+def stackFrames(arrays: list) -> np.ndarray:
+    """Stacks the per-frame arrays of a clip into a single array with the frame index as the first axis.
+
+    When the number of hands or faces varies between frames, the arrays are padded with NaN up to the largest count.
+    """
+    if not arrays:
+        return np.empty((0,), np.float32)
+
+    maxCount = max(array.shape[0] for array in arrays)
+    stacked = np.full((len(arrays), maxCount) + arrays[0].shape[1:], np.nan, np.float32)
+    for ind, array in enumerate(arrays):
+        stacked[ind, : array.shape[0]] = array
+    return stacked
+
+
+def toLandmarkList(points: np.ndarray):
+    """Converts the normalised landmarks of a single hand, pose or face back into a MediaPipe landmark list,
+    so that results which were not inferred just now can still be drawn with `drawing_utils`.
+    """
+    # imported here so that array-only users do not pay for loading MediaPipe
+    from mediapipe.framework.formats import landmark_pb2
+
+    landmarkList = landmark_pb2.NormalizedLandmarkList()
+    for point in points.tolist():
+        landmark = landmarkList.landmark.add(x=point[0], y=point[1], z=point[2])
+        if len(point) > 3:
+            landmark.visibility = point[3]
+    return landmarkList
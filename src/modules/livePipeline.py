@@ -0,0 +1,172 @@
+import threading
+import time
+from collections import deque
+import cv2
+import numpy as np
+from src.modules import metrics
+
+
+class LatestFrameQueue:
+    """A single-slot queue where a new item replaces the one waiting to be taken, so consumers never see stale frames"""
+
+    def __init__(self, name=""):
+        self.name = name
+        self.item = None
+        self.dropped = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def put(self, item):
+        with self.condition:
+            if self.item is not None:
+                self.dropped += 1
+                metrics.increment(
+                    "dropped_frames_total", description="Frames replaced before being taken", queue=self.name
+                )
+            self.item = item
+            self.condition.notify()
+
+    def get(self, timeout=None):
+        """Returns the latest item, or None if the queue was closed or nothing arrived within `timeout` seconds"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.item is not None or self.closed, timeout)
+            item, self.item = self.item, None
+            return item
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class LivePipeline:
+    """Runs capture, processing and rendering of a live source on separate threads.
+
+    The stages are connected by `LatestFrameQueue`s, so when processing falls behind the camera,
+    stale frames are dropped instead of piling up.
+
+    Usage:
+    ```python
+    def process(img):
+        img, hands = detector.findHands(img)
+        return img
+
+    LivePipeline(process, frameShape=(640, 480)).run()
+    ```
+    """
+
+    def __init__(self, process, source=0, frameShape=None, windowName="Camera", showStats=True, latencyWindow=120):
+        """
+        Args:
+            process: Called on the processing thread with each captured frame, returns the frame to render.
+            source (optional): Anything `cv2.VideoCapture` accepts. Defaults to the first camera.
+            frameShape (tuple[int, int], optional): (frameWidth, frameHeight) requested from the camera.
+            windowName (str, optional): Name of the window frames are rendered in.
+            showStats (bool, optional): Whether to draw the achieved FPS and latency onto the rendered frames.
+            latencyWindow (int, optional): Number of recent frames the reported statistics are computed over.
+        """
+        self.process = process
+        self.source = source
+        self.frameShape = frameShape
+        self.windowName = windowName
+        self.showStats = showStats
+
+        self.captured = LatestFrameQueue("beforeProcessing")
+        self.processed = LatestFrameQueue("beforeRendering")
+        self.stopped = threading.Event()
+
+        self.renderTimes = deque(maxlen=latencyWindow)
+        self.latencies = deque(maxlen=latencyWindow)
+        self.framesCaptured = 0
+        self.framesRendered = 0
+
+    def _capture(self, cap):
+        while not self.stopped.is_set():
+            success, img = cap.read()
+            if success is False:
+                break
+            self.framesCaptured += 1
+            # the capture timestamp travels with the frame to measure end-to-end latency
+            self.captured.put((time.perf_counter(), img))
+        self.stop()
+
+    def _processFrames(self):
+        while not self.stopped.is_set():
+            item = self.captured.get(0.1)
+            if item is None:
+                continue
+            capturedAt, img = item
+            with metrics.timer("process", "LivePipeline"):
+                img = self.process(img)
+            self.processed.put((capturedAt, img))
+
+    def getStats(self) -> dict:
+        """Returns the achieved FPS, the end-to-end latency in milliseconds and the number of dropped frames"""
+        fps = 0.0
+        if len(self.renderTimes) > 1:
+            fps = (len(self.renderTimes) - 1) / (self.renderTimes[-1] - self.renderTimes[0])
+        latencies = np.array(self.latencies) * 1000 if self.latencies else np.zeros(1)
+
+        return {
+            "fps": fps,
+            "latencyMs": float(np.mean(latencies)),
+            "p95LatencyMs": float(np.percentile(latencies, 95)),
+            "framesCaptured": self.framesCaptured,
+            "framesRendered": self.framesRendered,
+            "droppedBeforeProcessing": self.captured.dropped,
+            "droppedBeforeRendering": self.processed.dropped,
+        }
+
+    def _render(self, capturedAt, img):
+        now = time.perf_counter()
+        self.renderTimes.append(now)
+        self.latencies.append(now - capturedAt)
+        self.framesRendered += 1
+
+        if self.showStats:
+            stats = self.getStats()
+            cv2.putText(
+                img,
+                f"{stats['fps']:.0f} FPS  {stats['latencyMs']:.0f} ms",
+                (10, img.shape[0] - 15),
+                cv2.FONT_HERSHEY_PLAIN,
+                1.5,
+                (0, 255, 255),
+                2,
+            )
+        cv2.imshow(self.windowName, img)
+
+    def stop(self):
+        self.stopped.set()
+        self.captured.close()
+        self.processed.close()
+
+    def run(self) -> dict:
+        """Renders on the calling thread until the source ends or "q" is pressed, then returns `getStats()`"""
+        cap = cv2.VideoCapture(self.source)
+        if self.frameShape is not None:
+            cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.frameShape[0])
+            cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.frameShape[1])
+
+        threads = [
+            threading.Thread(target=self._capture, args=(cap,), daemon=True),
+            threading.Thread(target=self._processFrames, daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+
+        # GUI calls stay on the calling thread, which some platforms require
+        try:
+            while not self.stopped.is_set():
+                item = self.processed.get(0.1)
+                if item is not None:
+                    self._render(*item)
+                if cv2.waitKey(1) & 0xFF == ord("q"):
+                    break
+        finally:
+            self.stop()
+            for thread in threads:
+                thread.join()
+            cap.release()
+
+        return self.getStats()
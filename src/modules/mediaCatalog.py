@@ -0,0 +1,330 @@
+import fnmatch
+import os
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+from src.modules.utils import checkFileType, hashFile
+from termcolor import colored
+
+DEFAULT_CATALOG_FILENAME = os.path.join(os.path.expanduser("~"), ".cache", "computer-vision", "catalog.sqlite")
+# bump whenever the columns of the catalog change, older catalogs are then rebuilt
+CATALOG_VERSION = 1
+COLUMNS = (
+    "path",
+    "type",
+    "size",
+    "mtime",
+    "hash",
+    "duration",
+    "frameCount",
+    "fps",
+    "width",
+    "height",
+    "codec",
+    "hasAudio",
+    "error",
+    "scannedAt",
+)
+
+
+def _frameRate(value: str):
+    """Returns the fps of an ffprobe rate such as "30000/1001", or None when it is unknown"""
+    numerator, _, denominator = (value or "0/0").partition("/")
+    try:
+        rate = float(numerator) / float(denominator or 1)
+    except (ValueError, ZeroDivisionError):
+        return None
+    return rate or None
+
+
+def probeVideo(path: str) -> dict:
+    """Returns the duration, frame count, fps, resolution and codec of the video at `path`, and whether it has an
+    audio track, from ffprobe, falling back on the container as read by OpenCV when ffprobe is not installed
+    """
+    import ffmpeg
+
+    try:
+        probe = ffmpeg.probe(path)
+    except FileNotFoundError:
+        capture = cv2.VideoCapture(path)
+        if not capture.isOpened():
+            raise IOError(f"Failed to open file {path}")
+        fps = capture.get(cv2.CAP_PROP_FPS) or None
+        frameCount = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        codec = int(capture.get(cv2.CAP_PROP_FOURCC)).to_bytes(4, "little").decode("ascii", "replace").strip("\0 ")
+        metadata = {
+            "duration": frameCount / fps if fps else None,
+            "frameCount": frameCount,
+            "fps": fps,
+            "width": int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            "height": int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            "codec": codec or None,
+            # OpenCV cannot tell
+            "hasAudio": None,
+        }
+        capture.release()
+        return metadata
+    except ffmpeg.Error as error:
+        raise IOError(f"ffprobe failed on {path}: {error.stderr.decode(errors='replace').strip()}") from None
+
+    streams = probe.get("streams", [])
+    video = next((stream for stream in streams if stream.get("codec_type") == "video"), None)
+    if video is None:
+        raise IOError(f"{path} has no video stream")
+    duration = float(video.get("duration") or probe.get("format", {}).get("duration") or 0) or None
+    fps = _frameRate(video.get("avg_frame_rate")) or _frameRate(video.get("r_frame_rate"))
+    frameCount = int(video["nb_frames"]) if video.get("nb_frames", "").isdigit() else None
+    if frameCount is None and duration and fps:
+        # e.g. webm and mkv, whose containers do not count frames
+        frameCount = round(duration * fps)
+    return {
+        "duration": duration,
+        "frameCount": frameCount,
+        "fps": fps,
+        "width": video.get("width"),
+        "height": video.get("height"),
+        "codec": video.get("codec_name"),
+        "hasAudio": any(stream.get("codec_type") == "audio" for stream in streams),
+    }
+
+
+def probeImage(path: str) -> dict:
+    """Returns the resolution and format of the image at `path`, only reading its header"""
+    from PIL import Image
+
+    with Image.open(path) as image:
+        return {"width": image.width, "height": image.height, "codec": image.format, "frameCount": 1}
+
+
+def probeFile(path: str, fileType: str, withHash=True) -> dict:
+    """Returns the catalog entry of the media file at `path`, holding the error instead of the metadata when probing
+    failed, or None when the file is gone
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    entry = dict.fromkeys(COLUMNS)
+    entry.update(path=path, type=fileType, size=stat.st_size, mtime=stat.st_mtime, scannedAt=time.time())
+    try:
+        entry.update(probeVideo(path) if fileType == "video" else probeImage(path))
+        if withHash:
+            entry["hash"] = hashFile(path)
+    except Exception as error:
+        entry["error"] = repr(error)
+    return entry
+
+
+class MediaCatalog:
+    """A SQLite index of the images and videos under one or more directories, with their container and stream
+    metadata, so that batch runners can plan and size jobs without opening every file again.
+
+    `scan` walks a directory tree and probes the files that are new or whose size or modification time changed since
+    the last scan, on several threads, and forgets the files that are gone. Files that cannot be probed are kept with
+    their error, so that they are not retried until they change.
+
+    Usage:
+    ```python
+    catalog = MediaCatalog()
+    catalog.scan("assets")
+    clips = catalog.query("assets", fileType="video", minHeight=1080)
+    jobs = planJobs(clips, 4)  # four lists of clips with about as many frames each
+    ```
+
+    Args:
+        filename (str, optional): The SQLite database. Defaults to `DEFAULT_CATALOG_FILENAME`.
+    """
+
+    def __init__(self, filename=DEFAULT_CATALOG_FILENAME):
+        self.filename = filename
+        if os.path.dirname(filename):
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+        # scans write from the calling thread only, the lock keeps other threads from interleaving with them
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        with self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            if self.connection.execute("PRAGMA user_version").fetchone()[0] != CATALOG_VERSION:
+                self.connection.execute("DROP TABLE IF EXISTS media")
+                self.connection.execute(f"PRAGMA user_version={CATALOG_VERSION}")
+            self.connection.execute(
+                """CREATE TABLE IF NOT EXISTS media (
+                    path TEXT PRIMARY KEY, type TEXT, size INTEGER, mtime REAL, hash TEXT, duration REAL,
+                    frameCount INTEGER, fps REAL, width INTEGER, height INTEGER, codec TEXT, hasAudio INTEGER,
+                    error TEXT, scannedAt REAL
+                )"""
+            )
+
+    def scan(self, root: str, workers=8, withHash=True) -> dict:
+        """Brings the entries of the media files under the directory `root` up to date.
+
+        Args:
+            root (str): The directory to walk, sub directories included.
+            workers (int, optional): Number of threads probing and hashing files. Defaults to 8.
+            withHash (bool, optional): Whether to record the SHA-256 of the content of each file. Defaults to True.
+
+        Returns:
+            dict: How many media "files" were found, and how many were "added", "updated", "unchanged", "removed"
+                and "failed", and the "seconds" it took.
+        """
+        start = time.perf_counter()
+        root = os.path.abspath(root)
+        rows = self._rows("SELECT path, size, mtime FROM media", root)
+        known = {row["path"]: (row["size"], row["mtime"]) for row in rows}
+        summary = {"files": 0, "added": 0, "updated": 0, "unchanged": 0, "removed": 0, "failed": 0, "seconds": 0.0}
+
+        jobs = []
+        for directory, _, filenames in os.walk(root):
+            for filename in filenames:
+                fileType = checkFileType(filename.lower())
+                if fileType == "other":
+                    continue
+                path = os.path.join(directory, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    # deleted since the directory was listed
+                    continue
+                summary["files"] += 1
+                existed = path in known
+                if known.pop(path, None) == (stat.st_size, stat.st_mtime):
+                    summary["unchanged"] += 1
+                else:
+                    jobs.append((path, fileType, existed))
+
+        # probed before the lock is taken, so that queries from other threads are only held up by the writes
+        with ThreadPoolExecutor(workers) as executor:
+            entries = list(executor.map(lambda job: probeFile(job[0], job[1], withHash), jobs))
+
+        with self.lock, self.connection:
+            for (path, _, existed), entry in zip(jobs, entries):
+                if entry is None:
+                    # deleted while the files were probed
+                    summary["files"] -= 1
+                    if existed:
+                        known[path] = None
+                    continue
+                summary["updated" if existed else "added"] += 1
+                summary["failed"] += entry["error"] is not None
+                self.connection.execute(
+                    f"INSERT OR REPLACE INTO media VALUES ({', '.join('?' * len(COLUMNS))})",
+                    [entry[column] for column in COLUMNS],
+                )
+            # what is left was not found under `root` anymore
+            self.connection.executemany("DELETE FROM media WHERE path = ?", [(path,) for path in known])
+            summary["removed"] = len(known)
+
+        summary["seconds"] = time.perf_counter() - start
+        return summary
+
+    def _rows(self, sql: str, root=None, conditions=(), parameters=()) -> list:
+        conditions, parameters = list(conditions), list(parameters)
+        if root is not None:
+            # the prefix of `root` as a range, as LIKE would treat "_" and "%" in paths as wildcards
+            prefix = os.path.join(os.path.abspath(root), "")
+            conditions.append("path >= ? AND path < ?")
+            parameters += [prefix, prefix[:-1] + chr(ord(os.sep) + 1)]
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        with self.lock:
+            return self.connection.execute(sql + " ORDER BY path", parameters).fetchall()
+
+    def get(self, path: str):
+        """Returns the entry of the file at `path` as a dict, or None if it was never scanned"""
+        rows = self._rows("SELECT * FROM media", conditions=["path = ?"], parameters=[os.path.abspath(path)])
+        return dict(rows[0]) if rows else None
+
+    def query(
+        self,
+        root=None,
+        fileType=None,
+        minDuration=None,
+        maxDuration=None,
+        minHeight=None,
+        codec=None,
+        hasAudio=None,
+        includeFailed=False,
+    ) -> list:
+        """Returns the entries, as dicts sorted by path, of the files under `root` matching every filter that is set.
+
+        Args:
+            root (str, optional): Only the files under this directory. Defaults to None and thus every file scanned.
+            fileType (str, optional): "image" or "video", see `checkFileType`. Defaults to None.
+            minDuration (float, optional): Shortest duration in seconds. Defaults to None.
+            maxDuration (float, optional): Longest duration in seconds. Defaults to None.
+            minHeight (int, optional): Smallest frame height in pixels. Defaults to None.
+            codec (str, optional): Codec name as reported by ffprobe, e.g. "h264". Defaults to None.
+            hasAudio (bool, optional): Whether the videos have an audio track. Defaults to None.
+            includeFailed (bool, optional): Whether to return the files that could not be probed. Defaults to False.
+        """
+        filters = {
+            "type = ?": fileType,
+            "duration >= ?": minDuration,
+            "duration <= ?": maxDuration,
+            "height >= ?": minHeight,
+            "codec = ?": codec,
+            "hasAudio = ?": None if hasAudio is None else int(hasAudio),
+        }
+        conditions = [condition for condition, value in filters.items() if value is not None]
+        parameters = [value for value in filters.values() if value is not None]
+        if not includeFailed:
+            conditions.append("error IS NULL")
+        return [dict(row) for row in self._rows("SELECT * FROM media", root, conditions, parameters)]
+
+    def select(self, pattern: str, fileType=None) -> list:
+        """Returns the entries of the files in the directory `pattern`, sub directories included, or of those matching
+        the glob `pattern`, as `query` does
+        """
+        if os.path.isdir(pattern):
+            return self.query(pattern, fileType)
+        pattern = os.path.abspath(pattern)
+        return [entry for entry in self.query(fileType=fileType) if fnmatch.fnmatchcase(entry["path"], pattern)]
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+def planJobs(entries: list, jobCount: int) -> list:
+    """Splits catalog entries into `jobCount` lists holding about as many frames each, giving the longest files out
+    first, each to the job with the fewest frames so far
+    """
+    jobs = [[] for _ in range(jobCount)]
+    frames = [0] * jobCount
+    for entry in sorted(entries, key=lambda entry: entry["frameCount"] or 0, reverse=True):
+        ind = frames.index(min(frames))
+        jobs[ind].append(entry)
+        frames[ind] += entry["frameCount"] or 0
+    return jobs
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(colored("Usage: python -m src.modules.mediaCatalog <directory> [catalog.sqlite]", "red"))
+        return
+
+    with MediaCatalog(*sys.argv[2:3]) as catalog:
+        summary = catalog.scan(sys.argv[1])
+        print(
+            colored(
+                f"Scanned {summary['files']} files in {summary['seconds']:.1f}s: {summary['added']} added, "
+                f"{summary['updated']} updated, {summary['unchanged']} unchanged, {summary['removed']} removed",
+                "green",
+            )
+        )
+        failures = [entry for entry in catalog.query(sys.argv[1], includeFailed=True) if entry["error"]]
+        for entry in failures:
+            print(colored(f"  {entry['path']}: {entry['error']}", "red"))
+
+
+if __name__ == "__main__":
+    main()
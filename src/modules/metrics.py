@@ -0,0 +1,254 @@
+"""Runtime instrumentation of the pipeline stages: decoding, colour conversion, inference, landmark conversion,
+drawing and encoding.
+
+Instrumentation is off by default and costs a flag check per call while it stays off. Once `enable`d, every stage
+records its latency into a histogram, and the detectors count the frames they processed and the detections per frame.
+Worker processes started by `Detector.createWorkerPool` record their own values while instrumentation is enabled
+here, and hand them back with each result, so that they are part of `snapshot` like those of this process.
+
+Usage:
+```python
+from src.modules import metrics
+
+metrics.enable()
+frames = HandDetector().findHandsInFrames(readVideo("assets/chain punch.mp4"))
+print(metrics.snapshot()["stage_seconds"])
+metrics.writePrometheus("out/metrics.prom")  # or metrics.serve(9100)
+```
+"""
+
+import os
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PREFIX = "cv_"
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+COUNT_BUCKETS = (0, 1, 2, 3, 4, 5, 10, 20, 50)
+
+_enabled = False
+_lock = threading.Lock()
+# name => {"help": str, "type": "counter" | "histogram", "buckets": tuple, "series": {labels: value or histogram}}
+_metrics = {}
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def isEnabled() -> bool:
+    return _enabled
+
+
+def reset():
+    """Forgets every recorded value"""
+    with _lock:
+        _metrics.clear()
+
+
+def _series(name: str, kind: str, labels: dict, buckets=None, description=""):
+    metric = _metrics.setdefault(name, {"help": description, "type": kind, "buckets": buckets, "series": {}})
+    key = tuple(sorted(labels.items()))
+    if key not in metric["series"]:
+        metric["series"][key] = (
+            0 if kind == "counter" else {"count": 0, "sum": 0.0, "buckets": [0] * (len(metric["buckets"]) + 1)}
+        )
+    return metric, key
+
+
+def increment(name: str, amount=1, description="", **labels):
+    """Adds `amount` to the counter `name` of the series with `labels`"""
+    if not _enabled:
+        return
+    with _lock:
+        metric, key = _series(name, "counter", labels, description=description)
+        metric["series"][key] += amount
+
+
+def observe(name: str, value: float, buckets=LATENCY_BUCKETS, description="", **labels):
+    """Records `value` into the histogram `name` of the series with `labels`"""
+    if not _enabled:
+        return
+    with _lock:
+        metric, key = _series(name, "histogram", labels, buckets, description)
+        histogram = metric["series"][key]
+        histogram["count"] += 1
+        histogram["sum"] += value
+        # the last bucket is +Inf
+        histogram["buckets"][bisect_left(metric["buckets"], value)] += 1
+
+
+class _Timer:
+    __slots__ = ("stage", "component", "start")
+
+    def __init__(self, stage: str, component: str):
+        self.stage = stage
+        self.component = component
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *_):
+        observe(
+            "stage_seconds",
+            time.perf_counter() - self.start,
+            description="Latency of each pipeline stage",
+            stage=self.stage,
+            component=self.component,
+        )
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        return None
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timer(stage: str, component: str):
+    """Returns a context manager recording how long its body took as `stage` of `component`,
+    e.g. `with metrics.timer("inference", "HandDetector"):`
+    """
+    return _Timer(stage, component) if _enabled else _NULL_TIMER
+
+
+def recordDetections(component: str, detections: int):
+    """Counts a frame processed by `component` and how many hands, faces or poses it held"""
+    if not _enabled:
+        return
+    increment("frames_total", description="Frames processed", component=component)
+    observe("detections", detections, COUNT_BUCKETS, description="Detections per frame", component=component)
+
+
+def drain() -> dict:
+    """Returns the raw values recorded so far and forgets them, so that a worker process can hand them to its parent,
+    see `merge`
+    """
+    with _lock:
+        drained = dict(_metrics)
+        _metrics.clear()
+        return drained
+
+
+def merge(recorded: dict):
+    """Adds the raw values returned by `drain` in another process to the values recorded here"""
+    with _lock:
+        for name, metric in recorded.items():
+            for key, value in metric["series"].items():
+                target, key = _series(name, metric["type"], dict(key), metric["buckets"], metric["help"])
+                if metric["type"] == "counter":
+                    target["series"][key] += value
+                    continue
+                histogram = target["series"][key]
+                histogram["count"] += value["count"]
+                histogram["sum"] += value["sum"]
+                histogram["buckets"] = [old + new for old, new in zip(histogram["buckets"], value["buckets"])]
+
+
+def _quantile(buckets: tuple, counts: list, total: int, q: float):
+    # the upper bound of the bucket holding the quantile, as precise as the histogram allows
+    target = q * total
+    cumulative = 0
+    for bound, count in zip(buckets + (float("inf"),), counts):
+        cumulative += count
+        if cumulative >= target:
+            return bound
+    return float("inf")
+
+
+def snapshot() -> dict:
+    """Returns every metric as `{name: {labels: value}}`, where the labels are a tuple of `(label, value)` pairs.
+    Counters map to their value, histograms to their count, sum, mean and the bucket bounds of p50, p95 and p99.
+    """
+    with _lock:
+        res = {}
+        for name, metric in _metrics.items():
+            res[name] = {}
+            for key, value in metric["series"].items():
+                if metric["type"] == "counter":
+                    res[name][key] = value
+                    continue
+                count = value["count"]
+                res[name][key] = {
+                    "count": count,
+                    "sum": value["sum"],
+                    "mean": value["sum"] / count if count else None,
+                    **{
+                        f"p{int(q * 100)}": _quantile(metric["buckets"], value["buckets"], count, q)
+                        for q in (0.5, 0.95, 0.99)
+                    },
+                }
+        return res
+
+
+def _formatLabels(key: tuple, extra=()) -> str:
+    labels = list(key) + list(extra)
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{label}="{value}"' for label, value in labels) + "}"
+
+
+def toPrometheus() -> str:
+    """Formats every metric in the Prometheus text exposition format"""
+    lines = []
+    with _lock:
+        for name, metric in sorted(_metrics.items()):
+            fullName = PREFIX + name
+            if metric["help"]:
+                lines.append(f"# HELP {fullName} {metric['help']}")
+            lines.append(f"# TYPE {fullName} {metric['type']}")
+            for key, value in metric["series"].items():
+                if metric["type"] == "counter":
+                    lines.append(f"{fullName}{_formatLabels(key)} {value}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric["buckets"] + ("+Inf",), value["buckets"]):
+                    cumulative += count
+                    lines.append(f"{fullName}_bucket{_formatLabels(key, [('le', bound)])} {cumulative}")
+                lines.append(f"{fullName}_sum{_formatLabels(key)} {value['sum']}")
+                lines.append(f"{fullName}_count{_formatLabels(key)} {value['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def writePrometheus(filename: str):
+    """Writes the metrics to `filename`, e.g. for the textfile collector of the Prometheus node exporter"""
+    os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+    # the collector may read the file at any time, so it is replaced in one go
+    temporaryFilename = f"{filename}.tmp"
+    with open(temporaryFilename, "w") as file:
+        file.write(toPrometheus())
+    os.replace(temporaryFilename, filename)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = toPrometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *_):
+        pass
+
+
+def serve(port=9100, host="127.0.0.1") -> ThreadingHTTPServer:
+    """Serves the metrics for Prometheus to scrape on a background thread, call `shutdown()` on the result to stop"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -1,14 +1,30 @@
 import cv2
-import mediapipe as mp
+import numpy as np
 import os
-from src.modules.utils import checkFileType, readVideo
+from src.modules import geometry, metrics, renderer
+from src.modules.constants import EMPHASIS_COLOR
+from src.modules.detector import Detector, mediapipeSolutions
+from src.modules.landmarks import landmarksToArray, toLandmarkList, toPixels, toTuples
+from src.modules.resizePlan import ResizePlan
+from src.modules.segmentedJob import SegmentedJob
+from src.modules.subsampling import Subsampler
+from src.modules.utils import VideoReader, checkFileType, outputWrite
 from termcolor import colored
-import ffmpeg
-import math
-from src.modules.handTracking import EMPHASIS_COLOR
 
 
-class PoseDetector:
+class PoseDetector(Detector):
+    """Finds the landmarks of a single pose with MediaPipe Pose.
+
+    With `fastDraw` set, poses are drawn by `src.modules.renderer`, which batches every line and landmark of a frame
+    into one OpenCV call each, instead of with the MediaPipe style.
+
+    With `inferenceMaxSide` or `inferenceScale` set, the graph runs on the frame downscaled by a `ResizePlan`, while
+    the landmarks are still returned and drawn in the pixels of the frame as it came.
+    """
+
+    graphAttribute = "pose"
+    multipleResults = False
+
     def __init__(
         self,
         staticImageMode=False,
@@ -18,6 +34,9 @@ class PoseDetector:
         smoothSegmentation=True,
         minDetectionConfidence=0.5,
         minTrackingConfidence=0.5,
+        fastDraw=False,
+        inferenceMaxSide=None,
+        inferenceScale=None,
     ):
         self.staticImageMode = staticImageMode
         self.modelComplexity = modelComplexity
@@ -26,34 +45,69 @@ class PoseDetector:
         self.smoothSegmentation = smoothSegmentation
         self.minDetectionConfidence = minDetectionConfidence
         self.minTrackingConfidence = minTrackingConfidence
-        self.mpPose = mp.solutions.pose
-        self.pose = self.mpPose.Pose(
-            staticImageMode,
-            modelComplexity,
-            smoothLandmarks,
-            enableSegmentation,
-            smoothSegmentation,
-            minDetectionConfidence,
-            minTrackingConfidence,
-        )
-        self.mpDraw = mp.solutions.drawing_utils
-        self.mpDrawingStyles = mp.solutions.drawing_styles
+        self.fastDraw = fastDraw
+        self.inferenceMaxSide = inferenceMaxSide
+        self.inferenceScale = inferenceScale
+        self.resizePlan = ResizePlan(inferenceMaxSide, inferenceScale)
+        solutions = mediapipeSolutions()
+        self.mpPose = solutions.pose
+        self.pose = self.createGraph()
+        self.mpDraw = solutions.drawing_utils
+        self.mpDrawingStyles = solutions.drawing_styles
         self.drawingSpecLine = self.mpDraw.DrawingSpec((20, 255, 0), 7)
         self.drawingSpecLandmark = self.mpDraw.DrawingSpec((20, 20, 255), 3, 15)
+        self.renderer = renderer.Renderer(
+            renderer.POSE_CONNECTIONS, self.drawingSpecLine.color, 7, self.drawingSpecLandmark.color, 6
+        )
+
+    def getParams(self) -> dict:
+        return {
+            "staticImageMode": self.staticImageMode,
+            "modelComplexity": self.modelComplexity,
+            "smoothLandmarks": self.smoothLandmarks,
+            "enableSegmentation": self.enableSegmentation,
+            "smoothSegmentation": self.smoothSegmentation,
+            "minDetectionConfidence": self.minDetectionConfidence,
+            "minTrackingConfidence": self.minTrackingConfidence,
+            "fastDraw": self.fastDraw,
+            "inferenceMaxSide": self.inferenceMaxSide,
+            "inferenceScale": self.inferenceScale,
+        }
+
+    def createGraph(self):
+        return self.mpPose.Pose(
+            static_image_mode=self.staticImageMode,
+            model_complexity=self.modelComplexity,
+            smooth_landmarks=self.smoothLandmarks,
+            enable_segmentation=self.enableSegmentation,
+            smooth_segmentation=self.smoothSegmentation,
+            min_detection_confidence=self.minDetectionConfidence,
+            min_tracking_confidence=self.minTrackingConfidence,
+        )
 
-    def findPose(self, img, draw=True):
+    def find(self, img, draw=True, **options):
+        return self.findPose(img, draw, **options)
+
+    def findPose(self, img, draw=True, asArray=False, normalised=False, rgb=None):
         """
         Returns a tuples structured as `(img, poses)`
         And "poses" is:
         ```python
         list[list[tuple[landmarkId: int, x: int, y: int]]]
         ```
+        or a float32 array of shape `(33, 4)` if `asArray` is set, see `src.modules.landmarks`.
+        `rgb` can hold the frame already converted to RGB, e.g. when it is shared by several detectors,
+        or be True when `img` itself is RGB.
         """
-        currResult = self.pose.process(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+        with metrics.timer("convert", "PoseDetector"):
+            rgb = self.inferenceInput(img, rgb)
+        with metrics.timer("inference", "PoseDetector"):
+            currResult = self.pose.process(rgb)
         landmarks = currResult.pose_landmarks
-        poses = []
-        if landmarks:
-            if draw:
+        with metrics.timer("draw", "PoseDetector"):
+            if landmarks and draw and self.fastDraw:
+                self.renderer.draw(img, landmarksToArray([landmarks], 33, withVisibility=True))
+            elif landmarks and draw:
                 self.mpDraw.draw_landmarks(
                     img,
                     landmarks,
@@ -61,70 +115,89 @@ class PoseDetector:
                     self.mpDrawingStyles.get_default_pose_landmarks_style(),
                     self.drawingSpecLine,
                 )
-            pose = []
-            for ind, landmark in enumerate(landmarks.landmark):
-                imageH, imageW, _ = img.shape
-                x, y = int(landmark.x * imageW), int(landmark.y * imageH)
-                pose.append((ind, x, y))
-            poses.append(pose)
 
-        return (img, poses)
+        with metrics.timer("landmarks", "PoseDetector"):
+            pose = landmarksToArray([landmarks], 33, withVisibility=True)[0] if landmarks else np.full((33, 4), np.nan)
+            res = self.formatResult(img, pose, asArray, normalised)
+        metrics.recordDetections("PoseDetector", int(landmarks is not None))
+        return (img, res)
+
+    @staticmethod
+    def formatResult(img, pose, asArray=False, normalised=False):
+        """Converts a normalised `(33, 4)` pose into the format returned by `findPose`"""
+        if asArray and normalised:
+            return pose.astype(np.float32)
+
+        pose = toPixels(pose, img.shape)
+        if asArray:
+            return pose.astype(np.float32)
+        return [] if np.isnan(pose).all() else [toTuples(pose)]
+
+    def drawArray(self, img, pose):
+        """Draws a normalised `(33, 4)` pose, e.g. one that was cached rather than inferred"""
+        if self.fastDraw:
+            return self.renderer.draw(img, pose)
+        if not np.isnan(pose).all():
+            self.mpDraw.draw_landmarks(
+                img,
+                toLandmarkList(pose),
+                self.mpPose.POSE_CONNECTIONS,
+                self.mpDrawingStyles.get_default_pose_landmarks_style(),
+                self.drawingSpecLine,
+            )
+        return img
 
-    def findPoseInFrames(self, frames: list, draw=True):
+    def findPoseInFrames(self, frames, draw=True, **options):
         """
         Returns a list of tuples where `list[i] = (frame, poses)`
         And "poses" is:
         ```python
         list[list[tuple[landmarkId: int, x: int, y: int]]]
         ```
+
+        `frames` can be a list of frames or a `VideoReader`, in which case the tuples are yielded lazily.
+        See `Detector.findInFrames` for the `options`, e.g. running over a pool of `workers` processes.
         """
-        res = []
-        for frame in frames:
-            res.append(self.findPose(frame, draw))
-        return res
+        return self.findInFrames(frames, draw, **options)
 
     def highlightLandmark(self, img, poses, landmarkId, circleRadius=12):
         """Given a list of poses, highlight the landmark where `landmark.id = landmarkId` across all poses.
 
         Args:
             img: cv2 img
-            poses (List[List[Tuple[int, int]]]): A list of hands
-            landmarkId ([type]): [description]
+            poses: A list of poses of `(id, x, y)` tuples or a pixel array of shape `(33, 2 | 3 | 4)`
+            landmarkId: A landmark id, or a list of ids to highlight in one go
         """
-        x, y = None, None
-
-        for pose in poses:
-            for ind, currX, currY in pose:
-                if ind == landmarkId:
-                    x, y = currX, currY
-                    break
-
-        if x is None or y is None:
+        if isinstance(poses, list):
+            pixels = np.array([[point[1:] for point in pose] for pose in poses]).reshape(-1, 33, 2)
+        else:
+            pixels = np.asarray(poses)[None, :, :2]
+        ids = np.atleast_1d(landmarkId)
+        if not len(pixels) or ids.min() < 0 or ids.max() >= pixels.shape[1] or np.isnan(pixels[:, ids]).any():
             raise ValueError("Invalid landmark id")
 
-        cv2.circle(img, (x, y), circleRadius, EMPHASIS_COLOR, cv2.FILLED)
+        renderer.highlightLandmarks(
+            img, renderer.toPixelPoints(pixels, normalised=False), ids, EMPHASIS_COLOR, circleRadius
+        )
 
         return img
 
     def findAndComputeAngle(
         self, img, pose: list, landmarkAId, landmarkBId, landmarkCId, draw=True, drawAngleValue=False
     ):
-        """Computes and returns the value of ∠ABC
+        """Computes and returns the value of ∠ABC, see `geometry.jointAngles` to compute it for a whole clip at once
 
         Args:
+            pose: A list of `(id, x, y)` tuples or an array of shape `(33, 2 | 3 | 4)`
             landmarkA: A
             landmarkB: B
             landmarkC: C
             draw (bool, optional): [description]. Defaults to True.
         """
-        x1, y1 = pose[landmarkAId][1:]
-        x2, y2 = pose[landmarkBId][1:]
-        x3, y3 = pose[landmarkCId][1:]
+        points = np.asarray(pose)[:, 1:] if isinstance(pose, list) else pose
+        angle = float(geometry.jointAngles(points, [(landmarkAId, landmarkBId, landmarkCId)])[0])
 
-        angle = math.degrees(math.atan2(y3 - y2, x3 - x2) - math.atan2(y1 - y2, x1 - x2))
-
-        if angle < 0:
-            angle += 360
+        (x1, y1), (x2, y2), (x3, y3) = points[[landmarkAId, landmarkBId, landmarkCId], :2].astype(int).tolist()
 
         if draw:
             cv2.line(img, (x1, y1), (x2, y2), (255, 255, 255), 5)
@@ -145,6 +218,10 @@ def main():
     filename = "./assets/IpVsWan0.mp4"
     filename = os.path.normpath(filename)
     write = True
+    # only detect every few frames of a video and interpolate the poses in between
+    subsample = False
+    # e.g. 300 to process long videos in checkpointed segments of 5 minutes, which a restarted run resumes from
+    segmentSeconds = None
 
     fileType = checkFileType(filename)
 
@@ -152,55 +229,41 @@ def main():
         print(colored("Unsupported file format", "red"))
         return
 
-    frameWidth = None
-    frameHeight = None
-
-    frames = []
+    fps = None
+    frameShape = None
 
     if fileType == "image":
-        img = cv2.imread(filename)
-        frames.append(img)
+        frames = [cv2.imread(filename)]
     else:
-        ((frames, audio), (frameWidth, frameHeight)) = readVideo(filename, True, True)
-
-    print(colored(f"Finish reading {fileType}", "green"))
+        # frames are decoded, processed and encoded one at a time
+        frames = VideoReader(filename, prefetch=8)
+        fps, frameShape = frames.fps, (frames.frameWidth, frames.frameHeight)
 
     detector = PoseDetector()
-
-    allPosesInFrames = detector.findPoseInFrames(frames, True)
-    frames = []
-    for frame, _ in allPosesInFrames:
-        frames.append(frame)
-
-    print(colored("Finish processing pose estimation", "green"))
-
-    if not write:
-        if fileType == "video":
-            for frame in frames:
-                cv2.imshow("Frame", frame)
-                cv2.waitKey(1)
-        else:
-            cv2.imshow("Frame", frames[0])
-            cv2.waitKey(0)
+    subsampler = Subsampler(step=4, keyframes="motion", method="spline") if subsample else None
+    if segmentSeconds and write and fileType == "video":
+        frames.release()
+        job = SegmentedJob(filename, f"out/pose/{os.path.basename(filename)}", segmentSeconds)
+        # the workers are only used without a subsampler, as for `findPoseInFrames`
+        outputFilename = job.run(detector, True, subsampler=subsampler, workers=os.cpu_count())
+        print(colored(f"Output written to {outputFilename}", "green"))
         return
 
-    outputFilename = f"out/pose/buffer-{filename.split(os.sep)[-1]}"
+    if subsample and fileType == "video":
+        framesWithPoses = detector.findPoseInFrames(frames, True, subsampler=subsampler)
+    else:
+        framesWithPoses = detector.findPoseInFrames(frames, True, workers=os.cpu_count())
+    frames = (frame for frame, _ in framesWithPoses)
 
-    if fileType == "video":
-        outputVideo = cv2.VideoWriter(outputFilename, cv2.VideoWriter_fourcc(*"MP4V"), 30, (frameWidth, frameHeight))
+    if not write:
         for frame in frames:
-            outputVideo.write(frame)
-        outputVideo.release()
-
-        processedFfmpegVideo = ffmpeg.input(outputFilename)
-
-        ffmpeg.concat(processedFfmpegVideo, audio, v=1, a=1).output(outputFilename.replace("buffer-", "", 1)).run()
-        os.remove(outputFilename)
+            cv2.imshow("Frame", frame)
+            cv2.waitKey(1 if fileType == "video" else 0)
+        return
 
-    else:
-        if write:
-            cv2.imwrite(outputFilename, frames[0])
+    outputFilename = outputWrite(frames, filename, fileType, "pose", fps, frameShape, filename)
 
+    print(colored("Finish processing pose estimation", "green"))
     print(colored(f"Output written to {outputFilename}", "green"))
 
 
@@ -0,0 +1,173 @@
+"""Vectorised drawing of landmark arrays.
+
+`mpDraw.draw_landmarks` needs a MediaPipe landmark list and draws every connection and landmark with its own OpenCV
+call from Python. The functions here take the arrays described in `src.modules.landmarks` instead, index them with
+precomputed connection arrays, and draw every line of a frame with a single `cv2.polylines` call and every dot with
+another, however many hands, poses or faces there are.
+
+Usage:
+```python
+renderer = Renderer(HAND_CONNECTIONS, lineColor=(26, 246, 0), pointColor=(48, 48, 255))
+renderer.draw(img, hands)  # normalised (nHands, 21, 3) landmarks
+drawDots(img, toPixelPoints(hands[:, [4, 8]], img.shape), (26, 0, 246), 12)
+```
+"""
+
+import cv2
+import numpy as np
+
+
+def connectionsToArray(connections) -> np.ndarray:
+    """Converts a MediaPipe set of `(start, end)` landmark index pairs into a sorted int array of shape `(n, 2)`"""
+    return np.array(sorted(connections), dtype=np.intp).reshape(-1, 2)
+
+
+# constant => the MediaPipe solution and the connection set it is built from
+_CONNECTIONS = {
+    "HAND_CONNECTIONS": ("hands", "HAND_CONNECTIONS"),
+    "POSE_CONNECTIONS": ("pose", "POSE_CONNECTIONS"),
+    "FACEMESH_CONTOURS": ("face_mesh", "FACEMESH_CONTOURS"),
+}
+
+
+def __getattr__(name: str):
+    # `HAND_CONNECTIONS`, `POSE_CONNECTIONS` and `FACEMESH_CONTOURS` are built on first access,
+    # so that importing the renderer does not import MediaPipe
+    if name not in _CONNECTIONS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    from src.modules.detector import mediapipeSolutions
+
+    solution, connections = _CONNECTIONS[name]
+    value = connectionsToArray(getattr(getattr(mediapipeSolutions(), solution), connections))
+    globals()[name] = value
+    return value
+
+
+def toPixelPoints(points: np.ndarray, imageShape=None, normalised=True) -> np.ndarray:
+    """Returns the x and y of `points` as int32 pixels, scaling them to an image of `imageShape` if `normalised`"""
+    points = np.asarray(points, dtype=np.float64)[..., :2]
+    if normalised:
+        imageH, imageW = imageShape[:2]
+        points = points * (imageW, imageH)
+    return np.rint(points).astype(np.int32)
+
+
+def drawSegments(img, segments: np.ndarray, color, thickness=2, lineType=cv2.LINE_8):
+    """Draws every `((x1, y1), (x2, y2))` pixel segment of the `(n, 2, 2)` array `segments` in one call"""
+    if len(segments):
+        cv2.polylines(img, np.ascontiguousarray(segments, dtype=np.int32), False, color, thickness, lineType)
+    return img
+
+
+def drawDots(img, points: np.ndarray, color, radius=4):
+    """Draws a filled circle of `radius` at every `(x, y)` pixel of `points`, of any leading shape, in one call"""
+    points = np.asarray(points, dtype=np.int32).reshape(-1, 2)
+    if len(points):
+        # a thick segment of length 0 is exactly the filled circle `cv2.circle` would draw
+        drawSegments(img, np.repeat(points[:, None], 2, axis=1), color, 2 * radius)
+    return img
+
+
+def skeletonSegments(pixels: np.ndarray, connections: np.ndarray, visible=None) -> np.ndarray:
+    """Returns the `(n, 2, 2)` segments joining `connections` in every skeleton of the `(nSkeletons, nLandmarks, 2)`
+    array `pixels`, leaving out segments with an end that is not `visible`
+    """
+    segments = pixels[:, connections].reshape(-1, 2, 2)
+    if visible is not None:
+        segments = segments[visible[:, connections].all(axis=-1).reshape(-1)]
+    return segments
+
+
+class Renderer:
+    """Draws skeletons in a fixed style straight from landmark arrays.
+
+    Args:
+        connections: `(n, 2)` array of the landmark indices to join, e.g. `HAND_CONNECTIONS`.
+        lineColor: BGR colour of the connections.
+        lineThickness (int, optional): Defaults to 2.
+        pointColor (optional): BGR colour of the landmarks. Defaults to None and thus no landmarks are drawn.
+        pointRadius (int, optional): Defaults to 3.
+        visibilityThreshold (float, optional): Landmarks whose visibility, the fourth column of a pose, is below this
+            are not drawn, like `draw_landmarks` does. Defaults to 0.5.
+    """
+
+    def __init__(
+        self,
+        connections: np.ndarray,
+        lineColor,
+        lineThickness=2,
+        pointColor=None,
+        pointRadius=3,
+        visibilityThreshold=0.5,
+    ):
+        self.connections = connections
+        self.lineColor = lineColor
+        self.lineThickness = lineThickness
+        self.pointColor = pointColor
+        self.pointRadius = pointRadius
+        self.visibilityThreshold = visibilityThreshold
+
+    def draw(self, img, points: np.ndarray, normalised=True):
+        """Draws `(nSkeletons, nLandmarks, 3 | 4)` or `(nLandmarks, 3 | 4)` landmarks, normalised or in pixels"""
+        points = np.asarray(points)
+        if points.ndim == 2:
+            points = points[None]
+        if not points.size:
+            return img
+
+        visible = ~np.isnan(points[..., :2]).any(axis=-1)
+        if points.shape[-1] > 3:
+            visible &= points[..., 3] >= self.visibilityThreshold
+        pixels = toPixelPoints(np.nan_to_num(points), img.shape, normalised)
+
+        drawSegments(img, skeletonSegments(pixels, self.connections, visible), self.lineColor, self.lineThickness)
+        if self.pointColor is not None:
+            drawDots(img, pixels[visible], self.pointColor, self.pointRadius)
+        return img
+
+
+def highlightLandmarks(img, pixels: np.ndarray, landmarkIds, color, radius=12):
+    """Draws a dot on each of `landmarkIds` of every skeleton of the `(nSkeletons, nLandmarks, 2)` array `pixels`"""
+    return drawDots(img, pixels[:, np.atleast_1d(landmarkIds)], color, radius)
+
+
+def connectLandmarks(img, pixels: np.ndarray, landmarkAIds, landmarkBIds, color, thickness=4):
+    """Draws a line from each of `landmarkAIds` to the matching one of `landmarkBIds` in every skeleton of the
+    `(nSkeletons, nLandmarks, 2)` array `pixels`
+    """
+    connections = np.stack([np.atleast_1d(landmarkAIds), np.atleast_1d(landmarkBIds)], axis=-1)
+    return drawSegments(img, skeletonSegments(pixels, connections), color, thickness)
+
+
+class Overlay:
+    """A reusable layer to draw annotations on before composing them onto frames, e.g. to blend them or to draw them
+    once and reuse them across frames. The layer is only allocated again when the frame size changes.
+    Black pixels of the layer are treated as transparent.
+
+    Usage:
+    ```python
+    overlay = Overlay()
+    renderer.draw(overlay.clear(img.shape), hands)
+    overlay.compose(img, alpha=0.6)
+    ```
+    """
+
+    def __init__(self):
+        self.layer = None
+
+    def clear(self, imageShape) -> np.ndarray:
+        """Returns the layer for frames of `imageShape`, wiped clean"""
+        if self.layer is None or self.layer.shape != tuple(imageShape):
+            self.layer = np.zeros(imageShape, np.uint8)
+        else:
+            self.layer.fill(0)
+        return self.layer
+
+    def compose(self, img, alpha=1.0):
+        """Copies the annotations of the layer onto `img`, blended with it by `alpha`"""
+        if self.layer is None:
+            return img
+        mask = self.layer.max(axis=2) if self.layer.ndim == 3 else self.layer
+        source = self.layer if alpha >= 1 else cv2.addWeighted(img, 1 - alpha, self.layer, alpha, 0)
+        cv2.copyTo(source, mask, img)
+        return img
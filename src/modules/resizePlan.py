@@ -0,0 +1,79 @@
+import cv2
+import numpy as np
+
+
+class ResizePlan:
+    """Downscales frames to an inference resolution, given as a maximum side or a scale factor.
+
+    The steps to get there are planned once per input size and reused, with their output buffers, for every following
+    frame of that size, so a video costs no allocation per frame. `cv2.INTER_AREA` only has a fast path for integer
+    ratios, so the plan halves the frame with it while the size allows, and finishes with a single `cv2.INTER_LINEAR`
+    step over a ratio above one half, where it does not alias. Frames already small enough are passed through
+    untouched, frames are never upscaled.
+
+    Landmarks found on the downscaled frame are normalised to it, and as the aspect ratio is kept they are normalised
+    to the original frame just as well, so they map back to its pixels with `landmarks.toPixels(points, img.shape)`.
+
+    Usage:
+    ```python
+    plan = ResizePlan(maxSide=640)
+    small = plan.apply(img)  # 640x360 for a 1920x1080 frame, through 960x540
+    ```
+
+    Args:
+        maxSide (int, optional): Longest side of the frames inferred on. Defaults to None.
+        scale (float, optional): Factor the frames are scaled by, used when `maxSide` is not set. Defaults to None.
+    """
+
+    def __init__(self, maxSide=None, scale=None):
+        if maxSide is not None and maxSide <= 0:
+            raise ValueError(f"maxSide must be positive, got {maxSide}")
+        if scale is not None and not 0 < scale <= 1:
+            raise ValueError(f"scale must be within (0, 1], got {scale}")
+        self.maxSide = maxSide
+        self.scale = scale
+        # the shape the steps were planned for, and `((frameWidth, frameHeight), interpolation, buffer)` per step
+        self.shape = None
+        self.steps = []
+
+    def isActive(self) -> bool:
+        return self.maxSide is not None or self.scale is not None
+
+    def targetSize(self, imageShape) -> tuple:
+        """Returns the `(frameWidth, frameHeight)` an image of `imageShape` is resized to, or None if it is kept"""
+        imageH, imageW = imageShape[:2]
+        factor = self.maxSide / max(imageH, imageW) if self.maxSide is not None else self.scale
+        if factor is None or factor >= 1:
+            return None
+        return (max(1, round(imageW * factor)), max(1, round(imageH * factor)))
+
+    def plan(self, imageShape) -> list:
+        """Returns the `((frameWidth, frameHeight), interpolation)` steps resizing an image of `imageShape`"""
+        target = self.targetSize(imageShape)
+        if target is None:
+            return []
+        imageH, imageW = imageShape[:2]
+        steps = []
+        # exact halvings take the fast path of `INTER_AREA`
+        while imageW % 2 == 0 and imageH % 2 == 0 and imageW // 2 >= target[0] and imageH // 2 >= target[1]:
+            imageW, imageH = imageW // 2, imageH // 2
+            steps.append(((imageW, imageH), cv2.INTER_AREA))
+        if (imageW, imageH) != target:
+            # a ratio beyond one half is only left when the size could not be halved exactly
+            downscaled = imageW > 2 * target[0] or imageH > 2 * target[1]
+            steps.append((target, cv2.INTER_AREA if downscaled else cv2.INTER_LINEAR))
+        return steps
+
+    def apply(self, img):
+        """Returns `img` downscaled to the inference resolution, in a buffer reused by the next call"""
+        if not self.isActive():
+            return img
+        if img.shape != self.shape:
+            self.shape = img.shape
+            self.steps = [
+                (size, interpolation, np.empty((size[1], size[0], *img.shape[2:]), img.dtype))
+                for size, interpolation in self.plan(img.shape)
+            ]
+        for size, interpolation, buffer in self.steps:
+            img = cv2.resize(img, size, buffer, interpolation=interpolation)
+        return img
@@ -0,0 +1,45 @@
+"""Helpers for running inference on a region of interest (ROI) instead of the whole frame.
+
+ROIs are `(xStart, yStart, xEnd, yEnd)` pixel boxes, landmarks are normalised arrays, see `src.modules.landmarks`.
+"""
+
+import numpy as np
+
+
+def landmarksToRoi(points: np.ndarray, imageShape, margin=0.5) -> tuple:
+    """Returns the square ROI around normalised `points`, expanded by `margin` times its size on every side
+    and clamped to an image of `imageShape`.
+    """
+    imageH, imageW = imageShape[:2]
+    xs, ys = points[:, 0] * imageW, points[:, 1] * imageH
+    centreX, centreY = (xs.min() + xs.max()) / 2, (ys.min() + ys.max()) / 2
+    half = max(xs.max() - xs.min(), ys.max() - ys.min()) * (0.5 + margin)
+
+    return (
+        int(max(0, centreX - half)),
+        int(max(0, centreY - half)),
+        int(min(imageW, centreX + half)),
+        int(min(imageH, centreY + half)),
+    )
+
+
+def roiToFrame(points: np.ndarray, roi: tuple, imageShape) -> np.ndarray:
+    """Maps landmarks normalised to the `roi` crop back to landmarks normalised to the whole image of `imageShape`"""
+    imageH, imageW = imageShape[:2]
+    xStart, yStart, xEnd, yEnd = roi
+    mapped = points.copy()
+    mapped[..., 0] = (xStart + points[..., 0] * (xEnd - xStart)) / imageW
+    mapped[..., 1] = (yStart + points[..., 1] * (yEnd - yStart)) / imageH
+    # z is relative to the width of the image it was inferred on
+    mapped[..., 2] = points[..., 2] * (xEnd - xStart) / imageW
+    return mapped
+
+
+def roiOverlap(roiA: tuple, roiB: tuple) -> float:
+    """Returns the fraction of the smaller ROI covered by the other one"""
+    width = min(roiA[2], roiB[2]) - max(roiA[0], roiB[0])
+    height = min(roiA[3], roiB[3]) - max(roiA[1], roiB[1])
+    if width <= 0 or height <= 0:
+        return 0.0
+    smallerArea = min((roi[2] - roi[0]) * (roi[3] - roi[1]) for roi in (roiA, roiB))
+    return width * height / smallerArea if smallerArea > 0 else 0.0
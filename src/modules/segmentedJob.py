@@ -0,0 +1,317 @@
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+from src.modules.landmarks import stackFrames
+from src.modules.utils import VideoReader, VideoWriter
+
+DEFAULT_WORK_DIRECTORY = os.path.join(os.path.expanduser("~"), ".cache", "computer-vision", "segments")
+# bump whenever the layout of the work directory changes
+MANIFEST_VERSION = 2
+
+
+class SegmentedJob:
+    """Processes a long video in fixed-length segments, so that a job that crashed or was preempted continues from
+    the last completed segment instead of starting over.
+
+    Each segment is read with its own `VideoReader`, encoded without audio into the work directory, and its
+    normalised landmark arrays are saved next to it with `landmarks.stackFrames`. The manifest of the work directory
+    then records the segment as done, so a segment is either complete or processed again. The detector is reset at
+    the start of every segment, so the result does not depend on where the job was resumed.
+    Once every segment is done, they are joined with ffmpeg's concat demuxer without being re-encoded, and the audio
+    track of the source is copied in.
+
+    The manifest also holds the source, detector and parameters of the job, and the work directory is cleared when
+    any of them changed. When only the annotation changed, e.g. the `annotateKey` passed to `run`, the segments are
+    drawn again from their stored landmarks without running the detector. The source is identified by its size and
+    modification time, as hashing hours of video would cost about as much as decoding it.
+
+    Usage:
+    ```python
+    job = SegmentedJob("assets/IpVsWan0.mp4", "out/pose/IpVsWan0.mp4", segmentSeconds=300)
+    outputFilename = job.run(PoseDetector(), True, workers=os.cpu_count())
+    poses = job.landmarks()  # (nFrames, 33, 4)
+    ```
+
+    Args:
+        source (str): The video to process.
+        outputFilename (str): The stitched video.
+        segmentSeconds (float, optional): Length of a segment. Defaults to 60.
+        workDirectory (str, optional): Where the segments and the manifest are kept. Defaults to None and thus a
+            directory of `DEFAULT_WORK_DIRECTORY` named after `outputFilename`.
+        cleanup (bool, optional): Whether to delete the segment videos once stitched. The landmarks and the manifest
+            are kept for `landmarks`. Defaults to True.
+        **writerOptions: `codec`, `preset` and `threads` passed on to `VideoWriter`.
+    """
+
+    def __init__(
+        self, source: str, outputFilename: str, segmentSeconds=60, workDirectory=None, cleanup=True, **writerOptions
+    ):
+        self.source = source
+        self.outputFilename = outputFilename
+        self.cleanup = cleanup
+        self.writerOptions = writerOptions
+        if workDirectory is None:
+            name = hashlib.sha256(os.path.abspath(outputFilename).encode()).hexdigest()[:24]
+            workDirectory = os.path.join(DEFAULT_WORK_DIRECTORY, name)
+        self.workDirectory = workDirectory
+        self.manifestFilename = os.path.join(workDirectory, "manifest.json")
+
+        reader = VideoReader(source)
+        self.fps = reader.fps
+        self.frameShape = (reader.frameWidth, reader.frameHeight)
+        reader.release()
+        self.segmentFrames = max(1, round(segmentSeconds * self.fps))
+
+    def _segmentFilename(self, ind: int, extension: str) -> str:
+        return os.path.join(self.workDirectory, f"segment-{ind:05d}.{extension}")
+
+    def _readManifest(self):
+        if not os.path.exists(self.manifestFilename):
+            return None
+        try:
+            with open(self.manifestFilename) as file:
+                return json.load(file)
+        except json.JSONDecodeError:
+            return None
+
+    def _writeManifest(self, manifest: dict):
+        # write to a temporary file first so that a crash never leaves a truncated manifest behind
+        temporaryFilename = f"{self.manifestFilename}.tmp"
+        with open(temporaryFilename, "w") as file:
+            json.dump(manifest, file, indent=2)
+        os.replace(temporaryFilename, self.manifestFilename)
+
+    def _describe(self, detector, subsampler, workers, tracking: bool, findOptions: dict) -> dict:
+        """Returns what the landmarks of a job depend on, which must match for them to be reused"""
+        stat = os.stat(self.source)
+        return {
+            "version": MANIFEST_VERSION,
+            "source": {"path": os.path.abspath(self.source), "size": stat.st_size, "mtime": stat.st_mtime},
+            "output": os.path.abspath(self.outputFilename),
+            "segmentFrames": self.segmentFrames,
+            "detector": type(detector).__name__,
+            "params": detector.getParams(),
+            "subsampling": subsampler.getParams() if subsampler is not None else None,
+            # static images and tracked frames give different landmarks, as do chunks tracked on several workers
+            "tracking": tracking,
+            "parallel": (workers or 1) > 1,
+            # round-tripped through JSON so that it compares equal to the stored copy
+            "findOptions": json.loads(json.dumps(findOptions, sort_keys=True, default=str)),
+        }
+
+    def _isDone(self, ind: int) -> bool:
+        return os.path.exists(self._segmentFilename(ind, "npy")) and os.path.exists(self._segmentFilename(ind, "mp4"))
+
+    def run(
+        self,
+        detector,
+        draw=True,
+        annotate=None,
+        subsampler=None,
+        workers=None,
+        annotateKey=None,
+        tracking=True,
+        **findOptions,
+    ) -> str:
+        """Processes the segments that are not done yet, then stitches them together.
+
+        Args:
+            detector: The detector run over the frames, see `Detector.findInFrames`.
+            draw (bool, optional): Whether to annotate the frames with the landmarks. Defaults to True.
+            annotate (optional): Called as `annotate(results, state)` with the `(frame, landmarks)` tuples of each
+                segment, and returning the frames to write, for drawing that depends on earlier frames. `state` is a
+                dict carried from one segment to the next, which is saved with every segment and so must only hold
+                JSON values. Defaults to None and thus the frames are written as they come.
+            subsampler (Subsampler, optional): See `Detector.findInFrames`. Defaults to None.
+            workers (int, optional): See `Detector.findInFrames`. Defaults to None.
+            annotateKey (optional): A JSON value identifying what `annotate` draws, such as its thresholds, to be
+                changed along with them so that the segments are drawn again. Defaults to None and thus the name of
+                `annotate`.
+            tracking (bool, optional): See `Detector.findInFrames`. Defaults to True.
+            **findOptions: Passed on to `find`, e.g. `asArray=True` for the landmarks handed to `annotate`.
+
+        Returns:
+            str: The output filename
+        """
+        description = self._describe(detector, subsampler, workers, tracking, findOptions)
+        if annotateKey is None and annotate is not None:
+            annotateKey = getattr(annotate, "__qualname__", repr(annotate))
+        # round-tripped through JSON so that it compares equal to the stored copy
+        annotation = json.loads(json.dumps({"draw": draw, "annotate": annotateKey}, sort_keys=True, default=str))
+        manifest = self._readManifest()
+        if manifest is None or manifest["job"] != description:
+            # segments of another job, or of an older version of the source, must not be mixed in
+            shutil.rmtree(self.workDirectory, ignore_errors=True)
+            os.makedirs(self.workDirectory)
+            manifest = {"job": description, "annotation": annotation, "segments": [], "complete": False}
+            manifest["stitched"] = False
+            self._writeManifest(manifest)
+        elif manifest["annotation"] != annotation:
+            # the landmarks still hold, only the segment videos are drawn again from them
+            for ind in range(len(manifest["segments"])):
+                if os.path.exists(self._segmentFilename(ind, "mp4")):
+                    os.remove(self._segmentFilename(ind, "mp4"))
+            manifest.update(annotation=annotation, segments=[], complete=False, stitched=False)
+            self._writeManifest(manifest)
+        if manifest["stitched"] and os.path.exists(self.outputFilename):
+            return self.outputFilename
+
+        segments = manifest["segments"]
+        # a segment whose files went missing, e.g. deleted after stitching, is processed again along with every
+        # segment after it
+        done = next((ind for ind in range(len(segments)) if not self._isDone(ind)), len(segments))
+        if done < len(segments):
+            del segments[done:]
+            manifest["complete"] = False
+
+        asArray = findOptions.pop("asArray", False)
+        normalised = findOptions.pop("normalised", False)
+        while not manifest["complete"]:
+            ind = len(segments)
+            state = dict(segments[-1]["state"]) if segments else {}
+            frameCount = self._processSegment(
+                ind, detector, draw, annotate, state, subsampler, workers, tracking, asArray, normalised, findOptions
+            )
+            if frameCount:
+                segments.append({"frames": frameCount, "state": state})
+            # the container's frame count is not trusted, the video ends with the first short segment
+            manifest["complete"] = frameCount < self.segmentFrames
+            self._writeManifest(manifest)
+
+        self._stitch(len(segments))
+        manifest["stitched"] = True
+        self._writeManifest(manifest)
+        if self.cleanup:
+            for ind in range(len(segments)):
+                os.remove(self._segmentFilename(ind, "mp4"))
+        return self.outputFilename
+
+    def _processSegment(
+        self,
+        ind: int,
+        detector,
+        draw,
+        annotate,
+        state: dict,
+        subsampler,
+        workers,
+        tracking,
+        asArray,
+        normalised,
+        findOptions,
+    ) -> int:
+        """Processes and saves segment `ind`, returning its number of frames"""
+        startFrame = ind * self.segmentFrames
+        landmarksFilename = self._segmentFilename(ind, "npy")
+        stored = np.load(landmarksFilename) if os.path.exists(landmarksFilename) else None
+        frameLimit = self.segmentFrames if stored is None else len(stored)
+        reader = VideoReader(self.source, prefetch=8, startFrame=startFrame, frameLimit=frameLimit)
+        if stored is not None:
+            results = self._storedResults(detector, reader, stored, draw)
+        else:
+            detector.reset()
+            results = detector.findInFrames(
+                reader,
+                draw,
+                workers,
+                tracking=tracking,
+                subsampler=subsampler,
+                asArray=True,
+                normalised=True,
+                **findOptions,
+            )
+
+        arrays = []
+
+        def formatResults():
+            for frame, points in results:
+                arrays.append(points)
+                yield (frame, detector.formatResult(frame, points.astype(np.float64), asArray, normalised))
+
+        frames = (frame for frame, _ in formatResults()) if annotate is None else annotate(formatResults(), state)
+        # the extension tells ffmpeg the container to write
+        temporaryFilename = self._segmentFilename(ind, "tmp.mp4")
+        writer = VideoWriter(temporaryFilename, self.frameShape, self.fps, **self.writerOptions)
+        try:
+            for frame in frames:
+                writer.write(frame)
+        except BaseException:
+            # the error raised is the one that interrupted the segment, not one of the encoder it left behind
+            try:
+                writer.close()
+            except Exception:
+                pass
+            # a partial segment is never resumed, as it is processed again from its first frame
+            if os.path.exists(temporaryFilename):
+                os.remove(temporaryFilename)
+            raise
+        finally:
+            reader.release()
+        writer.close()
+
+        if not arrays:
+            os.remove(temporaryFilename)
+            return 0
+        if stored is None:
+            # written under another name first, so that a landmark file is always complete
+            temporaryLandmarksFilename = self._segmentFilename(ind, "tmp.npy")
+            np.save(temporaryLandmarksFilename, stackFrames(arrays))
+            os.replace(temporaryLandmarksFilename, landmarksFilename)
+        # the video is moved into place last, so that a segment with both files was written completely
+        os.replace(temporaryFilename, self._segmentFilename(ind, "mp4"))
+        return len(arrays)
+
+    @staticmethod
+    def _storedResults(detector, frames, stored: np.ndarray, draw: bool):
+        """Yields the `(frame, landmarks)` tuples of a segment whose landmarks were saved by an earlier run"""
+        for frame, points in zip(frames, stored):
+            if detector.multipleResults:
+                # drop the NaN padding of frames with fewer hands or faces
+                points = points[~np.isnan(points).all(axis=tuple(range(1, points.ndim)))]
+            points = np.array(points, dtype=np.float64)
+            if draw:
+                detector.drawArray(frame, points)
+            yield (frame, points)
+
+    def _stitch(self, segmentCount: int):
+        """Joins the segment videos into the output without re-encoding them, adding the audio of the source"""
+        import ffmpeg
+
+        listFilename = os.path.join(self.workDirectory, "segments.txt")
+        with open(listFilename, "w") as file:
+            for ind in range(segmentCount):
+                # paths in the list are relative to the list itself
+                file.write(f"file '{os.path.basename(self._segmentFilename(ind, 'mp4'))}'\n")
+
+        os.makedirs(os.path.dirname(self.outputFilename) or ".", exist_ok=True)
+        video = ffmpeg.input(listFilename, format="concat", safe=0)
+        # "a?" keeps sources without an audio track from failing
+        audio = ffmpeg.input(self.source)["a?"]
+        try:
+            (
+                ffmpeg.output(video["v"], audio, self.outputFilename, vcodec="copy", acodec="copy")
+                .overwrite_output()
+                .global_args("-loglevel", "error")
+                .run(capture_stderr=True)
+            )
+        except ffmpeg.Error as error:
+            raise RuntimeError(
+                f"ffmpeg failed to stitch {self.outputFilename}: {error.stderr.decode(errors='replace').strip()}"
+            ) from None
+
+    def landmarks(self) -> np.ndarray:
+        """Returns the normalised landmark arrays of every frame processed so far, stacked as by
+        `landmarks.stackFrames`, with the hands or faces of segments padded with NaN to the largest count
+        """
+        arrays = []
+        while os.path.exists(self._segmentFilename(len(arrays), "npy")):
+            arrays.append(np.load(self._segmentFilename(len(arrays), "npy")))
+        if not arrays:
+            return np.empty((0,), np.float32)
+        # only the number of hands or faces, on the second axis, can differ between segments
+        maxCount = max(array.shape[1] for array in arrays)
+        padding = lambda array: [(0, 0), (0, maxCount - array.shape[1])] + [(0, 0)] * (array.ndim - 2)
+        arrays = [np.pad(array, padding(array), constant_values=np.nan) for array in arrays]
+        return np.concatenate(arrays)
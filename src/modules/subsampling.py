@@ -0,0 +1,256 @@
+"""Temporal subsampling for offline video jobs.
+
+The detector only runs on keyframes, and the landmarks of the frames in between are interpolated from the keyframes
+around them. Keyframes are either every `step`-th frame or picked by how much the picture changed. Wherever the
+landmarks move too much between two keyframes for interpolation to be trusted, the frame halfway between them is
+detected as well, recursively.
+"""
+
+from bisect import bisect_right
+from contextlib import ExitStack
+import cv2
+import numpy as np
+from src.modules.detectorPool import getPool
+from src.modules.utils import VideoReader
+
+
+def motionScore(prevSmall: np.ndarray, small: np.ndarray) -> float:
+    """Mean absolute difference between two downscaled greyscale frames, within [0, 1]"""
+    return float(cv2.absdiff(prevSmall, small).mean()) / 255
+
+
+def isEmpty(points: np.ndarray) -> bool:
+    """Whether a landmark array holds no hand, face or pose"""
+    return points.shape[0] == 0 or bool(np.isnan(points).all())
+
+
+def matchOrder(reference: np.ndarray, points: np.ndarray) -> np.ndarray:
+    """Reorders the hands or faces of `points` so that each one lines up with the closest one in `reference`"""
+    if len(points) < 2 or reference.shape != points.shape:
+        return points
+    # landmarks are compared by their centre, bounding boxes by their corner
+    centres = np.nanmean(points[..., :2], axis=1) if points.ndim == 3 else points[:, :2]
+    referenceCentres = np.nanmean(reference[..., :2], axis=1) if reference.ndim == 3 else reference[:, :2]
+    costs = np.linalg.norm(referenceCentres[:, np.newaxis] - centres[np.newaxis], axis=-1)
+
+    order = [-1] * len(points)
+    # greedily pair the closest remaining couple first
+    for flat in np.argsort(costs, axis=None):
+        referenceInd, ind = np.unravel_index(flat, costs.shape)
+        if order[referenceInd] == -1 and ind not in order:
+            order[referenceInd] = ind
+    return points[order]
+
+
+class Subsampler:
+    """Runs a detector on keyframes only and interpolates the landmarks of every other frame.
+
+    Usage:
+    ```python
+    subsampler = Subsampler(step=4)
+    with VideoReader("assets/ben0.mp4") as reader:
+        results = PoseDetector().findPoseInFrames(reader, False, subsampler=subsampler)
+    print(subsampler.getStats())
+    ```
+
+    Args:
+        step (int, optional): Frames between two keyframes, the most allowed when `keyframes="motion"`. Defaults to 4.
+        keyframes (str, optional): "uniform" for every `step`-th frame, or "motion" to place a keyframe as soon as
+            the picture changed by `motionThreshold` since the last one. Defaults to "uniform".
+        method (str, optional): "linear", or "spline" for a cubic Catmull-Rom spline through the keyframes.
+            Defaults to "linear".
+        maxDisplacement (float, optional): The mean distance a landmark may travel between two keyframes, relative to
+            the frame size, before the frame halfway between them is detected too. Defaults to 0.02.
+        motionThreshold (float, optional): See `keyframes`. Defaults to 0.02.
+        visibilityThreshold (float, optional): Pose landmarks less visible than this on either keyframe are held
+            at the nearest keyframe rather than interpolated. Defaults to 0.5.
+    """
+
+    def __init__(
+        self,
+        step=4,
+        keyframes="uniform",
+        method="linear",
+        maxDisplacement=0.02,
+        motionThreshold=0.02,
+        visibilityThreshold=0.5,
+    ):
+        if keyframes not in ("uniform", "motion"):
+            raise ValueError(f"Unknown keyframe selection {keyframes}")
+        if method not in ("linear", "spline"):
+            raise ValueError(f"Unknown interpolation method {method}")
+        self.step = max(1, step)
+        self.keyframes = keyframes
+        self.method = method
+        self.maxDisplacement = maxDisplacement
+        self.motionThreshold = motionThreshold
+        self.visibilityThreshold = visibilityThreshold
+        self.framesProcessed = 0
+        self.detectorCalls = 0
+        self.numCoordinates = 3
+        self.withVisibility = False
+        self.multipleResults = True
+
+    def getParams(self) -> dict:
+        return {
+            "step": self.step,
+            "keyframes": self.keyframes,
+            "method": self.method,
+            "maxDisplacement": self.maxDisplacement,
+            "motionThreshold": self.motionThreshold,
+            "visibilityThreshold": self.visibilityThreshold,
+        }
+
+    def getStats(self) -> dict:
+        return {
+            "frames": self.framesProcessed,
+            "detectorCalls": self.detectorCalls,
+            "detectedRatio": self.detectorCalls / self.framesProcessed if self.framesProcessed else None,
+        }
+
+    def findInFrames(self, detector, frames, draw=True, asArray=False, normalised=False, **findOptions):
+        """Same as `detector.findInFrames`, with the landmarks of the frames between keyframes interpolated"""
+        res = self._generate(detector, frames, draw, asArray, normalised, findOptions)
+        return res if isinstance(frames, VideoReader) else list(res)
+
+    def _detect(self, detector, frame, findOptions: dict) -> np.ndarray:
+        self.detectorCalls += 1
+        _, points = detector.find(frame, False, asArray=True, normalised=True, **findOptions)
+        return points.astype(np.float64)
+
+    def _matchOrder(self, reference: np.ndarray, points: np.ndarray) -> np.ndarray:
+        # the landmarks of a single pose are always in order, and pairing them by distance would swap close joints
+        return matchOrder(reference, points) if self.multipleResults else points
+
+    def _needsRefinement(self, pointsA: np.ndarray, pointsB: np.ndarray) -> bool:
+        if isEmpty(pointsA) and isEmpty(pointsB):
+            return False
+        # a hand or face appeared or left in between
+        if isEmpty(pointsA) or isEmpty(pointsB) or pointsA.shape != pointsB.shape:
+            return True
+        pointsB = self._matchOrder(pointsA, pointsB)
+        displacement = np.linalg.norm(pointsB[..., :2] - pointsA[..., :2], axis=-1)
+        return bool(np.nanmean(displacement) > self.maxDisplacement)
+
+    def _refine(self, refiner, pending: dict, keyA: tuple, keyB: tuple, findOptions: dict) -> list:
+        """Returns the keyframes after `keyA` up to and including `keyB`, detecting the frames halfway in between
+        wherever the landmarks move too much, with the detector returned by `refiner()`
+        """
+        (indA, pointsA), (indB, pointsB) = keyA, keyB
+        if indB - indA <= 1 or not self._needsRefinement(pointsA, pointsB):
+            return [keyB]
+        indMid = (indA + indB) // 2
+        keyMid = (indMid, self._detect(refiner(), pending[indMid], findOptions))
+        return self._refine(refiner, pending, keyA, keyMid, findOptions) + self._refine(
+            refiner, pending, keyMid, keyB, findOptions
+        )
+
+    def _interpolate(self, keys: list, pos: int, ind: int) -> np.ndarray:
+        """Interpolates the landmarks of frame `ind`, which lies between `keys[pos - 1]` and `keys[pos]`"""
+        (indA, pointsA), (indB, pointsB) = keys[pos - 1], keys[pos]
+        t = (ind - indA) / (indB - indA)
+        nearest = pointsA if t < 0.5 else pointsB
+        if isEmpty(pointsA) or isEmpty(pointsB) or pointsA.shape != pointsB.shape:
+            return nearest.copy()
+        pointsB = self._matchOrder(pointsA, pointsB)
+
+        coordinates = slice(0, self.numCoordinates)
+        interpolated = pointsA + (pointsB - pointsA) * t
+        if self.method == "spline":
+            # tangents of a Catmull-Rom spline over unevenly spaced keyframes, falling back to the chord at the ends
+            tangentA = tangentB = pointsB - pointsA
+            if pos >= 2 and keys[pos - 2][1].shape == pointsA.shape and not isEmpty(keys[pos - 2][1]):
+                indPrev, pointsPrev = keys[pos - 2]
+                tangentA = (pointsB - self._matchOrder(pointsA, pointsPrev)) * (indB - indA) / (indB - indPrev)
+            if pos + 1 < len(keys) and keys[pos + 1][1].shape == pointsA.shape and not isEmpty(keys[pos + 1][1]):
+                indNext, pointsNext = keys[pos + 1]
+                tangentB = (self._matchOrder(pointsA, pointsNext) - pointsA) * (indB - indA) / (indNext - indA)
+            h00, h10, h01, h11 = 2 * t**3 - 3 * t**2 + 1, t**3 - 2 * t**2 + t, -2 * t**3 + 3 * t**2, t**3 - t**2
+            interpolated[..., coordinates] = (h00 * pointsA + h10 * tangentA + h01 * pointsB + h11 * tangentB)[
+                ..., coordinates
+            ]
+
+        if self.withVisibility:
+            # landmarks hidden on either side would drift through made up positions, so they stay put instead
+            hidden = np.minimum(pointsA[..., 3], pointsB[..., 3]) < self.visibilityThreshold
+            interpolated[hidden] = nearest[hidden]
+        return interpolated
+
+    def _emit(self, detector, pending: dict, keys: list, final: bool, draw, asArray, normalised):
+        # a spline segment also needs the keyframe after it, so the last segment waits for the next keyframe
+        lastInd = keys[-1][0] if final or self.method == "linear" or len(keys) < 2 else keys[-2][0]
+        keyIndices = [ind for ind, _ in keys]
+        for ind in [ind for ind in pending if ind <= lastInd]:
+            frame = pending.pop(ind)
+            pos = bisect_right(keyIndices, ind)
+            points = keys[pos - 1][1] if keyIndices[pos - 1] == ind else self._interpolate(keys, pos, ind)
+            if draw:
+                detector.drawArray(frame, points)
+            yield (frame, detector.formatResult(frame, points, asArray, normalised))
+
+        # keep the keyframes the next segments still need
+        firstPending = min(pending, default=lastInd)
+        while len(keys) > 3 and keys[2][0] <= firstPending:
+            keys.pop(0)
+
+    def _generate(self, detector, frames, draw, asArray, normalised, findOptions: dict):
+        with ExitStack() as stack:
+            refiners = []
+
+            def refiner():
+                # frames between keyframes are detected after the later keyframe, out of time order, so they go
+                # through a static detector whose result the tracking state of `detector` cannot bias
+                if detector.isStatic():
+                    return detector
+                if not refiners:
+                    staticParams = detector.getStaticParams()
+                    refiners.append(stack.enter_context(getPool().checkout(type(detector), **staticParams)))
+                return refiners[0]
+
+            yield from self._generateKeyframes(detector, refiner, frames, draw, asArray, normalised, findOptions)
+
+    def _generateKeyframes(self, detector, refiner, frames, draw, asArray, normalised, findOptions: dict):
+        pending = {}
+        keys = []
+        prevSmall = None
+        motion = 0.0
+        ind = -1
+
+        for ind, frame in enumerate(frames):
+            self.framesProcessed += 1
+            pending[ind] = frame
+            if self.keyframes == "motion":
+                small = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), (64, 64), interpolation=cv2.INTER_AREA)
+                motion += motionScore(prevSmall, small) if prevSmall is not None else 0.0
+                prevSmall = small
+
+            if not keys:
+                points = self._detect(detector, frame, findOptions)
+                keys.append((ind, points))
+                # the columns after the coordinates hold the visibility of pose landmarks, or the score of face boxes
+                boxes = detector.multipleResults and points.ndim == 2
+                self.withVisibility = not detector.multipleResults and points.shape[-1] > 3
+                self.multipleResults = detector.multipleResults
+                self.numCoordinates = 4 if boxes else min(3, points.shape[-1])
+                continue
+
+            gap = ind - keys[-1][0]
+            if gap < self.step and not (self.keyframes == "motion" and motion >= self.motionThreshold):
+                continue
+            motion = 0.0
+            keys.extend(
+                self._refine(
+                    refiner, pending, keys[-1], (ind, self._detect(detector, frame, findOptions)), findOptions
+                )
+            )
+            yield from self._emit(detector, pending, keys, False, draw, asArray, normalised)
+
+        # the last frame always becomes a keyframe, so that nothing is extrapolated
+        if keys and keys[-1][0] != ind:
+            keys.extend(
+                self._refine(
+                    refiner, pending, keys[-1], (ind, self._detect(detector, pending[ind], findOptions)), findOptions
+                )
+            )
+        if keys:
+            yield from self._emit(detector, pending, keys, True, draw, asArray, normalised)
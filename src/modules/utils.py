@@ -1,8 +1,10 @@
 import cv2
-import ffmpeg
+import hashlib
 import os
-import tempfile
-from shutil import copyfile
+import threading
+import numpy as np
+from queue import Queue
+from src.modules import metrics
 
 
 def checkFileType(filename: str) -> str:
@@ -51,91 +53,408 @@ def checkFileType(filename: str) -> str:
     return "other"
 
 
-def readVideo(path: str, getSize=False, withAudio=False):
+def hashFile(path: str, blockSize=1 << 20) -> str:
+    """Returns the SHA-256 hex digest of the content of the file at `path`"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(blockSize), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class VideoReader:
+    """Streams the frames of a video lazily instead of decoding all of them up front.
+
+    The metadata (`frameWidth`, `frameHeight`, `fps` and `frameCount`, as reported by the container) is available as
+    soon as the reader is created.
+    When `prefetch > 0`, a background thread decodes up to `prefetch` frames ahead of the consumer.
+    `startFrame` and `frameLimit` restrict the reader to a range of frames, e.g. one segment of a long video.
+
+    Usage:
+    ```python
+    with VideoReader("assets/ben0.mp4", prefetch=8) as reader:
+        for frame in reader:
+            ...
+    ```
+    """
+
+    # the channel order of the frames, see `FfmpegReader`
+    pixelFormat = "bgr24"
+
+    def __init__(self, path: str, prefetch=0, startFrame=0, frameLimit=None):
+        self.path = path
+        self.prefetch = prefetch
+        self.startFrame = startFrame
+        self.frameLimit = frameLimit
+        self.cap = cv2.VideoCapture(path)
+
+        if not self.cap.isOpened():
+            raise IOError(f"Failed to open file {path}")
+
+        self.frameWidth = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.frameHeight = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self.frameCount = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if startFrame:
+            self._seek(startFrame)
+            self.frameCount = max(0, self.frameCount - startFrame)
+        if frameLimit is not None:
+            self.frameCount = min(self.frameCount, frameLimit)
+        self._consumed = False
+        # the prefetch thread and what it needs to be stopped, see `_stopPrefetch`
+        self._decoder = None
+        self._frameQueue = None
+        self._stopped = threading.Event()
+
+    def _seek(self, startFrame: int):
+        """Moves to frame `startFrame`, reading forward from the start of the video when seeking does not land on it
+        exactly, as happens with many codecs
+        """
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, startFrame)
+        if int(self.cap.get(cv2.CAP_PROP_POS_FRAMES)) == startFrame:
+            return
+        self.cap.release()
+        self.cap = cv2.VideoCapture(self.path)
+        for _ in range(startFrame):
+            # grabbing decodes without converting the frame
+            if not self.cap.grab():
+                break
+
+    def __len__(self):
+        return self.frameCount
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.release()
+
+    def __iter__(self):
+        if self._consumed:
+            raise RuntimeError("A VideoReader can only be iterated once")
+        self._consumed = True
+
+        if self.prefetch > 0:
+            return self._prefetchFrames()
+        return self._readFrames()
+
+    def _readFrames(self):
+        framesRead = 0
+        try:
+            while self.cap.isOpened() and framesRead != self.frameLimit:
+                with metrics.timer("decode", "VideoReader"):
+                    success, frame = self.cap.read()
+                if success is False:
+                    break
+                framesRead += 1
+                metrics.increment("frames_total", description="Frames processed", component="VideoReader")
+                yield frame
+        finally:
+            self.release()
+
+    def _prefetchFrames(self):
+        frameQueue = self._frameQueue = Queue(maxsize=self.prefetch)
+
+        def decode():
+            end = None
+            try:
+                for frame in self._readFrames():
+                    if self._stopped.is_set():
+                        break
+                    frameQueue.put(frame)
+            except BaseException as error:
+                # handed to the consumer, which raises it
+                end = error
+            finally:
+                # `None` marks the end of the video, and is always sent so that the consumer never waits forever
+                frameQueue.put(end)
+
+        self._decoder = threading.Thread(target=decode, daemon=True)
+        self._decoder.start()
+
+        try:
+            while True:
+                frame = frameQueue.get()
+                if frame is None:
+                    break
+                if isinstance(frame, BaseException):
+                    raise frame
+                yield frame
+        finally:
+            self._stopPrefetch()
+
+    def _stopPrefetch(self):
+        """Stops the prefetch thread and waits for it, so that the capture is never released while it is reading"""
+        decoder = self._decoder
+        # the decoder releases the capture itself once it is done reading
+        if decoder is None or decoder is threading.current_thread():
+            return
+        self._stopped.set()
+        while decoder.is_alive():
+            # unblock the decoder if the consumer stops early
+            while not self._frameQueue.empty():
+                self._frameQueue.get_nowait()
+            decoder.join(0.01)
+
+    def release(self):
+        self._stopPrefetch()
+        self.cap.release()
+
+
+class FfmpegReader(VideoReader):
+    """A `VideoReader` decoding through an ffmpeg process, which scales the frames and converts them to the pixel
+    format the detectors take before they reach Python, using several decoder threads.
+
+    MediaPipe downsizes frames and needs them in RGB, so decoding straight to a smaller RGB frame skips both the
+    full resolution `cvtColor` of every detector call and most of the bytes going through the pipe.
+    `find*InFrames` pass RGB frames to the graphs as they are, but anything drawn on them, and so on the frames
+    written out, has its red and blue swapped unless written with `VideoWriter(..., pixelFormat="rgb24")`.
+
+    Usage:
+    ```python
+    with FfmpegReader("assets/ben0.mp4", frameShape=(640, None)) as reader:
+        results = PoseDetector().findPoseInFrames(reader, False, asArray=True, normalised=True)
+    ```
+
+    Args:
+        path (str): The video file.
+        frameShape (tuple, optional): `(frameWidth, frameHeight)` to scale the frames to, where either can be None
+            to keep the aspect ratio. Defaults to None and thus the size of the video.
+        pixelFormat (str, optional): "rgb24" or "bgr24". Defaults to "rgb24".
+        threads (int, optional): Number of decoder threads. Defaults to 0 and thus chosen by ffmpeg.
+        prefetch (int, optional): See `VideoReader`. Defaults to 0.
+    """
+
+    def __init__(self, path: str, frameShape=None, pixelFormat="rgb24", threads=0, prefetch=0):
+        if pixelFormat not in ("rgb24", "bgr24"):
+            raise ValueError(f"Unsupported pixel format {pixelFormat}, expected rgb24 or bgr24")
+        # the metadata comes from the container, as for a `VideoReader`, which needs no ffprobe
+        super().__init__(path, prefetch)
+        self.cap.release()
+
+        self.pixelFormat = pixelFormat
+        self.threads = threads
+        self.sourceShape = (self.frameWidth, self.frameHeight)
+        self.frameWidth, self.frameHeight = scaledShape(self.sourceShape, frameShape)
+        self.process = None
+
+    def _readFrames(self):
+        import ffmpeg
+
+        video = ffmpeg.input(self.path, threads=self.threads)
+        if (self.frameWidth, self.frameHeight) != self.sourceShape:
+            # area averaging keeps downscaled frames as sharp as `cv2.INTER_AREA` would
+            video = video.filter("scale", self.frameWidth, self.frameHeight, flags="area")
+        self.process = (
+            video.output("pipe:", format="rawvideo", pix_fmt=self.pixelFormat)
+            .global_args("-loglevel", "error")
+            .run_async(pipe_stdout=True)
+        )
+
+        frameShape = (self.frameHeight, self.frameWidth, 3)
+        try:
+            while True:
+                # each frame gets its own buffer, filled straight from the pipe, so it stays writable and owned
+                frame = np.empty(frameShape, np.uint8)
+                with metrics.timer("decode", "FfmpegReader"):
+                    complete = _readInto(self.process.stdout, memoryview(frame).cast("B"))
+                if not complete:
+                    break
+                metrics.increment("frames_total", description="Frames processed", component="FfmpegReader")
+                yield frame
+        finally:
+            self.release()
+
+    def release(self):
+        self._stopPrefetch()
+        if self.process is None:
+            return
+        self.process.stdout.close()
+        if self.process.poll() is None:
+            # the consumer stopped early
+            self.process.kill()
+        self.process.wait()
+        self.process = None
+
+
+def _readInto(stream, buffer: memoryview) -> bool:
+    """Fills `buffer` from `stream`, returning False if the stream ended first"""
+    filled = 0
+    while filled < len(buffer):
+        read = stream.readinto(buffer[filled:])
+        if not read:
+            return False
+        filled += read
+    return True
+
+
+def scaledShape(sourceShape: tuple[int, int], frameShape=None) -> tuple[int, int]:
+    """Returns the `(frameWidth, frameHeight)` of `frameShape`, where a None side keeps the aspect ratio of
+    `sourceShape`, rounded to an even number of pixels as most codecs need
+    """
+    sourceWidth, sourceHeight = sourceShape
+    frameWidth, frameHeight = frameShape or (None, None)
+    if frameWidth is None and frameHeight is None:
+        return sourceShape
+    if frameWidth is None:
+        frameWidth = max(2, round(sourceWidth * frameHeight / sourceHeight / 2) * 2)
+    if frameHeight is None:
+        frameHeight = max(2, round(sourceHeight * frameWidth / sourceWidth / 2) * 2)
+    return (frameWidth, frameHeight)
+
+
+# `readVideo` backends, see `VideoReader` and `FfmpegReader`
+VIDEO_BACKENDS = {"opencv": VideoReader, "ffmpeg": FfmpegReader}
+
+
+def readVideo(path: str, getSize=False, withAudio=False, backend="opencv", **readerOptions):
     """
     Given a relative path to a video file, read the video and return a list of unprocessed frames.
+    Prefer `VideoReader` for long videos, as this function keeps every decoded frame in memory.
     to determine the output variable `video` based on the withAudio parameter, if it is true, then the `video` variable would contain a tuple with (a list of frames, a ffmpeg audio)
     and finally `if getSize == true` then its return value would be like `(video, (frameWidth, frameHeight, fps))` and `video` otherwise
+    `backend` is "opencv", decoding to BGR, or "ffmpeg", where `readerOptions` such as `frameShape` and `pixelFormat`
+    are passed on to `FfmpegReader`, which decodes to RGB by default.
     """
-    # define capture source
-    cap = cv2.VideoCapture(path)
-
-    if not cap.isOpened():
-        print(f"Failed to open file {path}")
+    try:
+        reader = VIDEO_BACKENDS[backend](path, **readerOptions)
+    except IOError as error:
+        print(error)
         return []
-    frames = []
-    frameWidth = int(cap.get(3))
-    frameHeight = int(cap.get(4))
-    audio = ffmpeg.input(path)
-    fps = cap.get(cv2.CAP_PROP_FPS)
-
-    while cap.isOpened():
-        # read frame
-        success, frame = cap.read()
-
-        # if success then add frame to the frames array
-        if success is True:
-            frames.append(frame)
-        else:
-            # reached the end
-            break
-    cap.release()
-
-    video = (frames, audio) if withAudio else frames
+
+    frameWidth, frameHeight, fps = reader.frameWidth, reader.frameHeight, reader.fps
+    frames = list(reader)
+
+    if withAudio:
+        # ffmpeg-python is only imported by the functions that use it
+        import ffmpeg
+
+        video = (frames, ffmpeg.input(path))
+    else:
+        video = frames
 
     return (video, (frameWidth, frameHeight, fps)) if getSize else video
 
 
+class VideoWriter:
+    """Encodes frames one by one by piping them straight into a single ffmpeg process.
+
+    The audio track of `audio` (a path or an ffmpeg input such as the one returned by `readVideo`) is stream-copied
+    into the output without being re-encoded.
+    `pixelFormat` is the channel order of the frames written, "rgb24" for frames read by an `FfmpegReader`.
+    Frames of an odd width or height are padded by a pixel, as yuv420p only holds even sizes.
+
+    Usage:
+    ```python
+    with VideoWriter("out/hands/ben0.mp4", (frameWidth, frameHeight), fps, audio="assets/ben0.mp4") as writer:
+        for frame in frames:
+            writer.write(frame)
+    ```
+    """
+
+    def __init__(
+        self,
+        outputFilename: str,
+        frameShape: tuple[int, int],
+        fps: float,
+        audio=None,
+        codec="libx264",
+        preset="veryfast",
+        threads=0,
+        pixelFormat="bgr24",
+    ):
+        self.outputFilename = outputFilename
+        self.frameWidth, self.frameHeight = frameShape
+        self.framesWritten = 0
+
+        import ffmpeg
+
+        video = ffmpeg.input(
+            "pipe:", format="rawvideo", pix_fmt=pixelFormat, s=f"{self.frameWidth}x{self.frameHeight}", framerate=fps
+        )
+        if self.frameWidth % 2 or self.frameHeight % 2:
+            video = video.filter("pad", "ceil(iw/2)*2", "ceil(ih/2)*2")
+        streams = [video]
+        outputOptions = {"vcodec": codec, "pix_fmt": "yuv420p", "threads": threads}
+        if preset:
+            outputOptions["preset"] = preset
+
+        if audio is not None:
+            if isinstance(audio, str):
+                audio = ffmpeg.input(audio)
+            # "a?" keeps sources without an audio track from failing
+            streams.append(audio["a?"])
+            outputOptions["acodec"] = "copy"
+
+        self.process = (
+            ffmpeg.output(*streams, outputFilename, **outputOptions)
+            .overwrite_output()
+            .global_args("-loglevel", "error")
+            .run_async(pipe_stdin=True)
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def write(self, frame):
+        frameHeight, frameWidth = frame.shape[:2]
+        if (frameWidth, frameHeight) != (self.frameWidth, self.frameHeight):
+            raise ValueError(
+                f"Frame of size {frameWidth}x{frameHeight} does not match the output size "
+                f"{self.frameWidth}x{self.frameHeight}"
+            )
+        # blocks while ffmpeg is busy encoding, so this also measures the encoder falling behind
+        with metrics.timer("encode", "VideoWriter"):
+            self.process.stdin.write(frame.tobytes())
+        self.framesWritten += 1
+        metrics.increment("frames_total", description="Frames processed", component="VideoWriter")
+
+    def close(self):
+        if self.process.stdin.closed:
+            return
+        self.process.stdin.close()
+        if self.process.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed to encode {self.outputFilename}")
+
+
 def outputWrite(
-    frames: list,
+    frames,
     filename: str,
     fileType: str,
     outputDirectoryName: str,
     fps: int,
     frameShape: tuple[int, int],
     audio=None,
+    **writerOptions,
 ):
     """Handles outputing video/image
 
     Args:
-        frames (list): A list of frames which the output video is going to contain.
+        frames: The frames which the output video is going to contain, either a list or any iterable of frames.
         filename (str): File name
         fileType (str): File type
         outputDirectoryName (str): Will be plugged in to f"out/{outputDirectoryName}/..."
         fps (int): FPS
         frameShape (tuple[int, int]): (frameWidth, frameHeight)
-        audio (???, optional): The ffmpeg audio. Defaults to None and thus the video would be "muted" by default.
+        audio (optional): A path or an ffmpeg input whose audio track is copied into the output.
+            Defaults to None and thus the video would be "muted" by default.
+        **writerOptions: `codec`, `preset` and `threads` passed on to `VideoWriter`.
 
     Returns:
         str: The output filename
     """
 
+    outputFilename = f"out/{outputDirectoryName}/{filename.split(os.sep)[-1]}"
+    os.makedirs(os.path.dirname(outputFilename), exist_ok=True)
+
     if fileType == "video":
-        outputFilename = f"out/{outputDirectoryName}/{filename.split(os.sep)[-1]}"
-        if not audio:
-            outputVideo = cv2.VideoWriter(outputFilename, cv2.VideoWriter_fourcc(*"MP4V"), fps, frameShape)
-            outputVideo.release()
-        else:
-            bufferOutputFilename = f"{tempfile.gettempdir()}/buffer-{filename.split(os.sep)[-1]}"
-            outputVideo = cv2.VideoWriter(bufferOutputFilename, cv2.VideoWriter_fourcc(*"mp4v"), fps, frameShape)
+        with VideoWriter(outputFilename, frameShape, fps, audio, **writerOptions) as writer:
             for frame in frames:
-                outputVideo.write(frame)
-                cv2.waitKey(1)
-            outputVideo.release()
-
-            processedFfmpegVideo = ffmpeg.input(bufferOutputFilename)
-
-            try:
-                ffmpeg.concat(processedFfmpegVideo, audio, v=1, a=1).output(filename, loglevel="quiet").run()
-                os.remove(bufferOutputFilename)
-            # pylint: disable=bare-except
-            except:
-                outputFilename = f"out/{outputDirectoryName}/{filename.split(os.sep)[-1]}"
-                copyfile(bufferOutputFilename, outputFilename)
-
+                writer.write(frame)
     else:
-        outputFilename = f"out/{outputDirectoryName}/{filename.split(os.sep)[-1]}"
-        cv2.imwrite(outputFilename, frames[0])
-    outputFilename = outputFilename.replace("buffer-", "")
+        cv2.imwrite(outputFilename, next(iter(frames)))
 
     return outputFilename
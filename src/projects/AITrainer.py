@@ -1,7 +1,11 @@
 import os
 import cv2
 import numpy as np
-from src.modules.utils import outputWrite, readVideo, checkFileType
+from src.modules.frameStore import FrameStore
+from src.modules.landmarkCache import LandmarkCache
+from src.modules.segmentedJob import SegmentedJob
+from src.modules.subsampling import Subsampler
+from src.modules.utils import outputWrite, checkFileType
 from termcolor import colored
 from src.modules.poseEstimation import PoseDetector
 
@@ -9,37 +13,18 @@ CURL_DOWNWARDS_LIMIT = 210
 CURL_UPWARDS_LIMIT = 310
 
 
-def main():
-    filename = "./assets/weightLifting0.mp4"
-    filename = os.path.normpath(filename)
-    write = True
-    curlsCount = 0
-    direction = 0  # 0 == up and 1 == down
-
-    fileType = checkFileType(filename)
-
-    if fileType == "other":
-        print(colored("Unsupported file format", "red"))
-        return
-
-    frameWidth = None
-    frameHeight = None
+def countCurls(allPosesInFrames, detector: PoseDetector, state=None):
+    """Yields the frames of `(frame, poses)` tuples annotated with the progress of the current curl and the count.
+    `state` holds the count and the progress left by the previous frames, and is kept up to date, so that counting
+    can continue over the next segment of a `SegmentedJob`.
+    """
+    state = {} if state is None else state
+    curlsCount = state.get("curlsCount", 0)
+    direction = state.get("direction", 0)  # 0 == up and 1 == down
+    # shown until the first pose is found
+    percentage, bar = state.get("percentage", 0), state.get("bar", 950)
+    color = tuple(state.get("color", (255, 100, 100)))
 
-    frames = []
-    fps = None
-    audio = None
-
-    if fileType == "image":
-        img = cv2.imread(filename)
-        frames.append(img)
-    else:
-        ((frames, audio), (frameWidth, frameHeight, fps)) = readVideo(filename, True, True)
-
-    print(colored(f"Finish reading {fileType}", "green"))
-
-    detector = PoseDetector()
-    allPosesInFrames = detector.findPoseInFrames(frames, False)
-    frames = []
     for frame, poses in allPosesInFrames:
         for pose in poses:
             # # right arm
@@ -79,7 +64,62 @@ def main():
         # Display curls count
         cv2.putText(frame, f"Count: {int(curlsCount)}", (50, 100), cv2.FONT_HERSHEY_PLAIN, 5, (255, 100, 100), 5)
 
-        frames.append(frame)
+        state.update(
+            curlsCount=curlsCount, direction=direction, percentage=float(percentage), bar=float(bar), color=color
+        )
+        yield frame
+
+
+def main():
+    filename = "./assets/weightLifting0.mp4"
+    filename = os.path.normpath(filename)
+    write = True
+    # e.g. 300 to process long videos in checkpointed segments of 5 minutes, which a restarted run resumes from
+    segmentSeconds = None
+
+    fileType = checkFileType(filename)
+
+    if fileType == "other":
+        print(colored("Unsupported file format", "red"))
+        return
+
+    frameWidth = None
+    frameHeight = None
+
+    frames = []
+    fps = None
+    audio = None
+
+    if fileType == "image":
+        img = cv2.imread(filename)
+        frames.append(img)
+    elif segmentSeconds and write:
+        # each segment is decoded on its own, rather than the whole video being stored up front
+        job = SegmentedJob(filename, f"out/AITrainer/{os.path.basename(filename)}", segmentSeconds)
+        detector = PoseDetector()
+        outputFilename = job.run(
+            detector,
+            False,
+            annotate=lambda results, state: countCurls(results, detector, state),
+            subsampler=Subsampler(step=4, keyframes="motion"),
+            # the segments are drawn again, from their stored poses, when the limits change
+            annotateKey={"downwardsLimit": CURL_DOWNWARDS_LIMIT, "upwardsLimit": CURL_UPWARDS_LIMIT},
+        )
+        print(colored(f"Output written to {outputFilename}", "green"))
+        return
+    else:
+        # decoded once, re-runs map the decoded frames instead
+        frames = FrameStore.open(filename)
+        frameWidth, frameHeight, fps = frames.frameWidth, frames.frameHeight, frames.fps
+        audio = filename
+
+    detector = PoseDetector()
+    # re-runs over the same video only pay for inference once, e.g. while tuning the curl limits
+    # arms curl slowly compared to the frame rate, so only every few frames go through the detector
+    allPosesInFrames = detector.findPoseInFrames(
+        frames, False, cache=LandmarkCache(), subsampler=Subsampler(step=4, keyframes="motion")
+    )
+    frames = list(countCurls(allPosesInFrames, detector))
 
     print(colored("Finish processing pose detection", "green"))
 
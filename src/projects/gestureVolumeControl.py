@@ -1,7 +1,8 @@
 import platform
 import cv2
+from src.modules import geometry
 from src.modules import handTracking as ht
-import math
+from src.modules.livePipeline import LivePipeline
 import numpy as np
 
 system = platform.system()
@@ -17,9 +18,6 @@ CAMERA_WIDTH, CAMERA_HEIGHT = 640, 480
 
 
 def main():
-    cap = cv2.VideoCapture(0)
-    cap.set(3, CAMERA_WIDTH)
-    cap.set(4, CAMERA_HEIGHT)
     volumeBar = 400
     volumePercentage = 0
 
@@ -34,29 +32,22 @@ def main():
         minVolume = volumeRange[0]
         maxVolume = volumeRange[1]
 
-    while True:
-        success, img = cap.read()
-
-        # do stuff here
+    def process(img):
+        nonlocal volumeBar, volumePercentage
 
         (img, hands) = detector.findHands(img)
         if hands and len(hands) > 0:
             hands = [hands[0]]
             hand = hands[0]
 
-            img = detector.highlightLandmark(
-                img,
-                hands,
-                4,
-            )
-            img = detector.highlightLandmark(img, hands, 8)
+            img = detector.highlightLandmark(img, hands, [4, 8])
             img = detector.connectLandmarks(img, hands, 4, 8, 3)
             _, x1, y1 = hand[4]
             _, x2, y2 = hand[8]
             midX, midY = (x1 + x2) // 2, (y1 + y2) // 2
 
             # Finger(index and thumb) distance range: 50 - 300
-            length = math.hypot(x2 - x1, y2 - y1)
+            length = geometry.distances(np.array(hand)[:, 1:], [(4, 8)])[0]
 
             if system == "Windows":
                 # update volume for windows
@@ -82,15 +73,10 @@ def main():
         cv2.rectangle(img, (50, 150), (85, 400), (255, 0, 0), 3)
         cv2.rectangle(img, (50, int(volumeBar)), (85, 400), (255, 0, 0), cv2.FILLED)
         cv2.putText(img, f"{int(volumePercentage)}%", (40, 450), cv2.FONT_HERSHEY_PLAIN, 2, (255, 0, 0), 3)
+        return img
 
-        # ===========
-
-        if success is False:
-            break
-
-        cv2.imshow("Camera", img)
-        if cv2.waitKey(1) & 0xFF == ord("q"):
-            break
+    stats = LivePipeline(process, frameShape=(CAMERA_WIDTH, CAMERA_HEIGHT)).run()
+    print(f"{stats['fps']:.1f} FPS, {stats['latencyMs']:.1f} ms end-to-end latency")
 
 
 if __name__ == "__main__":
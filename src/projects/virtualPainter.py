@@ -1,7 +1,8 @@
 import os
 import cv2
-import numpy as np
 import src.modules.handTracking as ht
+from src.modules.canvas import Canvas
+from src.modules.livePipeline import LivePipeline
 
 
 def main():
@@ -22,18 +23,15 @@ def main():
     menuHeight, menuWidth, _ = menus[0].shape
     detector = ht.HandDetector(minDetectionConfidence=0.85)
 
-    cap = cv2.VideoCapture(0)
-    cap.set(3, CAMERA_WIDTH)
-    cap.set(4, CAMERA_HEIGHT)
     color = (255, 216, 0)
 
-    imgCanvas = np.zeros((CAMERA_HEIGHT, CAMERA_WIDTH, 3), np.uint8)
+    # only the regions holding ink are composited onto each frame
+    canvas = Canvas((CAMERA_WIDTH, CAMERA_HEIGHT))
 
-    while True:
-        success, img = cap.read()
-        img = cv2.flip(img, 1)
+    def process(img):
+        nonlocal prevX, prevY, menu, color
 
-        # do stuff here
+        img = cv2.flip(img, 1)
 
         # find hand landmarks
         img, hands = detector.findHands(img)
@@ -76,34 +74,22 @@ def main():
 
                 if color == (0, 0, 0):
                     cv2.line(img, (prevX, prevY), (x1, y1), color, penThickness + 20)
-                    cv2.line(imgCanvas, (prevX, prevY), (x1, y1), color, penThickness + 20)
+                    canvas.line((prevX, prevY), (x1, y1), color, penThickness + 20)
                 else:
                     cv2.line(img, (prevX, prevY), (x1, y1), color, penThickness)
-                    cv2.line(imgCanvas, (prevX, prevY), (x1, y1), color, penThickness)
+                    canvas.line((prevX, prevY), (x1, y1), color, penThickness)
                 prevX, prevY = x1, y1
 
         # placing the menu
         img[0:menuHeight, 0:menuWidth] = menu
 
         # placing the canvas
-        imgGray = cv2.cvtColor(imgCanvas, cv2.COLOR_BGR2GRAY)
-        _, imgInv = cv2.threshold(imgGray, 50, 255, cv2.THRESH_BINARY_INV)
-        imgInv = cv2.cvtColor(imgInv, cv2.COLOR_GRAY2BGR)
-
-        img = cv2.bitwise_and(img, imgInv)
-        img = cv2.bitwise_or(img, imgCanvas)
-
-        # placing the canvas
-        # img = cv2.addWeighted(img, 0.5, imgCanvas, 0.5, 0)
-        # =============
-
-        if success is False:
-            break
+        img = canvas.compose(img)
 
-        cv2.imshow("Camera", img)
+        return img
 
-        if cv2.waitKey(1) & 0xFF == ord("q"):
-            break
+    stats = LivePipeline(process, frameShape=(CAMERA_WIDTH, CAMERA_HEIGHT)).run()
+    print(f"{stats['fps']:.1f} FPS, {stats['latencyMs']:.1f} ms end-to-end latency")
 
 
 if __name__ == "__main__":